@@ -0,0 +1,82 @@
+"""
+Lightning callback that gathers the statistics of the data pipeline shipped with the
+batches by the DataLoader workers, and logs the latency percentiles of each stage.
+"""
+# Standard libraries
+from typing import Any, Sequence
+import math
+
+# Third-party libraries
+from lightning import Callback, LightningModule, Trainer
+
+# Custom modules
+from toolbox.datasets.pipeline_profiler import PipelineProfile
+
+
+class DataPipelineProfilerCallback(Callback):
+    """
+    Merge the profiles attached to the training batches (see
+    `ObjectSegmentationDataset(profile=True)`) and periodically log a summary of them
+    through the module's logger. Nothing is done if the batches carry no profile.
+    """
+    def __init__(
+        self,
+        log_every_n_steps: int = 50,
+        quantiles: Sequence[float] = (0.5, 0.95),
+        prefix: str = "data/",
+    ) -> None:
+        """Constructor.
+
+        Args:
+            log_every_n_steps (int, optional): Number of training steps between two
+                logs. Statistics are reset after each log. Defaults to 50.
+            quantiles (Sequence[float], optional): Quantiles of the stages latencies to
+                log. Defaults to (0.5, 0.95).
+            prefix (str, optional): Prefix of the logged metrics names. Defaults to
+                "data/".
+        """
+        super().__init__()
+        
+        self._log_every_n_steps = log_every_n_steps
+        self._quantiles = tuple(quantiles)
+        self._prefix = prefix
+        
+        self._profile = PipelineProfile()
+        self._nb_steps = 0
+    
+    def on_train_batch_start(
+        self,
+        trainer: Trainer,
+        pl_module: LightningModule,
+        batch: Any,
+        batch_idx: int,
+    ) -> None:
+        """Lightning hook that is called before a training batch is processed.
+
+        Args:
+            trainer (Trainer): The trainer.
+            pl_module (LightningModule): The module being trained.
+            batch (Any): The batch of data.
+            batch_idx (int): Index of the batch.
+        """
+        profile = getattr(batch, "profile", None)
+        
+        if profile is None:
+            return
+        
+        self._profile.merge(profile)
+        self._nb_steps += 1
+        
+        if self._nb_steps < self._log_every_n_steps:
+            return
+        
+        summary = {
+            f"{self._prefix}{key}": value
+            for key, value in self._profile.summary(self._quantiles).items()
+            if not math.isnan(value)
+        }
+        pl_module.log_dict(summary, on_step=True, on_epoch=False)
+        
+        # Start a new window
+        self._profile = PipelineProfile()
+        self._nb_steps = 0
@@ -3,7 +3,7 @@ Lightning component used to load and prepare the data on which to train, validat
 test the models.
 """
 # Standard libraries
-from typing import Any, Dict, Optional
+from typing import Any, Callable, Dict, Optional
 
 # Third-party libraries
 # import torch
@@ -12,8 +12,13 @@ from torch.utils.data import DataLoader, Dataset
 from omegaconf import DictConfig, ListConfig
 
 # Custom modules
-from toolbox.datasets.segmentation_dataset import ObjectSegmentationDataset
+from toolbox.datasets.segmentation_dataset import (
+    BatchSegmentationData,
+    ObjectSegmentationDataset,
+    SegmentationDataCollator,
+)
 from toolbox.datasets.make_sets import make_iterable_scene_set
+from toolbox.geometry.pose_perturbation import PosePerturbationSampler
 import toolbox.datasets.transformations as transformations
 
 
@@ -35,6 +40,9 @@ class GSODataModule(LightningDataModule):
         dataset_cfg: Optional[DictConfig] = None,
         dataloader_cfg: Optional[DictConfig] = None,
         transformations_cfg: Optional[DictConfig] = None,
+        preallocated_collate: bool = False,
+        batch_pose_perturbation: bool = False,
+        pose_perturbation_seed: Optional[int] = None,
     ) -> None:
         """Initialize the GSODataModule.
 
@@ -49,6 +57,15 @@ class GSODataModule(LightningDataModule):
                 dataloader. Defaults to None.
             transformations_cfg (Optional[DictConfig], optional): Configuration for the
                 transformations to apply to the data. Defaults to None.
+            preallocated_collate (bool, optional): Whether to collate the samples
+                directly into a ring of preallocated (pinned) buffers instead of
+                stacking them. Defaults to False.
+            batch_pose_perturbation (bool, optional): Whether to sample the pose
+                perturbations of whole batches once they are on the device (with the
+                probability and scales of the dataset configuration) instead of one
+                sample at a time in the dataloader workers. Defaults to False.
+            pose_perturbation_seed (Optional[int], optional): Seed of the generator of
+                the batch pose perturbations. Defaults to None.
         """
         super().__init__()
 
@@ -101,11 +118,27 @@ class GSODataModule(LightningDataModule):
                     p=transformations_cfg.augmentations_p,
                 )
         
+        # Sampler of the pose perturbations of whole batches
+        self._pose_perturbation = None
+        
+        if batch_pose_perturbation and dataset_cfg is not None and\
+            dataset_cfg.get("pose_perturbation_prob", 0.0) > 0.0:
+            self._pose_perturbation = PosePerturbationSampler(
+                prob=dataset_cfg.pose_perturbation_prob,
+                rel_translation_scale=dataset_cfg.get("rel_translation_scale"),
+                abs_rotation_scale=dataset_cfg.get("abs_rotation_scale"),
+                seed=pose_perturbation_seed,
+            )
+        
         # Variables to store the datasets
         self._data_train: Optional[Dataset] = None
         self._data_val: Optional[Dataset] = None
         self._data_test: Optional[Dataset] = None
         
+        # Position of each train dataloader worker in its data stream after the last
+        # consumed batch, and positions to resume from (loaded from a checkpoint)
+        self._worker_states: Dict[int, Dict[str, Any]] = {}
+        self._resume_states: Optional[Dict[int, Dict[str, Any]]] = None
         
     def prepare_data(self) -> None:
         """
@@ -134,6 +167,12 @@ class GSODataModule(LightningDataModule):
                 **self.hparams.scene_sets_cfg.test,
             )
             
+            dataset_cfg = dict(self.hparams.dataset_cfg)
+            
+            # The pose perturbations are sampled per batch, not per sample
+            if self._pose_perturbation is not None:
+                dataset_cfg["pose_perturbation_prob"] = 0.0
+            
             # Datasets
             self._data_train = ObjectSegmentationDataset(
                 scene_set_train,
@@ -141,7 +180,9 @@ class GSODataModule(LightningDataModule):
                 background_augmentations=self._background_augmentations,
                 rgb_augmentations=self._rgb_augmentations,
                 depth_augmentations=self._depth_augmentations,
-                **self.hparams.dataset_cfg,
+                track_state=True,
+                track_state_every=self.hparams.dataloader_cfg.batch_size,
+                **dataset_cfg,
             )
             self._data_val = ObjectSegmentationDataset(
                 scene_set_val,
@@ -149,7 +190,7 @@ class GSODataModule(LightningDataModule):
                 background_augmentations=self._background_augmentations,
                 rgb_augmentations=self._rgb_augmentations,
                 depth_augmentations=self._depth_augmentations,
-                **self.hparams.dataset_cfg,
+                **dataset_cfg,
             )
             self._data_test = ObjectSegmentationDataset(
                 scene_set_test,
@@ -157,18 +198,48 @@ class GSODataModule(LightningDataModule):
                 background_augmentations=self._background_augmentations,
                 rgb_augmentations=self._rgb_augmentations,
                 depth_augmentations=self._depth_augmentations,
-                **self.hparams.dataset_cfg,
+                **dataset_cfg,
             )
             
+    def _make_collate_fn(self) -> Callable:
+        """Create the function used by the dataloaders to collate the samples.
+
+        Returns:
+            Callable: The collate function.
+        """
+        if not self.hparams.preallocated_collate:
+            return ObjectSegmentationDataset.collate_fn
+        
+        dataloader_cfg = self.hparams.dataloader_cfg
+        
+        # Batches that can be alive at the same time in a worker: the prefetched ones,
+        # the one being pinned and the one being consumed
+        prefetch_factor = dataloader_cfg.get("prefetch_factor") or 2
+        
+        image_size = None
+        if isinstance(self.hparams.transformations_cfg, DictConfig) and\
+            "resize" in self.hparams.transformations_cfg:
+            image_size = tuple(self.hparams.transformations_cfg.resize.size)
+        
+        return SegmentationDataCollator(
+            batch_size=dataloader_cfg.batch_size,
+            image_size=image_size,
+            nb_buffers=prefetch_factor + 2,
+            pin_memory=dataloader_cfg.get("pin_memory", False),
+        )
+    
     def train_dataloader(self) -> DataLoader[Any]:
         """Create and return the train dataloader.
 
         Returns:
             DataLoader[Any]: The train dataloader.
         """
+        # Resume the data streams of the workers from a checkpoint if any
+        self._data_train.resume_from(self._resume_states)
+        
         return DataLoader(
             dataset=self._data_train,
-            collate_fn=ObjectSegmentationDataset.collate_fn,
+            collate_fn=self._make_collate_fn(),
             **self.hparams.dataloader_cfg,
         )
 
@@ -180,7 +251,7 @@ class GSODataModule(LightningDataModule):
         """
         return DataLoader(
             dataset=self._data_val,
-            collate_fn=ObjectSegmentationDataset.collate_fn,
+            collate_fn=self._make_collate_fn(),
             **self.hparams.dataloader_cfg,
         )
 
@@ -192,7 +263,7 @@ class GSODataModule(LightningDataModule):
         """
         return DataLoader(
             dataset=self._data_test,
-            collate_fn=ObjectSegmentationDataset.collate_fn,
+            collate_fn=self._make_collate_fn(),
             **self.hparams.dataloader_cfg,
         )
 
@@ -206,23 +277,98 @@ class GSODataModule(LightningDataModule):
         """
         pass
 
+    def on_before_batch_transfer(
+        self,
+        batch: Any,
+        dataloader_idx: int,
+    ) -> Any:
+        """Record the position in its data stream of the worker that produced a batch
+        before the batch is transferred to the device.
+
+        Args:
+            batch (Any): The batch.
+            dataloader_idx (int): Index of the dataloader the batch comes from.
+
+        Returns:
+            Any: The batch (without its pipeline state).
+        """
+        if isinstance(batch, BatchSegmentationData) and\
+            batch.pipeline_state is not None:
+            
+            self._worker_states[batch.pipeline_state["worker_id"]] =\
+                batch.pipeline_state
+            batch.pipeline_state = None
+            
+            # The workers have resumed, the next dataloaders start new streams unless
+            # a checkpoint is loaded again
+            if self._resume_states is not None:
+                self._resume_states = None
+                self._data_train.resume_from(None)
+        
+        return batch
+    
+    def on_after_batch_transfer(
+        self,
+        batch: Any,
+        dataloader_idx: int,
+    ) -> Any:
+        """Sample the pose perturbations of a batch once it is on the device (if they
+        are sampled per batch).
+
+        Args:
+            batch (Any): The batch.
+            dataloader_idx (int): Index of the dataloader the batch comes from.
+
+        Returns:
+            Any: The batch (with its pose perturbations).
+        """
+        if isinstance(batch, BatchSegmentationData) and\
+            self._pose_perturbation is not None:
+            
+            # The bounding boxes and intrinsics are those of the resized images,
+            # which gives the same scale of translation as the original ones
+            batch.DTO = self._pose_perturbation(
+                batch.bboxes,
+                batch.K,
+                batch.TCO[:, 2, 3],
+            )
+        
+        return batch
+    
     def state_dict(self) -> Dict[Any, Any]:
-        """Implement to return the datamodule state to save in a checkpoint.
+        """Return the datamodule state to save in a checkpoint: the position of each
+        train dataloader worker in its data stream (scene set iterators and random
+        number generators) after the last consumed batch, and the state of the
+        generator of the batch pose perturbations.
 
         Returns:
             Dict[Any, Any]: A dictionary containing the datamodule state that you want
                 to save.
         """
-        return {}
+        state = {"worker_states": dict(self._worker_states)}
+        
+        if self._pose_perturbation is not None:
+            state["pose_perturbation"] = self._pose_perturbation.state_dict()
+        
+        return state
 
     def load_state_dict(self, state_dict: Dict[str, Any]) -> None:
-        """Implement to load the datamodule state from a checkpoint.
+        """Load the datamodule state from a checkpoint. The train dataloader workers
+        resume their data streams from the saved positions. The samples that were in the
+        shuffle and prefetch buffers when the checkpoint was saved are not replayed.
 
         Args:
             state_dict (Dict[str, Any]): The datamodule state returned by
                 `self.state_dict()`.
         """
-        pass
+        worker_states = state_dict.get("worker_states")
+        
+        self._resume_states = dict(worker_states) if worker_states else None
+        self._worker_states = dict(worker_states) if worker_states else {}
+        
+        if self._pose_perturbation is not None and\
+            state_dict.get("pose_perturbation") is not None:
+            self._pose_perturbation.load_state_dict(state_dict["pose_perturbation"])
     
     @staticmethod
     def _set_transformations(
@@ -30,6 +30,7 @@ class ObjectSegmentationModel(nn.Module):
         sam_checkpoint: Optional[str] = None,
         object_set_cfg: Optional[DictConfig] = None,
         compile: bool = False,
+        rendering_lod_iou_tolerance: Optional[float] = None,
     ) -> None:
         """Constructor.
 
@@ -49,6 +50,10 @@ class ObjectSegmentationModel(nn.Module):
                 Defaults to None.
             compile (bool, optional): Whether to compile the MobileSAM module. Defaults
                 to False.
+            rendering_lod_iou_tolerance (Optional[float], optional): Tolerance on the
+                silhouette IoU used to render objects with decimated levels of detail
+                of their meshes. If None, the full meshes are rendered. Defaults to
+                None.
         """
         super().__init__()
         
@@ -62,7 +67,8 @@ class ObjectSegmentationModel(nn.Module):
             self._contour_rendering_module = ContourRendering(
                 object_set=object_set,
                 image_size=tuple(image_size),
-                debug=True
+                debug=True,
+                lod_iou_tolerance=rendering_lod_iou_tolerance,
             )
 
             # Instantiate the MobileSAM module
@@ -93,17 +99,12 @@ class ObjectSegmentationModel(nn.Module):
         if self._use_gt_masks:
             binary_masks = x.masks.unsqueeze(1)
         else:
-            # Render objects of the batch, extract outer contours points
-            contour_points_list = self._contour_rendering_module(x)
+            # Render objects of the batch and compute the bounding boxes of their
+            # silhouettes on the device
+            bboxes = self._contour_rendering_module.render_bboxes(x)
 
-            # Predict masks, scores and logits using the MobileSAM model
-            mobile_sam_outputs = self._mobile_sam(x.rgbs, contour_points_list)
-
-            # Stack the masks from the MobileSAM outputs
-            binary_masks = torch.stack([
-                output["masks"][:, torch.argmax(output["iou_predictions"])]
-                for output in mobile_sam_outputs
-            ])
+            # Predict the masks of the batch using the MobileSAM model
+            binary_masks, _ = self._mobile_sam(x.rgbs, bboxes=bboxes)
         
         # Get RGB images
         rgb_images = x.rgbs
@@ -0,0 +1,83 @@
+"""
+This script bakes the meshes of an object set into binary files (scale of the objects
+pre-applied, memory-mappable) which are loaded much faster than the original meshes.
+`make_object_set` uses the baked meshes automatically when they are present and up to
+date.
+
+Example:
+    python src/scripts/bake_meshes.py --object_set_name gso.normalized_decimated \
+        --object_set_dir data/webdatasets/google_scanned_objects
+"""
+# Standard libraries
+import argparse
+import pathlib
+import sys
+
+# Add the src directory to the system path
+# (to avoid having to install project as a package)
+sys.path.append("src/")
+
+# Third-party libraries
+from tqdm import tqdm
+
+# Custom modules
+from toolbox.datasets.make_sets import make_object_set
+from toolbox.datasets.baked_mesh import bake_object, default_baked_dir
+
+
+# Create an argument parser
+parser = argparse.ArgumentParser(
+    description="Bake the meshes of an object set into binary memory-mappable files."
+)
+parser.add_argument(
+    "--object_set_name",
+    type=str,
+    default="gso.normalized_decimated",
+    help="Name of the object set (e.g. gso.normalized_decimated, bcot, rbot).",
+)
+parser.add_argument(
+    "--object_set_dir",
+    type=str,
+    default="data/webdatasets/google_scanned_objects/",
+    help="Path to the object set directory.",
+)
+parser.add_argument(
+    "--baked_dir",
+    type=str,
+    default=None,
+    help="Path to the directory of the baked meshes. Defaults to a directory next to "
+    "the object set directory.",
+)
+parser.add_argument(
+    "--overwrite",
+    action="store_true",
+    help="Bake the meshes again even if their baked files are up to date.",
+)
+
+# Parse the arguments
+args = parser.parse_args()
+
+
+# Load the object set with its original meshes
+object_set = make_object_set(
+    args.object_set_name,
+    args.object_set_dir,
+    use_baked=False,
+)
+
+# Directory of the baked meshes
+baked_dir = pathlib.Path(args.baked_dir) if args.baked_dir is not None\
+    else default_baked_dir(args.object_set_dir, args.object_set_name)
+
+nb_baked = 0
+
+# Iterate over all the objects of the set
+for obj in tqdm(object_set.objects):
+
+    if bake_object(obj, baked_dir, overwrite=args.overwrite) is not None:
+        nb_baked += 1
+
+print(
+    f"Baked {nb_baked} meshes ({len(object_set) - nb_baked} up to date) "
+    f"in {baked_dir}"
+)
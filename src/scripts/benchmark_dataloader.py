@@ -0,0 +1,285 @@
+"""
+Script to measure how fast the GSO datamodule can feed a model. It sweeps the number of
+dataloader workers, the batch size and augmentation presets, and appends the results
+(samples/s, per-stage latencies, workers CPU usage and memory) to a JSON lines file so
+that regressions can be compared across commits.
+
+Example (on a local shard set):
+    python src/scripts/benchmark_dataloader.py data=train/gso_5 \
+        paths.data_dir=/path/to/local/webdatasets
+"""
+# Standard libraries
+from importlib.util import find_spec
+from itertools import product
+from pathlib import Path
+from typing import Any, Dict, List
+import json
+import sys
+import time
+
+# Add the src directory to the system path
+# (to avoid having to install project as a package)
+sys.path.append("src/")
+
+# Third-party libraries
+import hydra
+from omegaconf import DictConfig, OmegaConf
+from lightning import LightningDataModule
+
+# Custom modules
+from toolbox.utils.pylogger import RankedLogger
+from toolbox.datasets.pipeline_profiler import PipelineProfile
+from toolbox.utils.git_utils import get_commit_hash
+
+
+log = RankedLogger(__name__, rank_zero_only=True)
+
+# Config groups of the lists of augmentations
+AUGMENTATIONS_DIR =\
+    Path(__file__).resolve().parents[2] / "configs/data/transformations_cfg"
+
+
+class ProcessTreeMonitor:
+    """
+    Measure the CPU time and resident memory of the current process and of its children
+    (the dataloader workers). It relies on psutil, which is optional.
+    """
+    def __init__(self) -> None:
+        """Constructor."""
+        self._process = None
+
+        if find_spec("psutil"):
+            import psutil
+            self._process = psutil.Process()
+        else:
+            log.warning("psutil is not installed, CPU and memory are not measured.")
+
+        self._cpu_start = None
+
+    def _processes(self) -> list:
+        """Get the current process and its children.
+
+        Returns:
+            list: List of psutil processes.
+        """
+        return [self._process] + self._process.children(recursive=True)
+
+    def _cpu_times(self) -> Dict[int, float]:
+        """Get the CPU time consumed so far by each process of the tree.
+
+        Returns:
+            Dict[int, float]: CPU time (user + system, in seconds) per pid.
+        """
+        cpu_times = {}
+
+        for process in self._processes():
+            try:
+                times = process.cpu_times()
+                cpu_times[process.pid] = times.user + times.system
+            except Exception:
+                # The process may have exited in the meantime
+                continue
+
+        return cpu_times
+
+    def start(self) -> None:
+        """
+        Start measuring the CPU time.
+        """
+        if self._process is not None:
+            self._cpu_start = self._cpu_times()
+
+    def stop(self, elapsed_time: float) -> Dict[str, Any]:
+        """Stop measuring and report the CPU usage and memory of the process tree.
+
+        Args:
+            elapsed_time (float): Wall-clock time elapsed since `start` (in seconds).
+
+        Returns:
+            Dict[str, Any]: CPU usage of the main process and of the workers (in
+                percent of one core), and their resident memory (in MiB).
+        """
+        if self._process is None:
+            return {}
+
+        cpu_end = self._cpu_times()
+
+        def cpu_usage(pid: int) -> float:
+            return 100 * (cpu_end[pid] - self._cpu_start.get(pid, 0.0)) / elapsed_time
+
+        main_pid = self._process.pid
+        worker_pids = [pid for pid in cpu_end if pid != main_pid]
+
+        rss = {}
+        for process in self._processes():
+            try:
+                rss[process.pid] = process.memory_info().rss / 2**20
+            except Exception:
+                continue
+
+        return {
+            "main_cpu_percent": cpu_usage(main_pid),
+            "workers_cpu_percent": [cpu_usage(pid) for pid in worker_pids],
+            "main_rss_mib": rss.get(main_pid),
+            "workers_rss_mib": [rss[pid] for pid in worker_pids if pid in rss],
+        }
+
+
+def make_data_cfg(
+    cfg: DictConfig,
+    num_workers: int,
+    batch_size: int,
+    augmentation_preset: str,
+) -> DictConfig:
+    """Create the datamodule configuration of a point of the sweep.
+
+    Args:
+        cfg (DictConfig): Configuration of the benchmark.
+        num_workers (int): Number of dataloader workers.
+        batch_size (int): Batch size.
+        augmentation_preset (str): Name of the augmentation preset, whose lists of
+            augmentations replace those of the transformations configuration.
+
+    Returns:
+        DictConfig: The datamodule configuration.
+    """
+    data_cfg = OmegaConf.create(OmegaConf.to_container(cfg.data, resolve=True))
+
+    data_cfg.dataloader_cfg.num_workers = num_workers
+    data_cfg.dataloader_cfg.batch_size = batch_size
+
+    # The DataLoader rejects these options when loading in the main process
+    if num_workers == 0:
+        data_cfg.dataloader_cfg.persistent_workers = False
+        data_cfg.dataloader_cfg.pop("prefetch_factor", None)
+
+    # Record the latencies of the data pipeline stages
+    data_cfg.dataset_cfg.profile = True
+    data_cfg.dataset_cfg.profile_report_every = batch_size
+
+    # Set every list of augmentations, whatever the data config enables
+    preset = cfg.augmentation_presets[augmentation_preset]
+
+    for augmentations, option in preset.items():
+        data_cfg.transformations_cfg[augmentations] = None if option is None else\
+            OmegaConf.load(AUGMENTATIONS_DIR / augmentations / f"{option}.yaml")
+
+    return data_cfg
+
+
+def benchmark(cfg: DictConfig, data_cfg: DictConfig) -> Dict[str, Any]:
+    """Measure the throughput of the training dataloader of a datamodule.
+
+    Args:
+        cfg (DictConfig): Configuration of the benchmark.
+        data_cfg (DictConfig): Configuration of the datamodule.
+
+    Returns:
+        Dict[str, Any]: Measured throughput, data pipeline statistics and resources
+            usage.
+    """
+    datamodule: LightningDataModule = hydra.utils.instantiate(data_cfg)
+    datamodule.setup("fit")
+
+    dataloader = datamodule.train_dataloader()
+    iterator = iter(dataloader)
+
+    # Wait for the workers to start and the shuffle buffers to fill
+    for _ in range(cfg.nb_warmup_batches):
+        next(iterator)
+
+    monitor = ProcessTreeMonitor()
+    profile = PipelineProfile()
+    nb_samples = 0
+
+    monitor.start()
+    start = time.perf_counter()
+
+    for _ in range(cfg.nb_batches):
+        batch = next(iterator)
+        nb_samples += batch.batch_size
+
+        if batch.profile is not None:
+            profile.merge(batch.profile)
+
+    elapsed_time = time.perf_counter() - start
+
+    results = {
+        "nb_samples": nb_samples,
+        "elapsed_time_s": elapsed_time,
+        "samples_per_s": nb_samples / elapsed_time,
+        "pipeline": profile.summary(cfg.quantiles),
+        **monitor.stop(elapsed_time),
+    }
+
+    # Shut the workers down before the next point of the sweep
+    del iterator, dataloader
+
+    return results
+
+
+def benchmark_sweep(cfg: DictConfig) -> List[Dict[str, Any]]:
+    """Run the benchmark for every point of the sweep.
+
+    Args:
+        cfg (DictConfig): DictConfig object containing the configuration parameters.
+
+    Returns:
+        List[Dict[str, Any]]: Results of each point of the sweep.
+    """
+    commit = get_commit_hash()
+    output_file = Path(cfg.output_file)
+    output_file.parent.mkdir(parents=True, exist_ok=True)
+
+    all_results = []
+
+    for num_workers, batch_size, augmentation_preset in product(
+        cfg.sweep.num_workers,
+        cfg.sweep.batch_size,
+        cfg.sweep.augmentation_presets,
+    ):
+        log.info(
+            f"Benchmarking <num_workers={num_workers}, batch_size={batch_size}, "
+            f"augmentations={augmentation_preset}>"
+        )
+        data_cfg = make_data_cfg(cfg, num_workers, batch_size, augmentation_preset)
+
+        results = {
+            "commit": commit,
+            "timestamp": time.time(),
+            "data": cfg.data.scene_sets_cfg.train.sets_cfg[0].name,
+            "num_workers": num_workers,
+            "batch_size": batch_size,
+            "augmentation_preset": augmentation_preset,
+            **benchmark(cfg, data_cfg),
+        }
+        log.info(f"{results['samples_per_s']:.1f} samples/s")
+
+        # Append the results as soon as they are available
+        with open(output_file, "a") as f:
+            f.write(json.dumps(results) + "\n")
+
+        all_results.append(results)
+
+    log.info(f"Results saved to {output_file}")
+
+    return all_results
+
+
+@hydra.main(version_base="1.3",
+            config_path="../../configs/",
+            config_name="benchmark_dataloader.yaml")
+def main(cfg: DictConfig):
+    """Main entry point for the dataloader benchmark.
+
+    Args:
+        cfg (DictConfig): DictConfig object containing the configuration parameters.
+    """
+    # Benchmark the dataloader
+    benchmark_sweep(cfg)
+
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,331 @@
+"""
+Script to measure the latency of each component of the segmentation path: the one-off
+cost paid when an object is (re)initialized (MobileSAM, as run by `MobileSAM.forward`,
+and prediction of the parameters of the pixel segmentation model from the first frame,
+also timed alone on precomputed MobileSAM masks) and the per-frame cost paid while
+tracking (`ObjectSegmentationPredictionModel.forward` with
+`pixel_segmentation_only=True`). The pixel segmentation variants (histograms,
+lookup table predicted by a network, MLP) are measured for several numbers of intra-op
+threads, and the results (latency quantiles and memory) are appended to a JSON lines
+file.
+
+Example (on RBOT frames):
+    python src/scripts/benchmark_segmentation.py frames=rbot sweep.num_threads=[1,4]
+"""
+# Standard libraries
+from typing import Any, Dict, List, Tuple
+from pathlib import Path
+import json
+import sys
+import time
+
+# Add the src directory to the system path
+# (to avoid having to install project as a package)
+sys.path.append("src/")
+
+# Third-party libraries
+import hydra
+from omegaconf import DictConfig
+import numpy as np
+import torch
+
+# Custom modules
+from toolbox.utils.pylogger import RankedLogger
+from toolbox.utils.latency import measure_latency
+from toolbox.utils.git_utils import get_commit_hash
+from toolbox.modules.mobile_sam_module import MobileSAM
+from toolbox.modules.object_segmentation_prediction_module import (
+    BatchInferenceData,
+    ObjectSegmentationPredictionModel,
+)
+
+
+log = RankedLogger(__name__, rank_zero_only=True)
+
+
+def load_frames(cfg: DictConfig) -> torch.Tensor:
+    """Load the frames the components are applied to.
+
+    Args:
+        cfg (DictConfig): Configuration of the benchmark.
+
+    Raises:
+        ValueError: If the source of the frames is unknown.
+
+    Returns:
+        torch.Tensor: Batch of RGB frames, of shape (B, 3, H, W) (uint8).
+    """
+    if cfg.frames == "synthetic":
+        generator = torch.Generator().manual_seed(0)
+        return torch.randint(
+            0,
+            256,
+            (cfg.batch_size, 3, *cfg.image_size),
+            dtype=torch.uint8,
+            generator=generator,
+        )
+
+    elif cfg.frames == "rbot":
+        # Frames of the first sequence of the dataset
+        dataset = hydra.utils.instantiate(cfg.rbot_dataset)
+        rgbs = dataset[0].rgbs
+
+        return rgbs[torch.arange(cfg.batch_size) % len(rgbs)]
+
+    raise ValueError(f"Unknown frames source: {cfg.frames}")
+
+
+def box_prompts(rgbs: torch.Tensor) -> Tuple[torch.Tensor, List[List[np.ndarray]]]:
+    """Make prompts covering the center of the frames (the content of the prompts does
+    not change the latency of the components).
+
+    Args:
+        rgbs (torch.Tensor): Batch of RGB frames, of shape (B, 3, H, W).
+
+    Returns:
+        Tuple[torch.Tensor, List[List[np.ndarray]]]: Boxes in the format [xmin, ymin,
+            xmax, ymax], of shape (B, 4), and the corresponding contours (one contour
+            of shape (4, 2) per frame).
+    """
+    bsz, _, height, width = rgbs.shape
+    x0, y0, x1, y1 = width // 4, height // 4, 3 * width // 4, 3 * height // 4
+
+    bboxes = torch.tensor(
+        [x0, y0, x1, y1],
+        dtype=torch.float32,
+        device=rgbs.device,
+    ).repeat(bsz, 1)
+
+    contour = np.array([[x0, y0], [x1, y0], [x1, y1], [x0, y1]], dtype=np.float32)
+    contour_points_list = [[contour] for _ in range(bsz)]
+
+    return bboxes, contour_points_list
+
+
+@torch.no_grad()
+def benchmark_mobile_sam(
+    cfg: DictConfig,
+    rgbs: torch.Tensor,
+    bboxes: torch.Tensor,
+) -> Dict[str, Dict[str, float]]:
+    """Measure the latency of `MobileSAM.forward`, and of its image encoder and mask
+    decoder on the inputs it prepares (the embedding cache is disabled, so that every
+    call runs the encoder).
+
+    Args:
+        cfg (DictConfig): Configuration of the benchmark.
+        rgbs (torch.Tensor): Batch of RGB frames, of shape (B, 3, H, W).
+        bboxes (torch.Tensor): Prompt boxes, of shape (B, 4).
+
+    Returns:
+        Dict[str, Dict[str, float]]: Latency and memory of each component.
+    """
+    sam = MobileSAM(
+        sam_checkpoint=cfg.sam_checkpoint,
+        roi_padding=cfg.sam_roi_padding,
+    )
+    sam.to(cfg.device)
+    sam.eval()
+
+    original_size = rgbs.shape[2:]
+
+    # Inputs of the encoder and of the decoder, as prepared by the forward pass
+    resized_imgs, input_bboxes, regions = sam._prepare_inputs(rgbs, bboxes)
+    embeddings = sam._encode(resized_imgs)
+
+    def decode() -> torch.Tensor:
+        low_res_masks, _ = sam._decode(embeddings, input_bboxes)
+        return sam._postprocess(
+            low_res_masks,
+            resized_imgs.shape[2:],
+            original_size,
+            regions,
+        )
+
+    latency_kwargs = {
+        "device": cfg.device,
+        "nb_warmup_iterations": cfg.nb_warmup_iterations,
+        "nb_iterations": cfg.nb_iterations,
+        "quantiles": cfg.quantiles,
+    }
+
+    results = {
+        "mobile_sam": measure_latency(
+            lambda: sam(rgbs, bboxes=bboxes),
+            **latency_kwargs,
+        ),
+        "mobile_sam_encoder": measure_latency(
+            lambda: sam._encode(resized_imgs),
+            **latency_kwargs,
+        ),
+        "mobile_sam_decoder": measure_latency(decode, **latency_kwargs),
+    }
+
+    del sam, embeddings
+
+    return results
+
+
+def make_model(
+    cfg: DictConfig,
+    variant_cfg: DictConfig,
+) -> ObjectSegmentationPredictionModel:
+    """Instantiate the prediction model of a variant of the pixel segmentation.
+
+    Args:
+        cfg (DictConfig): Configuration of the benchmark.
+        variant_cfg (DictConfig): Configuration of the probabilistic segmentation
+            model.
+
+    Returns:
+        ObjectSegmentationPredictionModel: The model (on the benchmark device).
+    """
+    model = ObjectSegmentationPredictionModel(
+        probabilistic_segmentation_model=hydra.utils.instantiate(variant_cfg),
+        sam_checkpoint=cfg.sam_checkpoint,
+        sam_roi_padding=cfg.sam_roi_padding,
+    )
+    model.to(cfg.device)
+    model.eval()
+
+    return model
+
+
+@torch.no_grad()
+def benchmark_variant(
+    cfg: DictConfig,
+    model: ObjectSegmentationPredictionModel,
+    x: BatchInferenceData,
+) -> Dict[str, Dict[str, float]]:
+    """Measure the latency of a prediction model.
+
+    Args:
+        cfg (DictConfig): Configuration of the benchmark.
+        model (ObjectSegmentationPredictionModel): The prediction model.
+        x (BatchInferenceData): Frames and contours of the objects.
+
+    Returns:
+        Dict[str, Dict[str, float]]: Latency and memory of the whole initialization
+            from the first frame ("initialization": MobileSAM, then the probabilistic
+            segmentation model), of the probabilistic segmentation model alone on
+            precomputed MobileSAM masks ("parameter_prediction": prediction of the
+            parameters of the pixel segmentation and segmentation of the first frame)
+            and of the segmentation of a frame with the predicted parameters
+            ("pixel_segmentation").
+    """
+    latency_kwargs = {
+        "device": cfg.device,
+        "nb_warmup_iterations": cfg.nb_warmup_iterations,
+        "nb_iterations": cfg.nb_iterations,
+        "quantiles": cfg.quantiles,
+    }
+
+    # MobileSAM masks of the first frames, computed once
+    model(x)
+    binary_masks = model.binary_masks
+
+    return {
+        "initialization": measure_latency(lambda: model(x), **latency_kwargs),
+        "parameter_prediction": measure_latency(
+            lambda: model._probabilistic_segmentation_model(x.rgbs, binary_masks),
+            **latency_kwargs,
+        ),
+        # The parameters predicted from the first frame are kept by the model
+        "pixel_segmentation": measure_latency(
+            lambda: model(x, pixel_segmentation_only=True)            **latency_kwargs,
+        ),
+    }
+
+
+def benchmark_segmentation(cfg: DictConfig) -> List[Dict[str, Any]]:
+    """Run the benchmark of every component.
+
+    Args:
+        cfg (DictConfig): DictConfig object containing the configuration parameters.
+
+    Returns:
+        List[Dict[str, Any]]: Results of each component (and number of threads).
+    """
+    output_file = Path(cfg.output_file)
+    output_file.parent.mkdir(parents=True, exist_ok=True)
+
+    rgbs = load_frames(cfg).to(cfg.device)
+    bboxes, contour_points_list = box_prompts(rgbs)
+    x = BatchInferenceData(rgbs=rgbs, contour_points_list=contour_points_list)
+
+    context = {
+        "commit": get_commit_hash(),
+        "timestamp": time.time(),
+        "device": str(cfg.device),
+        "frames": cfg.frames,
+        "image_size": list(rgbs.shape[2:]),
+        "batch_size": len(rgbs),
+    }
+
+    all_results = []
+
+    def record(component: str, variant: str, num_threads: int, results: Dict) -> None:
+        log.info(
+            f"{component} <variant={variant}, num_threads={num_threads}>: "
+            + ", ".join(
+                f"{key}={value:.2f}" for key, value in results.items()
+                if key.endswith("_ms")
+            )
+        )
+        results = {
+            **context,
+            "component": component,
+            "variant": variant,
+            "num_threads": num_threads,
+            **results,
+        }
+
+        # Append the results as soon as they are available
+        with open(output_file, "a") as f:
+            f.write(json.dumps(results) + "\n")
+
+        all_results.append(results)
+
+    # MobileSAM only runs when an object is (re)initialized
+    if cfg.benchmark_mobile_sam:
+        log.info("Benchmarking MobileSAM")
+        for component, results in benchmark_mobile_sam(cfg, rgbs, bboxes).items():
+            record(component, "vit_t", torch.get_num_threads(), results)
+
+    # Pixel segmentation variants (instantiated once for all the numbers of threads)
+    models = {
+        variant: make_model(cfg, variant_cfg)
+        for variant, variant_cfg in cfg.variants.items()
+    }
+
+    for num_threads in cfg.sweep.num_threads:
+        torch.set_num_threads(num_threads)
+
+        for variant, model in models.items():
+            log.info(f"Benchmarking <variant={variant}, num_threads={num_threads}>")
+
+            for component, results in benchmark_variant(cfg, model, x).items():
+                record(component, variant, num_threads, results)
+
+    log.info(f"Results saved to {output_file}")
+
+    return all_results
+
+
+@hydra.main(version_base="1.3",
+            config_path="../../configs/",
+            config_name="benchmark_segmentation.yaml")
+def main(cfg: DictConfig):
+    """Main entry point for the segmentation benchmark.
+
+    Args:
+        cfg (DictConfig): DictConfig object containing the configuration parameters.
+    """
+    # Benchmark the segmentation components
+    benchmark_segmentation(cfg)
+
+    return
+
+
+if __name__ == "__main__":
+    main()
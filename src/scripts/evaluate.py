@@ -14,9 +14,18 @@ sys.path.append("src/")
 # Third-party libraries
 import hydra
 from omegaconf import DictConfig
+import pyarrow.compute as pc
 import torch
-from tqdm import tqdm
-import numpy as np
+
+# Custom modules
+from toolbox.evaluation.parallel_evaluation import (
+    HISTOGRAMS_FILE,
+    RESULTS_FILE,
+    evaluate_in_parallel,
+    evaluate_shard,
+    merge_histograms,
+    merge_results,
+)
 
 
 def evaluate(cfg: DictConfig):
@@ -25,48 +34,65 @@ def evaluate(cfg: DictConfig):
     Args:
         cfg (DictConfig): DictConfig object containing the configuration parameters.
     """
-    # Set the device
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    
-    # Instantiate the dataloader
-    dataloader: torch.utils.data.DataLoader = hydra.utils.instantiate(cfg.data)
-    
-    # Instantiate the model
-    model: torch.nn.Module = hydra.utils.instantiate(cfg.model)
-    model.to(device)
-    
-    # Set the model to evaluation mode
-    model.eval()
-    
-    # Array to store the results
-    results = np.empty((len(dataloader), 4), dtype="<U32")
-    
     # Get logs directory
     runs_dir = pathlib.Path("logs/evaluate/runs")
     logs_dir = sorted(runs_dir.iterdir())[-1]
     
-    # Go through the batches
-    for i, batch in enumerate(tqdm(dataloader)):
+    if cfg.nb_workers > 0:
+        # Shard the sequences across worker processes (on CPU), each with its own
+        # model replica
+        results = evaluate_in_parallel(
+            cfg,
+            results_dir=logs_dir,
+            nb_workers=cfg.nb_workers,
+            nb_threads_per_worker=cfg.nb_threads_per_worker,
+        )
+    else:
+        # Set the device
+        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         
-        # Send the batch to the GPU if it is available
-        batch = batch.to(device)
-        
-        # Perform the forward pass
-        error, optimal_error = model(batch)
+        # Evaluate all the sequences in the main process
+        evaluate_shard(
+            cfg,
+            shard=0,
+            nb_shards=1,
+            results_dir=logs_dir,
+            device=device,
+        )
+        results = merge_results(logs_dir)
+    
+    # None if no sequence has been evaluated
+    mean_error = pc.mean(results.column("error")).as_py()
+    
+    print(
+        f"Evaluated {results.num_rows} sequences, mean error: "
+        f"{mean_error if mean_error is not None else float('nan'):.4f} "
+        f"(results saved in {logs_dir / RESULTS_FILE})"
+    )
+    
+    # Metrics of all the evaluated pixels at several thresholds
+    histograms = merge_histograms(logs_dir)
+    
+    if histograms is not None:
+        thresholds = [0.1 * i for i in range(1, 10)]
+        ious = histograms.iou(thresholds)
+        precision_recall = histograms.precision_recall(thresholds)
         
-        # Store the results
-        results[i] = np.array([[
-            batch.object_labels[0],
-            batch.scene_labels[0],
-            error.item(),
-            optimal_error.item() if optimal_error is not None else "N/A",
-        ]])
+        for threshold, iou, precision, recall in zip(
+            thresholds,
+            ious.tolist(),
+            precision_recall["precision"].tolist(),
+            precision_recall["recall"].tolist(),
+        ):
+            print(
+                f"Threshold {threshold:.1f}: IoU {iou:.4f}, precision "
+                f"{precision:.4f}, recall {recall:.4f}"
+            )
         
-        # Save the results
-        if i % 50 == 0:
-            np.save(logs_dir / "results.npy", results)
-    
-    np.save(logs_dir / "results.npy", results)
+        print(
+            f"Expected calibration error: {float(histograms.calibration()['ece']):.4f} "
+            f"(histograms saved in {logs_dir / HISTOGRAMS_FILE})"
+        )
         
     return
 
@@ -0,0 +1,184 @@
+"""
+This script makes the levels of detail of the meshes of an object set: each mesh is
+decimated to several numbers of faces using MeshLab's quadric edge collapse decimation
+algorithm (with the settings of `scripts/meshlab/decimate_meshes.py`), the decimated
+meshes are baked (scale of the objects pre-applied), and their silhouettes are compared
+with the silhouettes of the full meshes at several projected diameters. The renderers
+use these measures to pick the coarsest level which is accurate enough for the size of
+an object on screen.
+
+Example:
+    python src/scripts/make_mesh_lods.py --object_set_name gso.normalized \
+        --object_set_dir data/webdatasets/google_scanned_objects \
+        --num_faces 20000 5000 1000 250
+"""
+# Standard libraries
+import argparse
+import pathlib
+import sys
+
+# Add the src directory to the system path
+# (to avoid having to install project as a package)
+sys.path.append("src/")
+
+# Third-party libraries
+import numpy as np
+import pymeshlab
+from pytorch3d.structures import Meshes
+from tqdm import tqdm
+
+# Custom modules
+from toolbox.datasets.make_sets import make_object_set
+from toolbox.datasets.baked_mesh import (
+    is_baked_mesh_up_to_date,
+    load_scaled_mesh,
+    read_baked_mesh,
+    write_baked_mesh,
+)
+from toolbox.datasets.mesh_lod import (
+    default_lods_dir,
+    lod_mesh_path,
+    read_lods_index,
+    write_lods_index,
+)
+from toolbox.modules.lod_selection import calibrate_lod
+
+
+# Create an argument parser
+parser = argparse.ArgumentParser(
+    description="Decimate the meshes of an object set into several levels of detail, "
+    "and measure the accuracy of their silhouettes."
+)
+parser.add_argument(
+    "--object_set_name",
+    type=str,
+    default="gso.normalized",
+    help="Name of the object set (e.g. gso.normalized, bcot, rbot).",
+)
+parser.add_argument(
+    "--object_set_dir",
+    type=str,
+    default="data/webdatasets/google_scanned_objects/",
+    help="Path to the object set directory.",
+)
+parser.add_argument(
+    "--lods_dir",
+    type=str,
+    default=None,
+    help="Path to the directory of the levels of detail. Defaults to a directory next "
+    "to the object set directory.",
+)
+parser.add_argument(
+    "--num_faces",
+    type=int,
+    nargs="+",
+    default=[5000, 1000, 250],
+    help="Target numbers of faces of the levels of detail.",
+)
+parser.add_argument(
+    "--pixel_diameters",
+    type=float,
+    nargs="+",
+    default=[16, 32, 64, 128, 256, 512],
+    help="Projected diameters of the objects (pixels) at which the silhouettes of the "
+    "levels of detail are compared with the silhouettes of the full meshes.",
+)
+parser.add_argument(
+    "--nb_views",
+    type=int,
+    default=16,
+    help="Number of viewpoints from which the silhouettes are compared.",
+)
+parser.add_argument(
+    "--overwrite",
+    action="store_true",
+    help="Decimate the meshes again even if their levels of detail are up to date.",
+)
+
+# Parse the arguments
+args = parser.parse_args()
+
+
+# Load the object set (levels of detail are made from the full meshes)
+object_set = make_object_set(args.object_set_name, args.object_set_dir)
+
+# Directory of the levels of detail
+lods_dir = pathlib.Path(args.lods_dir) if args.lods_dir is not None\
+    else default_lods_dir(args.object_set_dir, args.object_set_name)
+
+pixel_diameters = sorted(args.pixel_diameters)
+
+# Measures made with other projected diameters cannot be reused
+index = read_lods_index(lods_dir)
+if index["pixel_diameters"] != pixel_diameters:
+    index = {"pixel_diameters": pixel_diameters, "objects": {}}
+
+# Set the decimation configuration
+decimation_cfg = {
+    "preserveboundary": True,
+}
+
+# Create a new MeshSet object
+ms = pymeshlab.MeshSet()
+
+# Iterate over all the objects of the set
+for obj in tqdm(object_set.objects):
+
+    # The projected size of objects of unknown diameter cannot be computed
+    if obj.mesh_diameter is None:
+        continue
+
+    verts, faces = load_scaled_mesh(obj)
+    mesh = Meshes(verts=[verts], faces=[faces])
+
+    levels = []
+
+    for num_faces in sorted(args.num_faces, reverse=True):
+
+        # Decimating would not reduce the number of faces
+        if num_faces >= len(faces):
+            continue
+
+        path = lod_mesh_path(lods_dir, num_faces, obj.label)
+
+        if args.overwrite or not is_baked_mesh_up_to_date(path, obj):
+
+            # Decimate the scaled mesh
+            ms.clear()
+            ms.add_mesh(pymeshlab.Mesh(
+                vertex_matrix=verts.numpy().astype(np.float64),
+                face_matrix=faces.numpy().astype(np.int32),
+            ))
+            ms.meshing_decimation_quadric_edge_collapse(
+                targetfacenum=num_faces,
+                **decimation_cfg,
+            )
+
+            write_baked_mesh(
+                path,
+                ms.current_mesh().vertex_matrix(),
+                ms.current_mesh().face_matrix(),
+                obj.scale,
+            )
+
+        lod_verts, lod_faces = read_baked_mesh(path)
+        lod_mesh = Meshes(
+            verts=[verts.new_tensor(lod_verts)],
+            faces=[faces.new_tensor(lod_faces)],
+        )
+
+        # Compare the silhouettes of the level with those of the full mesh
+        ious = calibrate_lod(
+            mesh,
+            lod_mesh,
+            diameter=obj.mesh_diameter * obj.scale,
+            pixel_diameters=pixel_diameters,
+            nb_views=args.nb_views,
+        )
+        levels.append({"nb_faces": num_faces, "ious": ious})
+
+    index["objects"][obj.label] = levels
+
+write_lods_index(lods_dir, index)
+
+print(f"Made the levels of detail of {len(index['objects'])} objects in {lods_dir}")
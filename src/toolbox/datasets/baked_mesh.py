@@ -0,0 +1,280 @@
+"""
+Binary pre-baked meshes. Parsing OBJ files is slow, so the meshes of an object set can
+be baked once into a simple binary format (header, float32 vertices, int32 faces) with
+the scale of the object already applied. Baked meshes are memory-mapped when loaded.
+"""
+# Standard libraries
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+# Third-party libraries
+import numpy as np
+import torch
+from pytorch3d.io import load_objs_as_meshes
+from pytorch3d.structures import Meshes
+
+# Custom modules
+from toolbox.datasets.object_set import RigidObject, RigidObjectSet
+
+
+BAKED_MESH_SUFFIX = ".bin"
+
+# Header of a baked mesh file
+_MAGIC = b"TBXMESH1"
+_HEADER_DTYPE = np.dtype([
+    ("magic", "S8"),
+    ("nb_verts", "<u8"),
+    ("nb_faces", "<u8"),
+    ("scale", "<f8"),
+])
+_VERTS_DTYPE = np.dtype("<f4")
+_FACES_DTYPE = np.dtype("<i4")
+
+
+def default_baked_dir(object_set_dir: Path, name: str) -> Path:
+    """Get the default directory of the baked meshes of an object set. It is a sibling
+    of the object set directory so that the baked files are not mistaken for models.
+
+    Args:
+        object_set_dir (Path): Location of the object set directory.
+        name (str): Name of the object set.
+
+    Returns:
+        Path: Directory of the baked meshes.
+    """
+    object_set_dir = Path(object_set_dir)
+
+    return object_set_dir.parent / f"{object_set_dir.name}_baked" / name
+
+
+def baked_mesh_path(baked_dir: Path, label: str) -> Path:
+    """Get the path of the baked mesh of an object.
+
+    Args:
+        baked_dir (Path): Directory of the baked meshes.
+        label (str): Label of the object.
+
+    Returns:
+        Path: Path of the baked mesh.
+    """
+    return Path(baked_dir) / f"{label}{BAKED_MESH_SUFFIX}"
+
+
+def write_baked_mesh(
+    path: Path,
+    verts: np.ndarray,
+    faces: np.ndarray,
+    scale: float,
+) -> None:
+    """Write a baked mesh.
+
+    Args:
+        path (Path): Path of the file to write.
+        verts (np.ndarray): Vertices (already scaled), of shape (V, 3).
+        faces (np.ndarray): Faces (vertex indexes), of shape (F, 3).
+        scale (float): Scale that has been applied to the vertices (for reference).
+    """
+    header = np.zeros(1, dtype=_HEADER_DTYPE)
+    header["magic"] = _MAGIC
+    header["nb_verts"] = len(verts)
+    header["nb_faces"] = len(faces)
+    header["scale"] = scale
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    # Write in a temporary file first so that a partially written file is never read
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+
+    with open(tmp_path, "wb") as f:
+        f.write(header.tobytes())
+        f.write(np.ascontiguousarray(verts, dtype=_VERTS_DTYPE).tobytes())
+        f.write(np.ascontiguousarray(faces, dtype=_FACES_DTYPE).tobytes())
+
+    tmp_path.replace(path)
+
+
+def read_baked_mesh(path: Path) -> Tuple[np.ndarray, np.ndarray]:
+    """Memory-map a baked mesh.
+
+    Args:
+        path (Path): Path of the baked mesh.
+
+    Raises:
+        ValueError: If the file is not a baked mesh.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Vertices (V, 3) float32 and faces (F, 3)
+            int32, mapped copy-on-write.
+    """
+    header = np.fromfile(path, dtype=_HEADER_DTYPE, count=1)
+
+    if len(header) != 1 or header["magic"][0] != _MAGIC:
+        raise ValueError(f"Not a baked mesh: {path}")
+
+    nb_verts = int(header["nb_verts"][0])
+    nb_faces = int(header["nb_faces"][0])
+
+    verts = np.memmap(
+        path,
+        dtype=_VERTS_DTYPE,
+        mode="c",
+        offset=_HEADER_DTYPE.itemsize,
+        shape=(nb_verts, 3),
+    )
+    faces = np.memmap(
+        path,
+        dtype=_FACES_DTYPE,
+        mode="c",
+        offset=_HEADER_DTYPE.itemsize + verts.nbytes,
+        shape=(nb_faces, 3),
+    )
+
+    return verts, faces
+
+
+def load_baked_mesh_scale(path: Path) -> Optional[float]:
+    """Read the scale that was applied to a baked mesh.
+
+    Args:
+        path (Path): Path of the baked mesh.
+
+    Returns:
+        Optional[float]: The scale, or None if the file is not a baked mesh.
+    """
+    header = np.fromfile(path, dtype=_HEADER_DTYPE, count=1)
+
+    if len(header) != 1 or header["magic"][0] != _MAGIC:
+        return None
+
+    return float(header["scale"][0])
+
+
+def is_baked_mesh_up_to_date(path: Path, obj: RigidObject) -> bool:
+    """Check whether the baked mesh of an object can be used instead of its original
+    mesh file: it exists, is not older than the original file and has been baked with
+    the scale of the object.
+
+    Args:
+        path (Path): Path of the baked mesh.
+        obj (RigidObject): The object.
+
+    Returns:
+        bool: True if the baked mesh is up to date.
+    """
+    if not path.exists() or\
+        path.stat().st_mtime < Path(obj.mesh_path).stat().st_mtime:
+        return False
+
+    scale = load_baked_mesh_scale(path)
+
+    return scale is not None and np.isclose(scale, obj.scale)
+
+
+def load_scaled_mesh(
+    obj: RigidObject,
+    lod: int = 0,
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """Load the scaled mesh of an object, from its baked file if it has one, from its
+    original mesh file otherwise.
+
+    Args:
+        obj (RigidObject): The object.
+        lod (int, optional): Level of detail of the mesh: 0 for the full mesh, i > 0
+            for the baked decimated mesh `obj.lods[i - 1]`. Defaults to 0.
+
+    Returns:
+        Tuple[torch.Tensor, torch.Tensor]: Vertices (V, 3) float32 and faces (F, 3)
+            int64.
+    """
+    if lod > 0:
+        verts, faces = read_baked_mesh(obj.lods[lod - 1].mesh_path)
+
+        return torch.from_numpy(verts), torch.from_numpy(faces).long()
+
+    if obj.baked_mesh_path is not None:
+        verts, faces = read_baked_mesh(obj.baked_mesh_path)
+
+        return torch.from_numpy(verts), torch.from_numpy(faces).long()
+
+    # Load the mesh (without textures)
+    mesh = load_objs_as_meshes(files=[obj.mesh_path], load_textures=False)
+
+    # In-place scaling of the vertices
+    mesh.scale_verts_(obj.scale)
+
+    return mesh.verts_list()[0], mesh.faces_list()[0]
+
+
+def load_scaled_meshes(objects: List[RigidObject]) -> Meshes:
+    """Load the scaled meshes of a list of objects.
+
+    Args:
+        objects (List[RigidObject]): The objects.
+
+    Returns:
+        Meshes: The meshes, in the order of the objects.
+    """
+    verts, faces = zip(*[load_scaled_mesh(obj) for obj in objects])
+
+    return Meshes(verts=list(verts), faces=list(faces))
+
+
+def attach_baked_meshes(object_set: RigidObjectSet, baked_dir: Path) -> int:
+    """Make the objects of a set use their baked meshes when they are present and up to
+    date (not older than the original mesh file, same scale).
+
+    Args:
+        object_set (RigidObjectSet): The object set.
+        baked_dir (Path): Directory of the baked meshes.
+
+    Returns:
+        int: Number of objects using a baked mesh.
+    """
+    nb_baked = 0
+
+    for obj in object_set:
+        path = baked_mesh_path(baked_dir, obj.label)
+
+        if is_baked_mesh_up_to_date(path, obj):
+            obj.baked_mesh_path = path
+            nb_baked += 1
+
+    return nb_baked
+
+
+def bake_object(
+    obj: RigidObject,
+    baked_dir: Path,
+    overwrite: bool = False,
+) -> Optional[Path]:
+    """Bake the mesh of an object, with its scale applied.
+
+    Args:
+        obj (RigidObject): The object.
+        baked_dir (Path): Directory where the baked meshes are written.
+        overwrite (bool, optional): Whether to bake the mesh again if it already has an
+            up-to-date baked file. Defaults to False.
+
+    Returns:
+        Optional[Path]: Path of the baked mesh written, or None if it was up to date.
+    """
+    path = baked_mesh_path(baked_dir, obj.label)
+
+    if not overwrite and is_baked_mesh_up_to_date(path, obj):
+        return None
+
+    # Load the mesh (without textures)
+    mesh = load_objs_as_meshes(files=[obj.mesh_path], load_textures=False)
+
+    # In-place scaling of the vertices
+    mesh.scale_verts_(obj.scale)
+
+    write_baked_mesh(
+        path,
+        mesh.verts_list()[0].numpy(),
+        mesh.faces_list()[0].numpy(),
+        obj.scale,
+    )
+
+    return path
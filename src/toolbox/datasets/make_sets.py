@@ -12,6 +12,8 @@ from omegaconf import ListConfig
 
 # Custom modules
 from toolbox.datasets.object_set import RigidObjectSet
+from toolbox.datasets.baked_mesh import attach_baked_meshes, default_baked_dir
+from toolbox.datasets.mesh_lod import attach_mesh_lods, default_lods_dir
 from toolbox.datasets.gso_object_set import GoogleScannedObjectSet
 from toolbox.datasets.bcot_object_set import BCOTObjectSet
 from toolbox.datasets.rbot_object_set import RBOTObjectSet
@@ -26,12 +28,29 @@ from toolbox.datasets.web_scene_set import (
     IterableWebSceneSet,
 )
 
-def make_object_set(name: str, dir: str) -> RigidObjectSet:
+def make_object_set(
+    name: str,
+    dir: str,
+    baked_dir: Optional[str] = None,
+    use_baked: bool = True,
+    lods_dir: Optional[str] = None,
+) -> RigidObjectSet:
     """Create a RigidObjectSet object from the a given object set name and location.
+    The objects whose meshes have been baked (see `scripts/bake_meshes.py`) use the
+    baked files instead of the original meshes, and the levels of detail made by
+    `scripts/make_mesh_lods.py` are attached to the objects.
 
     Args:
         name (str): Name of the object set.
         dir (str): Location of the object set directory.
+        baked_dir (Optional[str], optional): Location of the baked meshes. If None,
+            the default location next to the object set directory is used. Defaults
+            to None.
+        use_baked (bool, optional): Whether to use the baked meshes when present.
+            Defaults to True.
+        lods_dir (Optional[str], optional): Location of the levels of detail of the
+            meshes. If None, the default location next to the object set directory is
+            used. Defaults to None.
 
     Raises:
         ValueError: If the object set name is unknown.
@@ -62,6 +81,21 @@ def make_object_set(name: str, dir: str) -> RigidObjectSet:
     else:
         raise ValueError(f"Unknown object set name: {name}")
     
+    # Prefer the baked meshes (scale pre-applied, memory-mappable)
+    if use_baked:
+        if baked_dir is None:
+            baked_dir = default_baked_dir(path, name)
+        
+        if Path(baked_dir).exists():
+            attach_baked_meshes(objset, Path(baked_dir))
+    
+    # Decimated meshes the renderers can use for small or distant objects
+    if lods_dir is None:
+        lods_dir = default_lods_dir(path, name)
+    
+    if Path(lods_dir).exists():
+        attach_mesh_lods(objset, Path(lods_dir))
+    
     return objset
 
 
@@ -118,8 +152,12 @@ def make_iterable_scene_set(
     input_depth: bool = False,
     sample_buffer_size: int = 1,
     deterministic: bool = False,
+    prefetch_size: int = 0,
+    strict_weights: bool = True,
 ) -> IterableMultiSceneSet:
-    """Create an iterable set from a list of scene sets configurations.
+    """Create an iterable set from a list of scene sets configurations. Each scene
+    set configuration may define a mixing `weight` (defaults to 1.0), which is applied
+    to each of its `n_repeats` repetitions.
 
     Args:
         dir (str): Location of the directory containing the scene sets.
@@ -130,6 +168,10 @@ def make_iterable_scene_set(
             Defaults to 1.
         deterministic (bool, optional): Whether to iterate deterministically or not.
             Defaults to False.
+        prefetch_size (int, optional): Number of samples prefetched per scene set by a
+            background thread. If 0, samples are loaded synchronously. Defaults to 0.
+        strict_weights (bool, optional): Whether to always wait for the drawn scene
+            set rather than taking a ready sample from another one. Defaults to True.
 
     Returns:
         IterableMultiSceneSet: The iterable set.
@@ -139,8 +181,9 @@ def make_iterable_scene_set(
     """
     path = Path(dir)
     
-    # Initialize a list of scene sets
+    # Initialize a list of scene sets and their mixing weights
     scene_set_iterators = []
+    weights = []
     
     for this_set_config in sets_cfg:
         
@@ -169,6 +212,12 @@ def make_iterable_scene_set(
         # of scene sets
         for _ in range(this_set_config.n_repeats):
             scene_set_iterators.append(iterator)
+            weights.append(this_set_config.get("weight", 1.0))
     
     # Gather all the scene sets into a single IterableMultiSceneSet
-    return IterableMultiSceneSet(scene_set_iterators)
+    return IterableMultiSceneSet(
+        scene_set_iterators,
+        weights=weights,
+        prefetch_size=prefetch_size,
+        strict_weights=strict_weights,
+    )
@@ -0,0 +1,156 @@
+"""
+Levels of detail (LODs) of the meshes of an object set. Each object may have several
+decimated versions of its mesh, stored as baked meshes (see
+`toolbox.datasets.baked_mesh`) in one directory per number of faces. An index file
+records, for each level, the IoU between its silhouettes and the silhouettes of the full
+mesh at several projected diameters, so that the renderers can pick the coarsest level
+which is accurate enough for the size of an object on screen (see
+`toolbox.modules.lod_selection` and `scripts/make_mesh_lods.py`).
+"""
+# Standard libraries
+from pathlib import Path
+from typing import Dict, List, Tuple
+import json
+
+# Third-party libraries
+from pytorch3d.structures import Meshes
+
+# Custom modules
+from toolbox.datasets.object_set import MeshLOD, RigidObject, RigidObjectSet
+from toolbox.datasets.baked_mesh import (
+    BAKED_MESH_SUFFIX,
+    is_baked_mesh_up_to_date,
+    load_scaled_mesh,
+)
+
+
+LODS_INDEX_FILE = "lods.json"
+
+
+def default_lods_dir(object_set_dir: Path, name: str) -> Path:
+    """Get the default directory of the levels of detail of an object set. It is a
+    sibling of the object set directory, like the directory of the baked meshes.
+
+    Args:
+        object_set_dir (Path): Location of the object set directory.
+        name (str): Name of the object set.
+
+    Returns:
+        Path: Directory of the levels of detail.
+    """
+    object_set_dir = Path(object_set_dir)
+
+    return object_set_dir.parent / f"{object_set_dir.name}_lods" / name
+
+
+def lod_mesh_path(lods_dir: Path, nb_faces: int, label: str) -> Path:
+    """Get the path of the baked decimated mesh of an object.
+
+    Args:
+        lods_dir (Path): Directory of the levels of detail.
+        nb_faces (int): Target number of faces of the level.
+        label (str): Label of the object.
+
+    Returns:
+        Path: Path of the baked decimated mesh.
+    """
+    return Path(lods_dir) / f"{nb_faces}_faces" / f"{label}{BAKED_MESH_SUFFIX}"
+
+
+def read_lods_index(lods_dir: Path) -> Dict:
+    """Read the index of the levels of detail of an object set.
+
+    Args:
+        lods_dir (Path): Directory of the levels of detail.
+
+    Returns:
+        Dict: Projected diameters at which the levels have been compared with the full
+            meshes ("pixel_diameters"), and levels of each object ("objects", a list of
+            {"nb_faces", "ious"} dictionaries per object label). Empty if there is no
+            index.
+    """
+    path = Path(lods_dir) / LODS_INDEX_FILE
+
+    if not path.exists():
+        return {"pixel_diameters": [], "objects": {}}
+
+    return json.loads(path.read_text())
+
+
+def write_lods_index(lods_dir: Path, index: Dict) -> None:
+    """Write the index of the levels of detail of an object set.
+
+    Args:
+        lods_dir (Path): Directory of the levels of detail.
+        index (Dict): The index (see `read_lods_index`).
+    """
+    path = Path(lods_dir) / LODS_INDEX_FILE
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    # Write in a temporary file first so that a partially written index is never read
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    tmp_path.write_text(json.dumps(index, indent=2))
+    tmp_path.replace(path)
+
+
+def attach_mesh_lods(object_set: RigidObjectSet, lods_dir: Path) -> int:
+    """Give the objects of a set the levels of detail listed in the index whose baked
+    meshes are present and up to date (not older than the original mesh file, same
+    scale).
+
+    Args:
+        object_set (RigidObjectSet): The object set.
+        lods_dir (Path): Directory of the levels of detail.
+
+    Returns:
+        int: Number of objects having at least one level of detail.
+    """
+    index = read_lods_index(lods_dir)
+    pixel_diameters = index["pixel_diameters"]
+
+    nb_objects = 0
+
+    for obj in object_set:
+        lods = []
+
+        for level in index["objects"].get(obj.label, []):
+            path = lod_mesh_path(lods_dir, level["nb_faces"], obj.label)
+
+            if is_baked_mesh_up_to_date(path, obj):
+                lods.append(MeshLOD(
+                    mesh_path=path,
+                    nb_faces=level["nb_faces"],
+                    pixel_diameters=pixel_diameters,
+                    ious=level["ious"],
+                ))
+
+        obj.lods = lods
+
+        if lods:
+            nb_objects += 1
+
+    return nb_objects
+
+
+def load_lod_meshes(objects: List[RigidObject]) -> Tuple[Meshes, List[List[int]]]:
+    """Load the scaled meshes of a list of objects with all their levels of detail.
+
+    Args:
+        objects (List[RigidObject]): The objects.
+
+    Returns:
+        Tuple[Meshes, List[List[int]]]: The meshes, and the index in the meshes of each
+            level of detail of each object (level 0, the full mesh of the i-th object,
+            is the i-th mesh).
+    """
+    meshes = [load_scaled_mesh(obj) for obj in objects]
+    lods_idx = [[i] for i in range(len(objects))]
+
+    for i, obj in enumerate(objects):
+        for lod in range(1, len(obj.lods) + 1):
+            lods_idx[i].append(len(meshes))
+            meshes.append(load_scaled_mesh(obj, lod=lod))
+
+    verts, faces = zip(*meshes)
+
+    return Meshes(verts=list(verts), faces=list(faces)), lods_idx
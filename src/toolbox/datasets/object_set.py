@@ -8,6 +8,73 @@ from pathlib import Path
 from typing import List, Optional, Set, Tuple, Union
 
 
+class MeshLOD:
+    """
+    A level of detail of the mesh of a rigid object, i.e. a decimated version of the
+    mesh, along with the IoU between its silhouettes and the silhouettes of the full
+    mesh measured at several projected diameters of the object.
+    """
+    def __init__(
+        self,
+        mesh_path: Path,
+        nb_faces: int,
+        pixel_diameters: List[float],
+        ious: List[float],
+        ) -> None:
+        """Initializes a level of detail.
+
+        Args:
+            mesh_path (Path): Path to the (baked) decimated mesh.
+            nb_faces (int): Number of faces of the decimated mesh.
+            pixel_diameters (List[float]): Projected diameters of the object (pixels)
+                at which the silhouettes have been compared, in increasing order.
+            ious (List[float]): Smallest IoU between the silhouettes of the decimated
+                mesh and of the full mesh at each projected diameter.
+        """
+        self._mesh_path = mesh_path
+        self._nb_faces = nb_faces
+        self._pixel_diameters = pixel_diameters
+        self._ious = ious
+    
+    @property
+    def mesh_path(self) -> Path:
+        """Returns the path to the decimated mesh.
+
+        Returns:
+            Path: The path to the decimated mesh.
+        """
+        return self._mesh_path
+    
+    @property
+    def nb_faces(self) -> int:
+        """Returns the number of faces of the decimated mesh.
+
+        Returns:
+            int: The number of faces.
+        """
+        return self._nb_faces
+    
+    def max_pixel_diameter(self, iou_tolerance: float) -> float:
+        """Returns the largest projected diameter of the object up to which the
+        silhouettes of the decimated mesh stay within a tolerance on the IoU.
+
+        Args:
+            iou_tolerance (float): Tolerated IoU loss w.r.t. the full mesh.
+
+        Returns:
+            float: The largest projected diameter (pixels). Infinite if the IoU is
+                within the tolerance at all the measured diameters.
+        """
+        max_diameter = 0.0
+        
+        for diameter, iou in zip(self._pixel_diameters, self._ious):
+            if iou < 1.0 - iou_tolerance:
+                return max_diameter
+            max_diameter = diameter
+        
+        return float("inf")
+
+
 class RigidObject:
     """
     A class to represent a rigid object. It gathers information about the object
@@ -47,6 +114,14 @@ class RigidObject:
         self._scaling_factor = scaling_factor
         self._mesh_diameter = mesh_diameter
         self._ypr_offset_deg = ypr_offset_deg
+        
+        # Binary mesh with the scale already applied, used instead of the original
+        # mesh when set (see toolbox.datasets.baked_mesh)
+        self._baked_mesh_path: Optional[Path] = None
+        
+        # Decimated versions of the mesh, from the finest to the coarsest
+        # (see toolbox.datasets.mesh_lod)
+        self._lods: List[MeshLOD] = []
     
     @property
     def label(self) -> str:
@@ -76,6 +151,44 @@ class RigidObject:
         """
         return self._mesh_path
     
+    @property
+    def baked_mesh_path(self) -> Optional[Path]:
+        """Returns the path to the baked mesh (scale already applied), if any.
+
+        Returns:
+            Optional[Path]: The path to the baked mesh.
+        """
+        return self._baked_mesh_path
+    
+    @baked_mesh_path.setter
+    def baked_mesh_path(self, path: Optional[Path]) -> None:
+        """Sets the path to the baked mesh (scale already applied).
+
+        Args:
+            path (Optional[Path]): The path to the baked mesh, or None to use the
+                original mesh.
+        """
+        self._baked_mesh_path = path
+    
+    @property
+    def lods(self) -> List[MeshLOD]:
+        """Returns the levels of detail of the mesh, from the finest to the coarsest.
+
+        Returns:
+            List[MeshLOD]: The levels of detail (empty if the mesh has none).
+        """
+        return self._lods
+    
+    @lods.setter
+    def lods(self, lods: List[MeshLOD]) -> None:
+        """Sets the levels of detail of the mesh.
+
+        Args:
+            lods (List[MeshLOD]): The levels of detail. They are sorted from the finest
+                to the coarsest.
+        """
+        self._lods = sorted(lods, key=lambda lod: lod.nb_faces, reverse=True)
+    
     @property
     def mesh_diameter(self) -> Optional[float]:
         """Returns the diameter of the object.
@@ -0,0 +1,217 @@
+"""
+Lightweight profiling of the data pipeline. Each DataLoader worker accumulates the
+latencies of the stages of the samples construction in histograms, which are
+periodically attached to the samples so that they reach the main process along with
+the batches, where they are merged and summarized (percentiles per stage).
+"""
+from __future__ import annotations
+
+# Standard libraries
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Optional, Sequence
+import math
+
+# Third-party libraries
+import numpy as np
+
+
+# Latency histograms bins (in milliseconds), log-spaced from 1 µs to 100 s so that the
+# relative resolution (~10%) is the same for all the stages
+_MIN_LATENCY_MS = 1e-3
+_MAX_LATENCY_MS = 1e5
+_NB_BINS = 200
+_LOG_MIN = math.log(_MIN_LATENCY_MS)
+_LOG_BIN_WIDTH = (math.log(_MAX_LATENCY_MS) - _LOG_MIN) / _NB_BINS
+
+BIN_EDGES_MS = np.exp(_LOG_MIN + _LOG_BIN_WIDTH * np.arange(_NB_BINS + 1))
+
+
+def _bin_index(latency_ms: float) -> int:
+    """Get the index of the histogram bin of a latency.
+
+    Args:
+        latency_ms (float): Latency in milliseconds.
+
+    Returns:
+        int: Index of the bin (latencies out of range fall in the first or last bin).
+    """
+    if latency_ms <= _MIN_LATENCY_MS:
+        return 0
+
+    idx = int((math.log(latency_ms) - _LOG_MIN) / _LOG_BIN_WIDTH)
+
+    return min(idx, _NB_BINS - 1)
+
+
+@dataclass
+class PipelineProfile:
+    """
+    Aggregated statistics of the data pipeline: one latency histogram per stage, the
+    number of samples produced and the number of observations rejected because no
+    valid object was found in them. Profiles are mergeable, whatever the process they
+    come from.
+    """
+    histograms: Dict[str, np.ndarray] = field(default_factory=dict)
+    nb_samples: int = 0
+    nb_rejected: int = 0
+
+    def merge(self, other: PipelineProfile) -> PipelineProfile:
+        """Merge (in-place) another profile into this one.
+
+        Args:
+            other (PipelineProfile): Profile to merge.
+
+        Returns:
+            PipelineProfile: This profile.
+        """
+        for stage, counts in other.histograms.items():
+            if stage in self.histograms:
+                self.histograms[stage] += counts
+            else:
+                self.histograms[stage] = counts.copy()
+
+        self.nb_samples += other.nb_samples
+        self.nb_rejected += other.nb_rejected
+
+        return self
+
+    @staticmethod
+    def merge_all(
+        profiles: Iterable[Optional[PipelineProfile]],
+    ) -> Optional[PipelineProfile]:
+        """Merge a collection of profiles.
+
+        Args:
+            profiles (Iterable[Optional[PipelineProfile]]): Profiles to merge. None
+                elements are ignored.
+
+        Returns:
+            Optional[PipelineProfile]: The merged profile, or None if there was no
+                profile to merge.
+        """
+        merged = None
+
+        for profile in profiles:
+            if profile is None:
+                continue
+            if merged is None:
+                merged = PipelineProfile()
+            merged.merge(profile)
+
+        return merged
+
+    def quantile(self, stage: str, q: float) -> float:
+        """Estimate a quantile of the latency of a stage from its histogram.
+
+        Args:
+            stage (str): Name of the stage.
+            q (float): Quantile to compute, in [0, 1].
+
+        Returns:
+            float: Estimated latency in milliseconds (NaN if no latency has been
+                recorded for the stage).
+        """
+        counts = self.histograms.get(stage)
+
+        if counts is None or counts.sum() == 0:
+            return float("nan")
+
+        cumulative_counts = np.cumsum(counts)
+        rank = q * cumulative_counts[-1]
+
+        # First bin in which the cumulative count reaches the rank
+        idx = int(np.searchsorted(cumulative_counts, rank, side="left"))
+        idx = min(idx, _NB_BINS - 1)
+
+        # Interpolate (geometrically) inside the bin
+        count_before = cumulative_counts[idx - 1] if idx > 0 else 0
+        fraction = (rank - count_before) / max(counts[idx], 1)
+
+        return float(
+            BIN_EDGES_MS[idx] * (BIN_EDGES_MS[idx + 1] / BIN_EDGES_MS[idx])**fraction
+        )
+
+    def summary(self, quantiles: Sequence[float] = (0.5, 0.95)) -> Dict[str, float]:
+        """Summarize the profile.
+
+        Args:
+            quantiles (Sequence[float], optional): Quantiles of the latencies to
+                report. Defaults to (0.5, 0.95).
+
+        Returns:
+            Dict[str, float]: Latency quantiles of each stage (keys
+                "<stage>_p<percent>_ms"), number of samples and rejected observations,
+                and rejection rate.
+        """
+        summary = {}
+
+        for stage in sorted(self.histograms.keys()):
+            for q in quantiles:
+                summary[f"{stage}_p{round(q * 100)}_ms"] = self.quantile(stage, q)
+
+        summary["nb_samples"] = float(self.nb_samples)
+        summary["nb_rejected"] = float(self.nb_rejected)
+
+        nb_observations = self.nb_samples + self.nb_rejected
+        summary["rejection_rate"] =\
+            self.nb_rejected / nb_observations if nb_observations > 0 else 0.0
+
+        return summary
+
+
+class DataPipelineProfiler:
+    """
+    Profiler living in a dataset (one instance per DataLoader worker). It records the
+    latencies of the stages of the samples construction and hands out what has been
+    recorded since the last report every `report_every` samples.
+    """
+    def __init__(self, report_every: int = 100) -> None:
+        """Constructor.
+
+        Args:
+            report_every (int, optional): Number of samples between two reports.
+                Defaults to 100.
+        """
+        self._report_every = report_every
+        self._profile = PipelineProfile()
+
+    def record(self, timings: Dict[str, float]) -> None:
+        """Record the latencies of the stages of a sample.
+
+        Args:
+            timings (Dict[str, float]): Latency of each stage in milliseconds.
+        """
+        histograms = self._profile.histograms
+
+        for stage, latency_ms in timings.items():
+            if stage not in histograms:
+                histograms[stage] = np.zeros(_NB_BINS, dtype=np.int64)
+            histograms[stage][_bin_index(latency_ms)] += 1
+
+        self._profile.nb_samples += 1
+
+    def reject(self) -> None:
+        """
+        Count an observation in which no valid object was found.
+        """
+        self._profile.nb_rejected += 1
+
+    def pop(self, force: bool = False) -> Optional[PipelineProfile]:
+        """Hand out the profile recorded since the last report if enough samples have
+        been recorded.
+
+        Args:
+            force (bool, optional): Whether to hand out the profile whatever the number
+                of samples recorded. Defaults to False.
+
+        Returns:
+            Optional[PipelineProfile]: The profile recorded since the last report, or
+                None if it is not time to report yet.
+        """
+        if not force and self._profile.nb_samples < self._report_every:
+            return None
+
+        profile = self._profile
+        self._profile = PipelineProfile()
+
+        return profile
@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 # Standard libraries
-from typing import List, Optional, Dict, Union, Any, Tuple
+from typing import Callable, List, Optional, Dict, Union, Any, Tuple
 from collections.abc import Iterator
 import os
 import random
@@ -9,6 +9,9 @@ import time
 from dataclasses import dataclass
 import json
 import copy
+import itertools
+import queue
+import threading
 
 # Third-party libraries
 import torch
@@ -18,7 +21,7 @@ import numpy as np
 
 # Custom modules
 from toolbox.utils.random import make_seed
-from toolbox.geometry.transform import Transform
+from toolbox.geometry.batch_transform import BatchTransform
 import toolbox.utils.tensor_collection as tc
 
 
@@ -49,17 +52,17 @@ tensors:
 SceneObservationTensorCollection = tc.PandasTensorCollection
 
 
-def transform_to_list(T: Transform) -> ListPose:
-    """Convert a Transform object to a list. The rotation is represented as a
+def transform_to_list(T: BatchTransform) -> ListPose:
+    """Convert a single transform to a list. The rotation is represented as a
     quaternion.
 
     Args:
-        T (Transform): The transform object.
+        T (BatchTransform): The transform (batch of 1).
 
     Returns:
         ListPose: The list representation of the transform.
     """
-    return [T.quaternion.coeffs().tolist(), T.translation.tolist()]
+    return [T.quaternion[0].tolist(), T.translation[0].tolist()]
 
 
 @dataclass
@@ -67,7 +70,7 @@ class ObjectData:
     # NOTE: (Yann): bbox_amodal, bbox_modal, visib_fract should be moved to
     # SceneObservation
     label: str
-    TWO: Optional[Transform] = None
+    TWO: Optional[BatchTransform] = None
     unique_id: Optional[int] = None
     
     # Amodal means the bounding box of the entire object, including the parts
@@ -78,7 +81,7 @@ class ObjectData:
     bbox_modal: Optional[np.ndarray] = None  # (4, ) array [xmin, ymin, xmax, ymax]
     
     visib_fract: Optional[float] = None
-    TWO_init: Optional[Transform] = None
+    TWO_init: Optional[BatchTransform] = None
     # Some pose estimation datasets (ModelNet) provide an initial pose estimate
     #  NOTE: This should be loaded externally
 
@@ -110,7 +113,11 @@ class ObjectData:
                 assert isinstance(trans_list, list)
                 quat = tuple(quat_list)
                 trans = tuple(trans_list)
-                setattr(data, k, Transform(quat, trans))
+                setattr(
+                    data,
+                    k,
+                    BatchTransform.from_quaternions_translations(quat, trans),
+                )
         for k in ("unique_id", "visib_fract"):
             if k in d:
                 setattr(data, k, d[k])
@@ -123,9 +130,9 @@ class ObjectData:
 class CameraData:
     K: Optional[np.ndarray] = None
     resolution: Optional[Resolution] = None
-    TWC: Optional[Transform] = None
+    TWC: Optional[BatchTransform] = None
     camera_id: Optional[str] = None
-    TWC_init: Optional[Transform] = None
+    TWC_init: Optional[BatchTransform] = None
     # Some pose estimation datasets (ModelNet) provide an initial pose estimate
     #  NOTE: This should be loaded externally
 
@@ -156,7 +163,11 @@ class CameraData:
                 assert isinstance(trans_list, list)
                 quat = tuple(quat_list)
                 trans = tuple(trans_list)
-                setattr(data, k, Transform(tuple(quat), tuple(trans)))
+                setattr(
+                    data,
+                    k,
+                    BatchTransform.from_quaternions_translations(quat, trans),
+                )
         for k in ("camera_id",):
             if k in d:
                 setattr(data, k, d[k])
@@ -339,12 +350,8 @@ class SceneObservation:
         TWO = []
         bboxes = []
         masks = []
-        TWC = torch.as_tensor(obs.camera_data.TWC.matrix).float()
 
         TWO_init = []
-        TWC_init = None
-        if obs.camera_data.TWC_init is not None:
-            TWC_init = torch.as_tensor(obs.camera_data.TWC_init.matrix).float()
 
         for _n, obj_data in enumerate(obs.object_datas):
             if object_labels is not None and obj_data.label not in object_labels:
@@ -356,8 +363,8 @@ class SceneObservation:
                 "visib_fract": getattr(obj_data, "visib_fract", 1),
             }
             infos.append(info)
-            TWO.append(torch.tensor(obj_data.TWO.matrix).float())
-            bboxes.append(torch.tensor(obj_data.bbox_modal).float())
+            TWO.append(obj_data.TWO)
+            bboxes.append(obj_data.bbox_modal)
 
             if obs.binary_masks is not None:
                 binary_mask = torch.tensor(obs.binary_masks[obj_data.unique_id]).float()
@@ -369,8 +376,8 @@ class SceneObservation:
                 binary_mask = torch.as_tensor(binary_mask).float()
                 masks.append(binary_mask)
 
-            if obj_data.TWO_init:
-                TWO_init.append(torch.tensor(obj_data.TWO_init.matrix).float())
+            if obj_data.TWO_init is not None:
+                TWO_init.append(obj_data.TWO_init)
 
         infos = pd.DataFrame(infos)
         if len(masks) > 0:
@@ -380,22 +387,23 @@ class SceneObservation:
 
         B = len(infos)
 
-        TCW = torch.linalg.inv(TWC)  # [4,4]
-
         # Deals with case where no object label is provided (hb,itodd)
-        if len(obs.object_datas) > 0:
-            TWO = torch.stack(TWO)
-            # [B,4,4]
-            TCO = TCW.unsqueeze(0) @ TWO
-            bboxes = torch.stack(bboxes)
+        if len(TWO) > 0:
+            # All the objects are moved to the camera frame at once, [B,4,4]
+            TCO = (
+                obs.camera_data.TWC.inverse() * BatchTransform.concatenate(TWO)
+            ).tensor
+            bboxes = torch.as_tensor(np.stack(bboxes)).float()
         else:
-            TWO = torch.Tensor()
             TCO = torch.Tensor()
             bboxes = torch.Tensor()
 
         TCO_init = None
         if len(TWO_init):
-            TCO_init = torch.linalg.inv(TWC_init).unsqueeze(0) @ torch.stack(TWO_init)
+            TCO_init = (
+                obs.camera_data.TWC_init.inverse()
+                * BatchTransform.concatenate(TWO_init)
+            ).tensor
         K = torch.tensor(obs.camera_data.K).unsqueeze(0).expand([B, -1, -1])
 
         data = tc.PandasTensorCollection(
@@ -459,9 +467,131 @@ class SceneSet(torch.utils.data.Dataset):
         raise NotImplementedError
 
 
+def snapshot_state(state: Dict[str, Any]) -> Dict[str, Any]:
+    """Copy the live state of an iterator into a picklable state. Random number
+    generators are replaced by their internal state, and nested iterators by their own
+    state.
+
+    Args:
+        state (Dict[str, Any]): Live state of an iterator.
+
+    Returns:
+        Dict[str, Any]: Picklable copy of the state.
+    """
+    def snapshot(value: Any) -> Any:
+        if isinstance(value, random.Random):
+            return value.getstate()
+        elif isinstance(value, SceneSetIterator):
+            return value.state_dict()
+        elif isinstance(value, dict):
+            return {k: snapshot(v) for k, v in value.items()}
+        elif isinstance(value, list):
+            return [snapshot(v) for v in value]
+        return value
+    
+    return snapshot(state)
+
+
+def make_rng(
+    state: Optional[tuple],
+    worker_seed_fn: Callable[[], int],
+    deterministic: bool = False,
+) -> random.Random:
+    """Create a random number generator, either restored from a saved state or seeded
+    for the current worker.
+
+    Args:
+        state (Optional[tuple]): State returned by `random.Random.getstate`, or None.
+        worker_seed_fn (Callable[[], int]): Function returning the seed of the worker.
+        deterministic (bool, optional): Whether to seed deterministically or not.
+            Defaults to False.
+
+    Returns:
+        random.Random: The random number generator.
+    """
+    rng = random.Random()
+    
+    if state is not None:
+        rng.setstate(state)
+    elif deterministic:
+        rng.seed(make_seed(worker_seed_fn()))
+    else:
+        rng.seed(make_seed(
+            worker_seed_fn(),
+            os.getpid(),
+            time.time_ns(),
+            os.urandom(4),
+        ))
+    
+    return rng
+
+
+class SceneSetIterator:
+    """
+    Iterator over SceneObservation whose position can be saved (`state_dict`) and
+    restored (`IterableSceneSet.iter_from_state`). The underlying generator keeps its
+    position up to date in a live state dictionary.
+    """
+    def __init__(
+        self,
+        make_generator: Callable[
+            [Dict[str, Any], Optional[Dict[str, Any]]],
+            Iterator[SceneObservation],
+        ],
+        resume_state: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        """Constructor.
+
+        Args:
+            make_generator (Callable): Function creating the generator from the live
+                state to update and the state to resume from (or None).
+            resume_state (Optional[Dict[str, Any]], optional): State to resume from, as
+                returned by `state_dict`. Defaults to None.
+        """
+        self._state: Dict[str, Any] = {}
+        self._generator = make_generator(self._state, resume_state)
+    
+    def __iter__(self) -> SceneSetIterator:
+        return self
+    
+    def __next__(self) -> SceneObservation:
+        return next(self._generator)
+    
+    def close(self) -> None:
+        """
+        Close the underlying generator.
+        """
+        self._generator.close()
+    
+    def state_dict(self) -> Dict[str, Any]:
+        """Get the position of the iterator.
+
+        Returns:
+            Dict[str, Any]: Picklable state of the iterator.
+        """
+        return snapshot_state(self._state)
+
+
 class IterableSceneSet:
     def __iter__(self) -> Iterator[SceneObservation]:
         """Returns an infinite iterator over SceneObservation samples."""
+        return self.iter_from_state(None)
+    
+    def iter_from_state(
+        self,
+        state: Optional[Dict[str, Any]] = None,
+    ) -> SceneSetIterator:
+        """Returns an infinite iterator over SceneObservation samples, resumed from the
+        state of a previous iterator.
+
+        Args:
+            state (Optional[Dict[str, Any]], optional): State returned by the
+                `state_dict` method of a previous iterator. If None, a new iteration
+                is started. Defaults to None.
+
+        Returns:
+            SceneSetIterator: The iterator.
+        """
         raise NotImplementedError
 
 
@@ -487,38 +617,150 @@ class RandomIterableSceneSet(IterableSceneSet):
         self.deterministic = deterministic
         self.worker_seed_fn = wds.utils.pytorch_worker_seed
 
-    def __iter__(self) -> Iterator[SceneObservation]:
+    def iter_from_state(
+        self,
+        state: Optional[Dict[str, Any]] = None,
+    ) -> SceneSetIterator:
         """Iterate over the scene set. A sample is randomly selected among the
         entire scene set at each iteration, converted to SceneObservation and
         yielded.
 
+        Args:
+            state (Optional[Dict[str, Any]], optional): State of a previous iterator to
+                resume from. Defaults to None.
+
+        Returns:
+            SceneSetIterator: An iterator over the scene set.
+        """
+        return SceneSetIterator(self._generate, state)
+    
+    def _generate(
+        self,
+        live_state: Dict[str, Any],
+        resume_state: Optional[Dict[str, Any]],
+    ) -> Iterator[SceneObservation]:
+        """Generate random samples of the scene set.
+
+        Args:
+            live_state (Dict[str, Any]): State of the iteration, kept up to date.
+            resume_state (Optional[Dict[str, Any]]): State to resume from.
+
         Yields:
             Iterator[SceneObservation]: An iterator over the scene set.
         """
-        if self.deterministic:
-            seed = make_seed(self.worker_seed_fn())
-        else:
-            seed = make_seed(
-                self.worker_seed_fn(),
-                os.getpid(),
-                time.time_ns(),
-                os.urandom(4),
-            )
-        self.rng = random.Random(seed)
+        self.rng = make_rng(
+            resume_state["rng"] if resume_state is not None else None,
+            self.worker_seed_fn,
+            deterministic=self.deterministic,
+        )
+        live_state["rng"] = self.rng
         
         while True:
             idx = self.rng.randint(0, len(self.scene_set) - 1)
             yield self.scene_set[idx]
 
 
+class _SourcePrefetcher:
+    """
+    Background thread filling a bounded queue with the samples of an iterable scene
+    set, so that a slow source does not block the consumer while it decodes.
+    """
+    # Timeout (in seconds) of the blocking queue operations, after which the stop
+    # event (producer) or the liveness of the thread (consumer) is checked
+    _TIMEOUT = 0.1
+    
+    # Item put in the queue when the source is exhausted
+    _EXHAUSTED = object()
+    
+    def __init__(
+        self,
+        iterator: Iterator[SceneObservation],
+        maxsize: int,
+        stop_event: threading.Event,
+    ) -> None:
+        """Constructor.
+
+        Args:
+            iterator (Iterator[SceneObservation]): Iterator over the source.
+            maxsize (int): Maximum number of samples in the queue.
+            stop_event (threading.Event): Event set by the consumer to stop the thread.
+        """
+        self.queue: queue.Queue = queue.Queue(maxsize=maxsize)
+        self._iterator = iterator
+        self._stop_event = stop_event
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+    
+    def _put(self, item: Any) -> None:
+        """Put an item in the queue, unless the consumer stopped.
+
+        Args:
+            item (Any): Sample (or exception raised by the source).
+        """
+        while not self._stop_event.is_set():
+            try:
+                self.queue.put(item, timeout=self._TIMEOUT)
+                return
+            except queue.Full:
+                continue
+    
+    def _run(self) -> None:
+        """
+        Fill the queue with the samples of the source. Exceptions raised by the source
+        and its exhaustion are forwarded to the consumer.
+        """
+        try:
+            for obs in self._iterator:
+                if self._stop_event.is_set():
+                    return
+                self._put(obs)
+        except BaseException as e:
+            self._put(e)
+        else:
+            self._put(self._EXHAUSTED)
+    
+    def get(self) -> SceneObservation:
+        """Take the next sample of the source from the queue.
+
+        Raises:
+            BaseException: The exception raised by the source, if any.
+            RuntimeError: If the source is exhausted or if the thread died without
+                forwarding anything.
+
+        Returns:
+            SceneObservation: The sample.
+        """
+        while True:
+            try:
+                item = self.queue.get(timeout=self._TIMEOUT)
+                break
+            except queue.Empty:
+                # The thread may have put a last item before exiting
+                if not self._thread.is_alive() and self.queue.empty():
+                    raise RuntimeError("The prefetching thread of a source died.")
+        
+        if item is self._EXHAUSTED:
+            raise RuntimeError("A prefetched source is exhausted.")
+        if isinstance(item, BaseException):
+            raise item
+        
+        return item
+
+
 class IterableMultiSceneSet(IterableSceneSet):
     """
-    IterableMultiSceneSet. An iterable set from a list of scene sets.
+    IterableMultiSceneSet. An iterable set from a list of scene sets. At each
+    iteration, a source is drawn according to the mixing weights and its next sample
+    is yielded. Sources can be prefetched by background threads so that a slow source
+    does not stall the whole stream.
     """
     def __init__(
         self,
         list_iterable_scene_set: List[IterableSceneSet],
         deterministic: bool = False,
+        weights: Optional[List[float]] = None,
+        prefetch_size: int = 0,
+        strict_weights: bool = True,
     ) -> None:
         """Constructor.
 
@@ -527,26 +769,166 @@ class IterableMultiSceneSet(IterableSceneSet):
                 sets.
             deterministic (bool, optional): Whether to iterate deterministically or not.
                 Defaults to False.
+            weights (Optional[List[float]], optional): Relative mixing weight of each
+                scene set. If None, the scene sets are drawn uniformly. Defaults to
+                None.
+            prefetch_size (int, optional): Number of samples prefetched per scene set by
+                a background thread. If 0, samples are loaded synchronously. Defaults
+                to 0.
+            strict_weights (bool, optional): Only used with prefetching. If False, a
+                sample is taken from another scene set with samples ready when the
+                drawn scene set has none, which trades the exactness of the mixing
+                weights for throughput. Defaults to True.
+
+        Raises:
+            ValueError: If the number of weights does not match the number of scene
+                sets, or if the weights are invalid.
         """
+        if weights is not None:
+            if len(weights) != len(list_iterable_scene_set):
+                raise ValueError(
+                    f"Expected {len(list_iterable_scene_set)} weights, got "
+                    f"{len(weights)}."
+                )
+            elif any(w < 0 for w in weights) or sum(weights) <= 0:
+                raise ValueError(f"Invalid mixing weights: {weights}")
+        
         self.list_iterable_scene_set = list_iterable_scene_set
         self.deterministic = deterministic
+        self.weights = list(weights) if weights is not None\
+            else [1.0] * len(list_iterable_scene_set)
+        self.prefetch_size = prefetch_size
+        self.strict_weights = strict_weights
         self.worker_seed_fn = wds.utils.pytorch_worker_seed
+        
+        self._reset_stats()
+    
+    def _reset_stats(self) -> None:
+        """
+        Reset the per-source throughput counters.
+        """
+        self._start_time = time.perf_counter()
+        self._nb_samples = [0] * len(self.list_iterable_scene_set)
+        self._wait_times = [0.0] * len(self.list_iterable_scene_set)
+    
+    def stats(self) -> List[Dict[str, float]]:
+        """Get the throughput counters of each source since the start of the
+        iteration (of this process).
 
-    def __iter__(self) -> Iterator[SceneObservation]:
+        Returns:
+            List[Dict[str, float]]: For each source, the number of samples yielded,
+                the throughput (samples/s) and the time spent waiting for it (s).
+        """
+        elapsed_time = max(time.perf_counter() - self._start_time, 1e-9)
         
-        if self.deterministic:
-            seed = make_seed(self.worker_seed_fn())
-        else:
-            seed = make_seed(
-                self.worker_seed_fn(),
-                os.getpid(),
-                time.time_ns(),
-                os.urandom(4),
+        return [
+            {
+                "nb_samples": float(nb_samples),
+                "samples_per_s": nb_samples / elapsed_time,
+                "wait_time_s": wait_time,
+            }
+            for nb_samples, wait_time in zip(self._nb_samples, self._wait_times)
+        ]
+    
+    def iter_from_state(
+        self,
+        state: Optional[Dict[str, Any]] = None,
+    ) -> SceneSetIterator:
+        """Iterate over the mixture of scene sets.
+
+        When resuming, the samples that were prefetched but not consumed yet when the
+        state was saved are not replayed.
+
+        Args:
+            state (Optional[Dict[str, Any]], optional): State of a previous iterator to
+                resume from. Defaults to None.
+
+        Returns:
+            SceneSetIterator: An iterator over the mixture of scene sets.
+        """
+        return SceneSetIterator(self._generate, state)
+    
+    def _generate(
+        self,
+        live_state: Dict[str, Any],
+        resume_state: Optional[Dict[str, Any]],
+    ) -> Iterator[SceneObservation]:
+        """Generate samples from the mixture of scene sets.
+
+        Args:
+            live_state (Dict[str, Any]): State of the iteration, kept up to date.
+            resume_state (Optional[Dict[str, Any]]): State to resume from.
+
+        Yields:
+            Iterator[SceneObservation]: An iterator over the mixture of scene sets.
+        """
+        sources_states = [None] * len(self.list_iterable_scene_set)
+        
+        if resume_state is not None:
+            sources_states = resume_state["sources"]
+        
+        self.rng = make_rng(
+            resume_state["rng"] if resume_state is not None else None,
+            self.worker_seed_fn,
+            deterministic=self.deterministic,
+        )
+        self.iterators = [
+            scene_set.iter_from_state(source_state)
+            for scene_set, source_state in zip(
+                self.list_iterable_scene_set,
+                sources_states,
             )
+        ]
+        live_state["rng"] = self.rng
+        live_state["sources"] = self.iterators
         
-        self.rng = random.Random(seed)
-        self.iterators = [iter(scene_set) for scene_set in self.list_iterable_scene_set]
+        self._reset_stats()
         
-        while True:
-            idx = self.rng.randint(0, len(self.iterators) - 1)
-            yield next(self.iterators[idx])
+        # Cumulative weights are computed once, not at each draw
+        indices = list(range(len(self.list_iterable_scene_set)))
+        cum_weights = list(itertools.accumulate(self.weights))
+        
+        if self.prefetch_size <= 0:
+            while True:
+                idx = self.rng.choices(indices, cum_weights=cum_weights)[0]
+                
+                s = time.perf_counter()
+                obs = next(self.iterators[idx])
+                self._wait_times[idx] += time.perf_counter() - s
+                self._nb_samples[idx] += 1
+                
+                yield obs
+        
+        stop_event = threading.Event()
+        prefetchers = [
+            _SourcePrefetcher(iterator, self.prefetch_size, stop_event)
+            for iterator in self.iterators
+        ]
+        
+        try:
+            while True:
+                idx = self.rng.choices(indices, cum_weights=cum_weights)[0]
+                
+                # Take a sample from another source which has samples ready rather
+                # than waiting for the drawn one
+                if not self.strict_weights and prefetchers[idx].queue.empty():
+                    ready = [
+                        i for i in indices
+                        if self.weights[i] > 0 and not prefetchers[i].queue.empty()
+                    ]
+                    if ready:
+                        idx = self.rng.choices(
+                            ready,
+                            weights=[self.weights[i] for i in ready],
+                        )[0]
+                
+                s = time.perf_counter()
+                obs = prefetchers[idx].get()
+                self._wait_times[idx] += time.perf_counter() - s
+                
+                self._nb_samples[idx] += 1
+                
+                yield obs
+        finally:
+            # Stop the prefetching threads when the iterator is closed
+            stop_event.set()
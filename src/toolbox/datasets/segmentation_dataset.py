@@ -1,7 +1,8 @@
 from __future__ import annotations
 
 # Standard libraries
-from typing import List, Optional, Union, Set, Iterator, Tuple
+from typing import Any, Dict, List, Optional, Union, Set, Iterator, Tuple
+from contextlib import contextmanager, nullcontext
 import time
 from dataclasses import dataclass, replace
 import random
@@ -20,6 +21,82 @@ from toolbox.datasets.scene_set import (
     ObjectData,
 )
 from toolbox.geometry.random_masking_clines import get_valid_clines
+from toolbox.datasets.pipeline_profiler import DataPipelineProfiler, PipelineProfile
+from toolbox.utils.buffer_ring import BufferRing
+
+
+class _StageTimer:
+    """
+    Measure the latencies of the stages of the construction of a sample.
+    """
+    def __init__(self) -> None:
+        """Constructor (starts the measure of the total latency)."""
+        self._start = time.perf_counter()
+        self._timings: Dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Measure the latency of a stage.
+
+        Args:
+            name (str): Name of the stage.
+        """
+        start = time.perf_counter()
+        yield
+        self._timings[name] = time.perf_counter() - start
+
+    def timings_ms(self) -> Dict[str, float]:
+        """Get the latencies of the stages and the total latency.
+
+        Returns:
+            Dict[str, float]: Latencies (milliseconds), keyed by stage name.
+        """
+        timings = dict(self._timings, total=time.perf_counter() - self._start)
+        return {name: latency * 1000 for name, latency in timings.items()}
+
+
+# Stage used when the data construction is not profiled (does nothing)
+_NO_STAGE = nullcontext()
+
+
+def _no_stage(name: str) -> nullcontext:
+    """Stage used when the data construction is not profiled.
+
+    Args:
+        name (str): Name of the stage (unused).
+
+    Returns:
+        nullcontext: A context manager doing nothing.
+    """
+    return _NO_STAGE
+
+
+def _pin(tensor: torch.Tensor) -> torch.Tensor:
+    """Pin a tensor unless it already lives in page-locked memory.
+
+    Args:
+        tensor (torch.Tensor): Tensor to pin.
+
+    Returns:
+        torch.Tensor: Pinned tensor.
+    """
+    return tensor if tensor.is_pinned() else tensor.pin_memory()
+
+
+def _from_numpy(array: np.ndarray) -> torch.Tensor:
+    """Wrap a numpy array into a tensor without copying it when possible (arrays with
+    negative strides, e.g. after a flip, are not supported by torch.from_numpy).
+
+    Args:
+        array (np.ndarray): Numpy array.
+
+    Returns:
+        torch.Tensor: Tensor sharing the memory of the array if possible.
+    """
+    if any(stride < 0 for stride in array.strides):
+        array = np.ascontiguousarray(array)
+    
+    return torch.from_numpy(array)
 
 
 @dataclass
@@ -34,6 +111,10 @@ class SegmentationData:
     bbox: (4, ) int
     K: (3, 3) float32
     TCO: (4, 4) float32
+    profile: statistics of the data pipeline recorded in the worker that produced the
+        sample since its last report (only set when profiling is enabled)
+    pipeline_state: position of the worker that produced the sample in its data stream
+        once the sample has been produced (only set when the state is tracked)
     """
     rgb: np.ndarray
     mask: np.ndarray
@@ -45,6 +126,8 @@ class SegmentationData:
     K: np.ndarray
     depth: Optional[np.ndarray]
     object_data: ObjectData
+    profile: Optional[PipelineProfile] = None
+    pipeline_state: Optional[Dict[str, Any]] = None
 
 @dataclass
 class BatchSegmentationData:
@@ -58,6 +141,9 @@ class BatchSegmentationData:
     bboxes: (bsz, 4) int
     TCO: (bsz, 4, 4) float32
     K: (bsz, 3, 3) float32
+    profile: statistics of the data pipeline gathered from the samples of the batch
+    pipeline_state: position of the worker that produced the batch in its data stream
+        after the last sample of the batch
     """
     rgbs: torch.Tensor
     masks: torch.Tensor
@@ -69,6 +155,8 @@ class BatchSegmentationData:
     DTO: torch.Tensor
     K: torch.Tensor
     depths: Optional[torch.Tensor] = None
+    profile: Optional[PipelineProfile] = None
+    pipeline_state: Optional[Dict[str, Any]] = None
 
     def pin_memory(self) -> BatchSegmentationData:
         """Pin memory for the batch.
@@ -76,17 +164,17 @@ class BatchSegmentationData:
         Returns:
             BatchSegmentationData: Batch with pinned memory.
         """
-        self.rgbs = self.rgbs.pin_memory()
-        self.masks = self.masks.pin_memory()
-        self.clines_rgbs = self.clines_rgbs.pin_memory()
-        self.clines_masks = self.clines_masks.pin_memory()
-        self.bboxes = self.bboxes.pin_memory()
-        self.TCO = self.TCO.pin_memory()
-        self.DTO = self.DTO.pin_memory()
-        self.K = self.K.pin_memory()
+        self.rgbs = _pin(self.rgbs)
+        self.masks = _pin(self.masks)
+        self.clines_rgbs = _pin(self.clines_rgbs)
+        self.clines_masks = _pin(self.clines_masks)
+        self.bboxes = _pin(self.bboxes)
+        self.TCO = _pin(self.TCO)
+        self.DTO = _pin(self.DTO)
+        self.K = _pin(self.K)
         
         if self.depths is not None:
-            self.depths = self.depths.pin_memory()
+            self.depths = _pin(self.depths)
         
         return self
     
@@ -130,6 +218,10 @@ class ObjectSegmentationDataset(torch.utils.data.IterableDataset):
         depth_augmentations: Optional[SceneObservationTransform] = None,
         background_augmentations: Optional[SceneObservationTransform] = None,
         clines_dir: Optional[str] = None,
+        profile: bool = False,
+        profile_report_every: int = 100,
+        track_state: bool = False,
+        track_state_every: int = 1,
     ) -> None:
         """Initialize the ObjectSegmentationDataset.
 
@@ -156,6 +248,19 @@ class ObjectSegmentationDataset(torch.utils.data.IterableDataset):
                 to [].
             clines_dir (Optional[str], optional): Directory containing the
                 correspondences lines. Defaults to None.
+            profile (bool, optional): Whether to record the latencies of the stages of
+                the data construction. If False, nothing is measured. Defaults to
+                False.
+            profile_report_every (int, optional): Number of samples between two
+                reports of the profiler (attached to the samples). Defaults to 100.
+            track_state (bool, optional): Whether to attach to each sample the position
+                of the worker in its data stream (scene set iterator and global random
+                number generators), so that the stream can be resumed from a
+                checkpoint. Defaults to False.
+            track_state_every (int, optional): Number of samples between two captures
+                of the position of the worker. Set it to the batch size so that only
+                the last sample of each batch, whose position is kept by the collate
+                functions, captures it. Defaults to 1.
         """
         self._scene_set = scene_set
         self._min_area = min_area
@@ -174,10 +279,28 @@ class ObjectSegmentationDataset(torch.utils.data.IterableDataset):
         self._depth_augmentations = depth_augmentations
         self._background_augmentations = background_augmentations
         
-        # Timings to construct the data from the observation
-        self._timings = None
+        # Profiler of the data construction (one per worker since each worker holds
+        # its own copy of the dataset)
+        self._profiler = DataPipelineProfiler(profile_report_every)\
+            if profile else None
         
         self._clines_dir = clines_dir
+        
+        # Position of each worker in its data stream to resume from
+        self._track_state = track_state
+        self._track_state_every = track_state_every
+        self._resume_states: Optional[Dict[int, Dict[str, Any]]] = None
+    
+    def resume_from(self, worker_states: Optional[Dict[int, Dict[str, Any]]]) -> None:
+        """Set the positions from which the workers resume their data stream the next
+        time the dataset is iterated over. Workers without a saved position start a new
+        stream.
+
+        Args:
+            worker_states (Optional[Dict[int, Dict[str, Any]]]): Pipeline state of each
+                worker, keyed by worker id. If None, new streams are started.
+        """
+        self._resume_states = worker_states
     
     @staticmethod
     def collate_fn(list_data: List[SegmentationData]) -> BatchSegmentationData:
@@ -211,6 +334,8 @@ class ObjectSegmentationDataset(torch.utils.data.IterableDataset):
             TCO=torch.from_numpy(np.stack([d.TCO for d in list_data])),
             DTO=torch.from_numpy(np.stack([d.DTO for d in list_data])),
             object_datas=[d.object_data for d in list_data],
+            profile=PipelineProfile.merge_all(d.profile for d in list_data),
+            pipeline_state=list_data[-1].pipeline_state,
         )
 
         has_depth = [d.depth is not None for d in list_data]
@@ -275,6 +400,10 @@ class ObjectSegmentationDataset(torch.utils.data.IterableDataset):
 
         Returns:
             np.ndarray: Random pose perturbation represented as a transform matrix.
+        
+        Note:
+            To sample the perturbations of a whole batch at once (e.g. on the GPU),
+            see `toolbox.geometry.pose_perturbation.sample_pose_perturbations`.
         """
         DR = np.eye(3)
         Dt = np.zeros(3)
@@ -294,8 +423,8 @@ class ObjectSegmentationDataset(torch.utils.data.IterableDataset):
             # visibility)
             abs_translation_scale = rel_translation_scale * np.min([X2 - X1, Y2 - Y1])
             
-            # Sample a random axis (unit vector)
-            axis = np.random.rand(3)
+            # Sample a random axis (unit vector, uniform on the sphere)
+            axis = np.random.normal(size=3)
             axis /= np.linalg.norm(axis)
             
             # Random translation (uniform distribution in a sphere of radius
@@ -309,8 +438,8 @@ class ObjectSegmentationDataset(torch.utils.data.IterableDataset):
             angle_deg = random.uniform(-abs_rotation_scale, abs_rotation_scale)
             angle_rad = angle_deg * np.pi / 180
             
-            # Random axis (unit vector)
-            axis = np.random.rand(3)
+            # Random axis (unit vector, uniform on the sphere)
+            axis = np.random.normal(size=3)
             axis /= np.linalg.norm(axis)
             
             DR = cv2.Rodrigues(angle_rad * axis)[0]
@@ -323,13 +452,8 @@ class ObjectSegmentationDataset(torch.utils.data.IterableDataset):
         return DT
         
     
-    def _make_data_from_obs(
-        self,
-        obs: SceneObservation,
-    ) -> Union[SegmentationData, None]:
-        """Construct a SegmentationData from a SceneObservation.
-        
-        A random object in the scene is selected randomly. It is considered valid if:
+    def _select_object(self, obs: SceneObservation) -> Optional[ObjectData]:
+        """Select an object in a scene observation. It is considered valid if:
             1. It is visible enough (its visible 2D area is >= min_area) ;
             2. It belongs to the set of objects to keep (if keep_objects_set isn't
                 None).
@@ -338,31 +462,10 @@ class ObjectSegmentationDataset(torch.utils.data.IterableDataset):
             obs (SceneObservation): Scene observation.
 
         Returns:
-            Union[SegmentationData, None]: Segmentation data or None if no valid object
+            Optional[ObjectData]: The first or a random valid object, or None if no
+                object is valid.
         """
-        obs = ObjectSegmentationDataset._remove_invisible_objects(obs)
-
-        start = time.time()
-        timings = {}
-
-        # Apply the augmentations
-        s = time.time()
-        if self._background_augmentations is not None:
-            obs = self._background_augmentations(obs)
-        timings["background_augmentation"] = time.time() - s
-
-        s = time.time()
-        if self._rgb_augmentations is not None:
-            obs = self._rgb_augmentations(obs)
-        timings["rgb_augmentation"] = time.time() - s
-
-        s = time.time()
-        if self._depth_augmentations is not None:
-            obs = self._depth_augmentations(obs)
-        timings["depth_augmentation"] = time.time() - s
-
         # Get the unique visible ids in the segmentation
-        s = time.time()
         unique_ids_visible = set(np.unique(obs.segmentation))
         
         valid_objects = []
@@ -411,13 +514,58 @@ class ObjectSegmentationDataset(torch.utils.data.IterableDataset):
         
         assert object_data.bbox_modal is not None
 
-        timings["other"] = time.time() - s 
+        return object_data
+
+    def _make_data_from_obs(
+        self,
+        obs: SceneObservation,
+    ) -> Union[SegmentationData, None]:
+        """Construct a SegmentationData from a SceneObservation.
+        
+        A random object in the scene is selected randomly. It is considered valid if:
+            1. It is visible enough (its visible 2D area is >= min_area) ;
+            2. It belongs to the set of objects to keep (if keep_objects_set isn't
+                None).
+
+        Args:
+            obs (SceneObservation): Scene observation.
+
+        Returns:
+            Union[SegmentationData, None]: Segmentation data or None if no valid object
+        """
+        obs = ObjectSegmentationDataset._remove_invisible_objects(obs)
+
+        # Do not even read the clock if the data construction is not profiled
+        timer = _StageTimer() if self._profiler is not None else None
+        stage = timer.stage if timer is not None else _no_stage
+
+        # Apply the augmentations
+        with stage("background_augmentation"):
+            if self._background_augmentations is not None:
+                obs = self._background_augmentations(obs)
+
+        with stage("rgb_augmentation"):
+            if self._rgb_augmentations is not None:
+                obs = self._rgb_augmentations(obs)
+
+        with stage("depth_augmentation"):
+            if self._depth_augmentations is not None:
+                obs = self._depth_augmentations(obs)
 
+        # Select an object
+        with stage("other"):
+            object_data = self._select_object(obs)
+
+        if object_data is None:
+            return None
+
+        assert obs.rgb is not None
+        assert obs.camera_data is not None
         assert obs.camera_data.K is not None
         assert obs.camera_data.TWC is not None
         assert object_data.TWO is not None
         
-        TCO = (obs.camera_data.TWC.inverse() * object_data.TWO).matrix
+        TCO = (obs.camera_data.TWC.inverse() * object_data.TWO).matrix[0]
         
         # Sample a random pose perturbation
         if random.random() <= self._pose_perturbation_prob:
@@ -483,14 +631,13 @@ class ObjectSegmentationDataset(torch.utils.data.IterableDataset):
             )
         
         # Resize the observation
-        s = time.time()
-        if self._resize_transform is not None:
-            if self._resize_transform.__class__.__name__ ==\
-                "CropResizeToObjectTransform":
-                    obs = self._resize_transform(obs, object_data.unique_id)
-            else:
-                obs = self._resize_transform(obs)
-        timings["resize_augmentation"] = time.time() - s
+        with stage("resize_augmentation"):
+            if self._resize_transform is not None:
+                if self._resize_transform.__class__.__name__ ==\
+                    "CropResizeToObjectTransform":
+                        obs = self._resize_transform(obs, object_data.unique_id)
+                else:
+                    obs = self._resize_transform(obs)
         
         # Get the new bounding box of the object after the resize
         bbox = None
@@ -499,13 +646,8 @@ class ObjectSegmentationDataset(torch.utils.data.IterableDataset):
                 bbox = obj.bbox_modal
                 break
         
-        timings["total"] = time.time() - start
-
-        # Convert timings to milliseconds
-        for k, v in timings.items():
-            timings[k] = v * 1000
-
-        self._timings = timings
+        if timer is not None:
+            self._profiler.record(timer.timings_ms())
 
         # Add depth to SegmentationData
         data = SegmentationData(
@@ -550,6 +692,9 @@ class ObjectSegmentationDataset(torch.utils.data.IterableDataset):
             if data is not None:
                 return data
             
+            if self._profiler is not None:
+                self._profiler.reject()
+            
         raise ValueError("Cannot find valid image in the dataset")
 
     def __iter__(self) -> Iterator[SegmentationData]:
@@ -558,9 +703,210 @@ class ObjectSegmentationDataset(torch.utils.data.IterableDataset):
         Yields:
             Iterator[SegmentationData]: Iterator over the dataset.
         """
+        worker_info = torch.utils.data.get_worker_info()
+        worker_id = worker_info.id if worker_info is not None else 0
+        
+        resume_state = None
+        if self._resume_states is not None:
+            resume_state = self._resume_states.get(worker_id)
+        
+        # Restore the position of the worker in its data stream
+        if resume_state is not None:
+            random.setstate(resume_state["random"])
+            np.random.set_state(resume_state["numpy"])
+            scene_set_state = resume_state["scene_set"]
+        else:
+            scene_set_state = None
+        
         # Iterator over the scene dataset
-        iterator = iter(self._scene_set)
+        iterator = self._scene_set.iter_from_state(scene_set_state)
+        
+        # A worker yields whole batches, and a resumed stream starts at a batch
+        # boundary
+        nb_samples = 0
         
         while True:
             # Find a valid data
-            yield self._find_valid_data(iterator)
+            data = self._find_valid_data(iterator)
+            nb_samples += 1
+            
+            # Periodically ship the statistics of the worker with a sample
+            if self._profiler is not None:
+                data.profile = self._profiler.pop()
+            
+            # Capture the position once per batch, after its last sample
+            if self._track_state and nb_samples % self._track_state_every == 0:
+                data.pipeline_state = {
+                    "worker_id": worker_id,
+                    "scene_set": iterator.state_dict(),
+                    "random": random.getstate(),
+                    "numpy": np.random.get_state(),
+                }
+            
+            yield data
+
+
+class SegmentationDataCollator:
+    """
+    Collate SegmentationData samples by writing them directly into a ring of
+    preallocated (pinned) buffers. The returned batches are views into these buffers,
+    which avoids the intermediate copies of `np.stack` and the copy made when the
+    DataLoader pins the batch.
+    
+    A buffer is reused once `nb_buffers` batches have been produced since it was handed
+    out, so it must be larger than the number of batches alive at the same time (i.e.
+    `prefetch_factor` + 2 per DataLoader worker).
+    """
+    # Map the buffers names to the SegmentationData fields and the permutation applied
+    # to go from the numpy layout to the batch layout
+    _FIELDS = {
+        "rgbs": ("rgb", (2, 0, 1)),
+        "masks": ("mask", None),
+        "clines_rgbs": ("clines_rgb", (2, 0, 1)),
+        "clines_masks": ("clines_mask", None),
+        "bboxes": ("bbox", None),
+        "K": ("K", None),
+        "TCO": ("TCO", None),
+        "DTO": ("DTO", None),
+        "depths": ("depth", None),
+    }
+    
+    def __init__(
+        self,
+        batch_size: int,
+        image_size: Optional[Tuple[int, int]] = None,
+        nb_buffers: int = 4,
+        pin_memory: bool = True,
+    ) -> None:
+        """Constructor.
+
+        Args:
+            batch_size (int): Batch size of the DataLoader (number of rows of the
+                buffers).
+            image_size (Optional[Tuple[int, int]], optional): Size (height, width) of
+                the images. If None, it is inferred from the first batch. Defaults to
+                None.
+            nb_buffers (int, optional): Number of buffers in the ring. Defaults to 4.
+            pin_memory (bool, optional): Whether to allocate the buffers in page-locked
+                memory. Defaults to True.
+        """
+        self._batch_size = batch_size
+        self._image_size = tuple(image_size) if image_size is not None else None
+        self._ring = BufferRing(nb_buffers=nb_buffers, pin_memory=pin_memory)
+    
+    @staticmethod
+    def _item(data: SegmentationData, name: str) -> torch.Tensor:
+        """Get a field of a sample as a tensor in the batch layout.
+
+        Args:
+            data (SegmentationData): A sample.
+            name (str): Name of the buffer.
+
+        Returns:
+            torch.Tensor: The field of the sample (no copy).
+        """
+        field, permutation = SegmentationDataCollator._FIELDS[name]
+        item = _from_numpy(np.asarray(getattr(data, field)))
+        
+        if permutation is not None:
+            item = item.permute(*permutation)
+        
+        return item
+    
+    def _allocate(self, data: SegmentationData) -> None:
+        """Allocate the ring buffers from the shapes of a sample.
+
+        Args:
+            data (SegmentationData): A sample.
+
+        Raises:
+            ValueError: If the images of the sample do not have the configured size.
+        """
+        if self._image_size is not None and data.rgb.shape[:2] != self._image_size:
+            raise ValueError(
+                f"Expected images of size {self._image_size}, got images of size "
+                f"{data.rgb.shape[:2]}."
+            )
+        
+        specs = {}
+        
+        for name, (field, _) in SegmentationDataCollator._FIELDS.items():
+            if getattr(data, field) is None:
+                continue
+            item = SegmentationDataCollator._item(data, name)
+            specs[name] = ((self._batch_size,) + tuple(item.shape), item.dtype)
+        
+        self._ring.allocate(specs)
+    
+    def _fits(self, list_data: List[SegmentationData]) -> bool:
+        """Check whether the samples can be written in the ring buffers.
+
+        Args:
+            list_data (List[SegmentationData]): List of samples.
+
+        Returns:
+            bool: True if all the samples match the buffers shapes and data types.
+        """
+        if len(list_data) > self._batch_size:
+            return False
+        
+        for data in list_data:
+            for name, (field, _) in SegmentationDataCollator._FIELDS.items():
+                
+                # Depth is optional but must be consistent with the buffers
+                if getattr(data, field) is None:
+                    if name in self._ring.specs:
+                        return False
+                    continue
+                
+                item = SegmentationDataCollator._item(data, name)
+                
+                if not self._ring.matches(name, tuple(item.shape), item.dtype):
+                    return False
+        
+        return True
+    
+    def __call__(self, list_data: List[SegmentationData]) -> BatchSegmentationData:
+        """Collate a list of SegmentationData into a BatchSegmentationData.
+
+        Args:
+            list_data (List[SegmentationData]): List of SegmentationData.
+
+        Returns:
+            BatchSegmentationData: Batch of SegmentationData (views into the ring
+                buffers).
+        """
+        if not self._ring.allocated:
+            self._allocate(list_data[0])
+        
+        # Samples which do not fit in the buffers (e.g. no resize transform) are
+        # collated the usual way
+        if not self._fits(list_data):
+            return ObjectSegmentationDataset.collate_fn(list_data)
+        
+        buffers = self._ring.next()
+        bsz = len(list_data)
+        
+        # Write the samples directly into the buffers
+        for i, data in enumerate(list_data):
+            for name, buffer in buffers.items():
+                buffer[i].copy_(SegmentationDataCollator._item(data, name))
+        
+        batch_data = BatchSegmentationData(
+            rgbs=buffers["rgbs"][:bsz],
+            masks=buffers["masks"][:bsz],
+            clines_rgbs=buffers["clines_rgbs"][:bsz],
+            clines_masks=buffers["clines_masks"][:bsz],
+            bboxes=buffers["bboxes"][:bsz],
+            K=buffers["K"][:bsz],
+            TCO=buffers["TCO"][:bsz],
+            DTO=buffers["DTO"][:bsz],
+            object_datas=[d.object_data for d in list_data],
+            profile=PipelineProfile.merge_all(d.profile for d in list_data),
+            pipeline_state=list_data[-1].pipeline_state,
+        )
+        
+        if "depths" in buffers:
+            batch_data.depths = buffers["depths"][:bsz]
+        
+        return batch_data
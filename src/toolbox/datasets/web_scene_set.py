@@ -2,7 +2,7 @@
 from collections import defaultdict
 from functools import partial
 from pathlib import Path
-from typing import List, Dict, Union
+from typing import Any, Iterator, List, Dict, Optional, Union
 import json
 
 # Third party libraries
@@ -14,9 +14,11 @@ import io
 import pyarrow.feather as feather
 
 # Custom modules
-from toolbox.utils.webdataset import tarfile_to_samples
+from toolbox.utils.webdataset import tarfile_samples
 from toolbox.datasets.scene_set import (
     IterableSceneSet,
+    SceneSetIterator,
+    make_rng,
     SceneSet,
     SceneObservation,
     CameraData,
@@ -193,53 +195,142 @@ def load_scene_ds_obs(
 
 class IterableWebSceneSet(IterableSceneSet):
     """
-    Iterable scene set for webdataset format.
+    Iterable scene set for webdataset format. Shards are resampled with replacement and
+    their samples are shuffled in a buffer. The position in the stream (random number
+    generators and number of samples read from the current shard) can be saved and
+    restored.
     """
-    def __init__(self, web_scene_set: WebSceneSet, buffer_size: int = 1) -> None:
+    def __init__(
+        self,
+        web_scene_set: WebSceneSet,
+        buffer_size: int = 1,
+        deterministic: bool = False,
+    ) -> None:
         """Constructor.
 
         Args:
             web_scene_set (WebSceneSet): The web scene set.
             buffer_size (int, optional): Number of samples to buffer in memory
                 before shuffling. Defaults to 1.
-
-        Yields:
-            Iterator: Iterator over SceneObservation objects.
+            deterministic (bool, optional): Whether to iterate deterministically or not.
+                Defaults to False.
         """
         self.web_scene_set = web_scene_set
+        self.buffer_size = buffer_size
+        self.deterministic = deterministic
+        self.worker_seed_fn = wds.utils.pytorch_worker_seed
         
-        load_scene_ds_obs_ = partial(
+        self._load_scene_ds_obs = partial(
             load_scene_ds_obs,
             # depth_scale=self.web_scene_set.depth_scale,
             load_depth=self.web_scene_set.load_depth,
             label_format=self.web_scene_set.label_format,
             index_frame_dir=self.web_scene_set.index_frame_dir,
         )
+        
+        self._tar_list = self.web_scene_set.get_tar_list()
+    
+    def iter_from_state(
+        self,
+        state: Optional[Dict[str, Any]] = None,
+    ) -> SceneSetIterator:
+        """Iterate over the webdataset.
 
-        def load_scene_ds_obs_iterator(
-            samples,
-        ):
-            for sample in samples:
-                yield load_scene_ds_obs_(sample)
-
-        # Create the webdataset Pipeline (wds.Dataset is a shorthand for writing down
-        # pipelines, but the underlying pipeline is an instance of wds.DataPipeline)
-        self.datapipeline = wds.DataPipeline(
-            # Sample from the shards
-            wds.ResampledShards(self.web_scene_set.get_tar_list()),
-            
-            # FIXME: Should we split by worker here? cf webdataset github
-            # wds.split_by_worker,
+        When resuming, the samples already read from the current shard are skipped
+        without being decoded, and the samples that were in the shuffle buffer when the
+        state was saved are not replayed.
+
+        Args:
+            state (Optional[Dict[str, Any]], optional): State of a previous iterator to
+                resume from. Defaults to None.
+
+        Returns:
+            SceneSetIterator: An iterator over SceneObservation objects.
+        """
+        return SceneSetIterator(self._generate, state)
+    
+    def _samples(
+        self,
+        live_state: Dict[str, Any],
+        resume_state: Optional[Dict[str, Any]],
+    ) -> Iterator[Dict[str, Union[bytes, str]]]:
+        """Read the raw samples of randomly drawn shards.
+
+        Args:
+            live_state (Dict[str, Any]): State of the iteration, kept up to date.
+            resume_state (Optional[Dict[str, Any]]): State to resume from.
+
+        Yields:
+            Iterator[Dict[str, Union[bytes, str]]]: Raw webdataset samples.
+        """
+        shard_rng = make_rng(
+            resume_state["shard_rng"] if resume_state is not None else None,
+            self.worker_seed_fn,
+            deterministic=self.deterministic,
+        )
+        nb_samples_to_skip =\
+            resume_state["nb_samples_read"] if resume_state is not None else 0
+        
+        while True:
+            # State of the generator before drawing the shard, so that the same shard is
+            # drawn again when resuming
+            live_state["shard_rng"] = shard_rng.getstate()
+            live_state["nb_samples_read"] = 0
             
-            # Extract samples from the tar file
-            tarfile_to_samples(),
+            url = shard_rng.choice(self._tar_list)
             
-            # Convert a sample to a SceneObservation
-            load_scene_ds_obs_iterator,
+            for sample in tarfile_samples([dict(url=url)]):
+                live_state["nb_samples_read"] += 1
+                
+                if nb_samples_to_skip > 0:
+                    nb_samples_to_skip -= 1
+                    continue
+                
+                yield sample
             
-            # Shuffle the samples
-            wds.shuffle(buffer_size),
-        )
+            nb_samples_to_skip = 0
+    
+    def _generate(
+        self,
+        live_state: Dict[str, Any],
+        resume_state: Optional[Dict[str, Any]],
+    ) -> Iterator[SceneObservation]:
+        """Decode and shuffle the samples of the webdataset (the shuffle follows
+        `webdataset.shuffle`).
+
+        Args:
+            live_state (Dict[str, Any]): State of the iteration, kept up to date.
+            resume_state (Optional[Dict[str, Any]]): State to resume from.
 
-    def __iter__(self):
-        return iter(self.datapipeline)
+        Yields:
+            Iterator[SceneObservation]: An iterator over SceneObservation objects.
+        """
+        rng = make_rng(
+            resume_state["shuffle_rng"] if resume_state is not None else None,
+            self.worker_seed_fn,
+            deterministic=self.deterministic,
+        )
+        live_state["shuffle_rng"] = rng
+        
+        samples = self._samples(live_state, resume_state)
+        
+        # Start streaming right away when resuming instead of waiting for the buffer to
+        # fill up again
+        initial = 1 if resume_state is not None else min(100, self.buffer_size)
+        buffer = []
+        
+        def pick() -> SceneObservation:
+            k = rng.randint(0, len(buffer) - 1)
+            sample = buffer[k]
+            buffer[k] = buffer[-1]
+            buffer.pop()
+            return sample
+        
+        for sample in samples:
+            buffer.append(self._load_scene_ds_obs(sample))
+            
+            if len(buffer) < self.buffer_size:
+                buffer.append(self._load_scene_ds_obs(next(samples)))
+            
+            if len(buffer) >= initial:
+                yield pick()
@@ -1,15 +1,15 @@
 # Standard libraries
 from pathlib import Path
-from typing import Optional, List
+from typing import Dict, Optional, List, Tuple
 
 # Third-party libraries
 import torch
-from torchvision import transforms
-import PIL
 import numpy as np
-from omegaconf import DictConfig
+from omegaconf import DictConfig, OmegaConf
 
 # Custom modules
+from toolbox.evaluation.frame_cache import FrameCache, read_poses_file
+from toolbox.evaluation.sequence_index import SequenceIndex, load_sequence_index
 from toolbox.evaluation.crop_resize_transform import CropResizeToAspectTransform
 from toolbox.evaluation.sequence_segmentation_dataset import (
     SequenceSegmentationData,
@@ -28,6 +28,8 @@ class BCOT(torch.utils.data.Dataset):
         frames_per_sequence: int = 5,
         step_between_frames: int = 1,
         transformations_cfg: Optional[DictConfig] = None,
+        frame_cache_max_bytes: int = 0,
+        use_sequence_index: bool = True,
     ) -> None:
         """Constructor.
 
@@ -41,12 +43,20 @@ class BCOT(torch.utils.data.Dataset):
                 to 1.
             transformations_cfg (Optional[DictConfig], optional): Configuration for the
                 transformations to apply to the data. Defaults to None.
+            frame_cache_max_bytes (int, optional): Maximum memory footprint of the
+                decoded frames kept in memory (per process). If 0, frames are decoded
+                at every access. Defaults to 0.
+            use_sequence_index (bool, optional): Whether to load the sequences and the
+                ground truth from the index saved next to the root directory (built at
+                the first instantiation, and rebuilt if the dataset has changed) rather
+                than walking the dataset. Defaults to True.
         """
         self._root = Path(root)
         self._scenes_models_dict = scenes_models_dict
         self._frames_per_sequence = frames_per_sequence
         self._step_between_frames = step_between_frames
         self._resize_transform = None
+        self._frame_cache = FrameCache(max_bytes=frame_cache_max_bytes)
         
         # Resize transform
         if isinstance(transformations_cfg, DictConfig)\
@@ -59,8 +69,61 @@ class BCOT(torch.utils.data.Dataset):
         # frames
         self._sequences_frames_idx = {}
         
+        # Ground truth poses and camera intrinsics (parsed once)
+        self._poses: Dict[Path, np.ndarray] = {}
+        self._K: Dict[Path, np.ndarray] = {}
+        
+        # Directories listed and files parsed to load the sequences
+        self._index_dependencies: List[Path] = []
+        
+        if use_sequence_index:
+            index = load_sequence_index(
+                self._root,
+                params=self._index_params(),
+                build=self._build_index,
+            )
+        else:
+            index, _ = self._build_index()
+        
+        self._sequences_frames_idx = index.sequences_frames
+        self._poses = index.poses
+        self._K = index.K
+    
+    def _index_params(self) -> dict:
+        """Get the parameters determining the sequences of the dataset.
+
+        Returns:
+            dict: The parameters (JSON serializable).
+        """
+        scenes_models_dict = self._scenes_models_dict
+        if isinstance(scenes_models_dict, DictConfig):
+            scenes_models_dict = OmegaConf.to_container(scenes_models_dict)
+        
+        return {
+            "dataset": type(self).__name__,
+            "scenes_models_dict": scenes_models_dict,
+            "frames_per_sequence": self._frames_per_sequence,
+            "step_between_frames": self._step_between_frames,
+        }
+    
+    def _build_index(self) -> Tuple[SequenceIndex, List[Path]]:
+        """Walk the dataset to load the sequences and parse their ground truth.
+
+        Returns:
+            Tuple[SequenceIndex, List[Path]]: Sequences and ground truth of the
+                dataset, and directories listed and files parsed to get them.
+        """
         # Fill the dictionary with the sequences and their corresponding frames
         self._load_sequences()
+        self._load_ground_truth()
+        
+        index = SequenceIndex(
+            sequences_frames=self._sequences_frames_idx,
+            poses=self._poses,
+            K=self._K,
+        )
+        
+        return index, self._index_dependencies
         
     def _load_sequences(self) -> None:
         """Load the sequences of frames.
@@ -79,6 +142,7 @@ class BCOT(torch.utils.data.Dataset):
         # Get the paths of the scenes
         scenes = [scene for scene in self._root.iterdir() if scene.is_dir()
                   and scene.name != "models"]
+        self._index_dependencies.append(self._root)
         
         # Filter the scenes if needed
         if self._scenes_models_dict is not None:
@@ -95,6 +159,7 @@ class BCOT(torch.utils.data.Dataset):
             
             # Get the paths of the models
             models = [model for model in scene.iterdir() if model.is_dir()]
+            self._index_dependencies.append(scene)
             
             # Filter the models if needed
             if self._scenes_models_dict is not None:
@@ -112,6 +177,7 @@ class BCOT(torch.utils.data.Dataset):
                 # Get the paths of the frames
                 frames = [frame for frame in model.iterdir() if frame.is_file()
                           and frame.suffix == ".png"]
+                self._index_dependencies.append(model)
                 
                 if len(frames) < self._frames_per_sequence:
                     continue
@@ -134,6 +200,33 @@ class BCOT(torch.utils.data.Dataset):
                         self._sequences_frames_idx[len(self._sequences_frames_idx)] =\
                             sequence
                     
+    def _load_ground_truth(self) -> None:
+        """
+        Parse the ground truth poses and the camera intrinsics of the sequences.
+        """
+        for sequence in self._sequences_frames_idx.values():
+            
+            model = sequence[0].parent
+            scene = model.parent
+            
+            if model not in self._poses:
+                self._poses[model] = read_poses_file(model / "pose.txt")
+                self._index_dependencies.append(model / "pose.txt")
+            
+            if scene in self._K:
+                continue
+            
+            self._index_dependencies.append(scene / "K.txt")
+            
+            with open(scene / "K.txt", "r") as f:
+                line = f.readline()
+            
+            K = np.array(
+                line[line.find("(")+1:line.find(")")].split(", "),
+                dtype=np.float32,
+            ).reshape(3, 3)
+            self._K[scene] = K
+    
     def __len__(self) -> int:
         """Get the number of sequences.
 
@@ -157,53 +250,23 @@ class BCOT(torch.utils.data.Dataset):
         if idx not in self._sequences_frames_idx.keys():
             raise ValueError(f"No sequence found at index {idx}.")
         
-        # Load the sequence of frames
-        rgbs = torch.stack([
-            transforms.ToTensor()(PIL.Image.open(frame))
-            for frame in self._sequences_frames_idx[idx]
-        ])
+        frames = self._sequences_frames_idx[idx]
         
-        # Convert images from float32 to uint8
-        rgbs = (rgbs * 255).to(torch.uint8)
+        # Load the sequence of frames (decoded as uint8)
+        rgbs = torch.stack([self._frame_cache.get(frame) for frame in frames])
         
         # Get the indices of the frames in order to retrieve the associated
         # ground truth poses
-        images_idx = [int(frame.stem) for frame in self._sequences_frames_idx[idx]]
-        
-        # Initialize the ground truth transformation matrices
-        TCO = torch.eye(4, dtype=torch.float32).repeat(self._frames_per_sequence, 1, 1)
-        
-        # Load the ground truth poses
-        poses_file = self._sequences_frames_idx[idx][0].parent / "pose.txt"
-        
-        with open(poses_file, "r") as f:
-            lines = f.readlines()
-        
-        poses = np.array([
-            np.array(lines[idx].strip("\t\n").split("\t"),
-                     dtype=np.float32) for idx in images_idx
-        ])
-        
-        # Store the ground truth poses
-        TCO[:, :3, :3] = torch.tensor(poses[:, :9].reshape(-1, 3, 3))  # Rotation
-        TCO[:, :3, 3] = torch.tensor(poses[:, 9:].reshape(-1, 3))  # Translation
-        
-        # Retrive the camera intrinsics
-        camera_intrinsics_file = self._sequences_frames_idx[idx][0].parents[1] / "K.txt"
-        
-        with open(camera_intrinsics_file, "r") as f:
-            line = f.readline()
+        images_idx = [int(frame.stem) for frame in frames]
         
-        K = np.array(
-            line[line.find("(")+1:line.find(")")].split(", "),
-            dtype=np.float32,
-        ).reshape(3, 3)
-        K = torch.tensor(K, dtype=torch.float32)
+        # Get the ground truth poses and the camera intrinsics
+        TCO = torch.from_numpy(self._poses[frames[0].parent][images_idx])
+        K = torch.tensor(self._K[frames[0].parent.parent], dtype=torch.float32)
         
         # Get the object label
-        object_label = self._sequences_frames_idx[idx][0].parent.name
+        object_label = frames[0].parent.name
         # Get the scene label
-        scene_label = self._sequences_frames_idx[idx][0].parent.parent.name
+        scene_label = frames[0].parent.parent.name
         
         sample = SequenceSegmentationData(
             rgbs=rgbs,
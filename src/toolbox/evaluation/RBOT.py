@@ -1,15 +1,15 @@
 # Standard libraries
 from pathlib import Path
-from typing import Optional, List
+from typing import Dict, Optional, List, Tuple
 
 # Third-party libraries
 import torch
-from torchvision import transforms
-import PIL
 import numpy as np
-from omegaconf import DictConfig
+from omegaconf import DictConfig, OmegaConf
 
 # Custom modules
+from toolbox.evaluation.frame_cache import FrameCache, read_poses_file
+from toolbox.evaluation.sequence_index import SequenceIndex, load_sequence_index
 from toolbox.evaluation.crop_resize_transform import CropResizeToAspectTransform
 from toolbox.evaluation.sequence_segmentation_dataset import (
     SequenceSegmentationData,
@@ -28,6 +28,8 @@ class RBOT(torch.utils.data.Dataset):
         frames_per_sequence: int = 5,
         step_between_frames: int = 1,
         transformations_cfg: Optional[DictConfig] = None,
+        frame_cache_max_bytes: int = 0,
+        use_sequence_index: bool = True,
     ) -> None:
         """Constructor.
 
@@ -41,12 +43,20 @@ class RBOT(torch.utils.data.Dataset):
                 to 1.
             transformations_cfg (Optional[DictConfig], optional): Configuration for the
                 transformations to apply to the data. Defaults to None.
+            frame_cache_max_bytes (int, optional): Maximum memory footprint of the
+                decoded frames kept in memory (per process). If 0, frames are decoded
+                at every access. Defaults to 0.
+            use_sequence_index (bool, optional): Whether to load the sequences and the
+                ground truth from the index saved next to the root directory (built at
+                the first instantiation, and rebuilt if the dataset has changed) rather
+                than walking the dataset. Defaults to True.
         """
         self._root = Path(root)
         self._scenes_models_dict = scenes_models_dict
         self._frames_per_sequence = frames_per_sequence
         self._step_between_frames = step_between_frames
         self._resize_transform = None
+        self._frame_cache = FrameCache(max_bytes=frame_cache_max_bytes)
         
         # Resize transform
         if isinstance(transformations_cfg, DictConfig)\
@@ -59,8 +69,61 @@ class RBOT(torch.utils.data.Dataset):
         # frames
         self._sequences_frames_idx = {}
         
+        # Ground truth poses and camera intrinsics (parsed once)
+        self._poses: Dict[Path, np.ndarray] = {}
+        self._K: Dict[Path, np.ndarray] = {}
+        
+        # Directories listed and files parsed to load the sequences
+        self._index_dependencies: List[Path] = []
+        
+        if use_sequence_index:
+            index = load_sequence_index(
+                self._root,
+                params=self._index_params(),
+                build=self._build_index,
+            )
+        else:
+            index, _ = self._build_index()
+        
+        self._sequences_frames_idx = index.sequences_frames
+        self._poses = index.poses
+        self._K = index.K
+    
+    def _index_params(self) -> dict:
+        """Get the parameters determining the sequences of the dataset.
+
+        Returns:
+            dict: The parameters (JSON serializable).
+        """
+        scenes_models_dict = self._scenes_models_dict
+        if isinstance(scenes_models_dict, DictConfig):
+            scenes_models_dict = OmegaConf.to_container(scenes_models_dict)
+        
+        return {
+            "dataset": type(self).__name__,
+            "scenes_models_dict": scenes_models_dict,
+            "frames_per_sequence": self._frames_per_sequence,
+            "step_between_frames": self._step_between_frames,
+        }
+    
+    def _build_index(self) -> Tuple[SequenceIndex, List[Path]]:
+        """Walk the dataset to load the sequences and parse their ground truth.
+
+        Returns:
+            Tuple[SequenceIndex, List[Path]]: Sequences and ground truth of the
+                dataset, and directories listed and files parsed to get them.
+        """
         # Fill the dictionary with the sequences and their corresponding frames
         self._load_sequences()
+        self._load_ground_truth()
+        
+        index = SequenceIndex(
+            sequences_frames=self._sequences_frames_idx,
+            poses=self._poses,
+            K=self._K,
+        )
+        
+        return index, self._index_dependencies
         
     def _load_sequences(self) -> None:
         """Load the sequences of frames.
@@ -92,6 +155,7 @@ class RBOT(torch.utils.data.Dataset):
         
         # Get the paths of the models
         models = [model for model in self._root.iterdir() if model.is_dir()]
+        self._index_dependencies.append(self._root)
         
         # Filter the models if needed
         if models_scenes_dict is not None:
@@ -124,6 +188,7 @@ class RBOT(torch.utils.data.Dataset):
                 # Get the paths of the frames
                 frames_dir = model / "frames/"
                 frames = list(frames_dir.glob(f"{scene}*.png"))
+                self._index_dependencies.append(frames_dir)
                 
                 if len(frames) < self._frames_per_sequence:
                     continue
@@ -146,6 +211,41 @@ class RBOT(torch.utils.data.Dataset):
                         self._sequences_frames_idx[len(self._sequences_frames_idx)] =\
                             sequence
                     
+    def _load_ground_truth(self) -> None:
+        """
+        Parse the ground truth poses and the camera intrinsics of the sequences.
+        """
+        for sequence in self._sequences_frames_idx.values():
+            
+            # Poses and intrinsics are shared by all the models
+            root = sequence[0].parents[2]
+            
+            if root in self._poses:
+                continue
+            
+            self._index_dependencies += [
+                root / "poses_first.txt",
+                root / "camera_calibration.txt",
+            ]
+            
+            self._poses[root] = read_poses_file(
+                root / "poses_first.txt",
+                skip_header=True,
+            )
+            
+            with open(root / "camera_calibration.txt", "r") as f:
+                f.readline()  # Skip the first line
+                line = f.readline()
+            
+            fx, fy, cx, cy = line.split("\t")[:4]
+            
+            K = np.array([
+                [float(fx), 0, float(cx)],
+                [0, float(fy), float(cy)],
+                [0, 0, 1],
+            ])
+            self._K[root] = K.astype(np.float32)
+    
     def __len__(self) -> int:
         """Get the number of sequences.
 
@@ -169,83 +269,24 @@ class RBOT(torch.utils.data.Dataset):
         if idx not in self._sequences_frames_idx.keys():
             raise ValueError(f"No sequence found at index {idx}.")
         
-        # Load the sequence of frames
-        rgbs = torch.stack([
-            transforms.ToTensor()(PIL.Image.open(frame))
-            for frame in self._sequences_frames_idx[idx]
-        ])
+        frames = self._sequences_frames_idx[idx]
         
-        # Convert images from float32 to uint8
-        rgbs = (rgbs * 255).to(torch.uint8)
+        # Load the sequence of frames (decoded as uint8)
+        rgbs = torch.stack([self._frame_cache.get(frame) for frame in frames])
         
         # Get the indices of the frames in order to retrieve the associated
         # ground truth poses
-        images_idx = [int(frame.stem[-4:]) for frame in self._sequences_frames_idx[idx]]
-        
-        # Initialize the ground truth transformation matrices
-        TCO = torch.eye(4, dtype=torch.float32).repeat(self._frames_per_sequence, 1, 1)
-        
-        # Load the ground truth poses
-        poses_file = self._sequences_frames_idx[idx][0].parents[2] / "poses_first.txt"
-        
-        with open(poses_file, "r") as f:
-            f.readline()  # Skip the first line
-            lines = f.readlines()
-        
-        poses = np.array([
-            np.array(lines[idx].strip("\n").split("\t"),
-                     dtype=np.float32) for idx in images_idx
-        ])
-        
-        # Store the ground truth poses
-        TCO[:, :3, :3] = torch.tensor(poses[:, :9].reshape(-1, 3, 3))  # Rotation
-        TCO[:, :3, 3] = torch.tensor(poses[:, 9:].reshape(-1, 3))  # Translation
-        
-        
-        # Initialize the ground truth transformation matrices for the occluding object
-        TCO_occluder =\
-            torch.eye(4, dtype=torch.float32).repeat(self._frames_per_sequence, 1, 1)
-        
-        # Load the poses of the occluding object
-        poses_occluder_file =\
-            self._sequences_frames_idx[idx][0].parents[2] / "poses_second.txt"
-        
-        with open(poses_occluder_file, "r") as f:
-            f.readline()  # Skip the first line
-            lines = f.readlines()
-        
-        poses_occluder = np.array([
-            np.array(lines[idx].strip("\n").split("\t"),
-                     dtype=np.float32) for idx in images_idx
-        ])
-        
-        # Store the ground truth poses
-        TCO_occluder[:, :3, :3] =\
-            torch.tensor(poses_occluder[:, :9].reshape(-1, 3, 3))  # Rotation
-        TCO_occluder[:, :3, 3] =\
-            torch.tensor(poses_occluder[:, 9:].reshape(-1, 3))  # Translation
-
-        # Retrive the camera intrinsics
-        camera_intrinsics_file =\
-            self._sequences_frames_idx[idx][0].parents[2] / "camera_calibration.txt"
-        
-        with open(camera_intrinsics_file, "r") as f:
-            f.readline()  # Skip the first line
-            line = f.readline()
-    
-        fx, fy, cx, cy = line.split("\t")[:4]
+        images_idx = [int(frame.stem[-4:]) for frame in frames]
         
-        K = np.array([
-            [float(fx), 0, float(cx)],
-            [0, float(fy), float(cy)],
-            [0, 0, 1],
-        ])
-        K = torch.tensor(K, dtype=torch.float32)
+        # Get the ground truth poses and the camera intrinsics
+        root = frames[0].parents[2]
+        TCO = torch.from_numpy(self._poses[root][images_idx])
+        K = torch.tensor(self._K[root], dtype=torch.float32)
         
         # Get the object label
-        object_label = self._sequences_frames_idx[idx][0].parents[1].name
+        object_label = frames[0].parents[1].name
         # Get the scene label
-        scene_label = self._sequences_frames_idx[idx][0].name[:-8]
+        scene_label = frames[0].name[:-8]
         
         sample = SequenceSegmentationData(
             rgbs=rgbs,
@@ -0,0 +1,156 @@
+"""
+Loading of the frames and ground truth files of the evaluation datasets. Frames are
+decoded straight to uint8 tensors and kept in a bounded LRU cache shared by all the
+sequences of a dataset, so that a frame used by several sequences (or evaluated again)
+is only decoded once. Text files of poses are parsed once into arrays.
+"""
+# Standard libraries
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict
+
+# Third-party libraries
+import numpy as np
+import torch
+from torchvision.io import ImageReadMode, read_image
+
+
+def read_rgb(path: Path) -> torch.Tensor:
+    """Decode an image file into an RGB uint8 tensor.
+
+    Args:
+        path (Path): Path of the image.
+
+    Returns:
+        torch.Tensor: The image, of shape (3, H, W) (uint8).
+    """
+    return read_image(str(path), mode=ImageReadMode.RGB)
+
+
+def read_poses_file(path: Path, skip_header: bool = False) -> np.ndarray:
+    """Parse a text file of poses, one pose per line given by the 9 coefficients of its
+    rotation matrix (row-major) followed by its translation, separated by tabs.
+
+    Args:
+        path (Path): Path of the poses file.
+        skip_header (bool, optional): Whether the first line is a header. Defaults to
+            False.
+
+    Returns:
+        np.ndarray: The poses, of shape (N, 4, 4) (float32).
+    """
+    with open(path, "r") as f:
+        if skip_header:
+            f.readline()
+        lines = [line.strip("\t\n") for line in f]
+
+    values = np.array(
+        [line.split("\t") for line in lines if line],
+        dtype=np.float32,
+    )
+
+    poses = np.tile(np.eye(4, dtype=np.float32), (len(values), 1, 1))
+    poses[:, :3, :3] = values[:, :9].reshape(-1, 3, 3)  # Rotation
+    poses[:, :3, 3] = values[:, 9:12]  # Translation
+
+    return poses
+
+
+class FrameCache:
+    """
+    LRU cache of decoded frames keyed by their path. The least recently used frames are
+    evicted when the memory footprint of the cached frames exceeds the limit.
+    """
+    def __init__(self, max_bytes: int = 0) -> None:
+        """Constructor.
+
+        Args:
+            max_bytes (int, optional): Maximum memory footprint of the cached frames.
+                If 0, frames are not cached. Defaults to 0.
+        """
+        self._max_bytes = max_bytes
+
+        self._frames: OrderedDict[Path, torch.Tensor] = OrderedDict()
+        self._total_nbytes = 0
+
+        self.nb_hits = 0
+        self.nb_misses = 0
+        self.nb_evictions = 0
+
+    def __len__(self) -> int:
+        """Get the number of frames in the cache.
+
+        Returns:
+            int: Number of cached frames.
+        """
+        return len(self._frames)
+
+    @property
+    def nbytes(self) -> int:
+        """Get the memory footprint of the cached frames.
+
+        Returns:
+            int: Number of bytes used by the cached frames.
+        """
+        return self._total_nbytes
+
+    def _evict(self) -> None:
+        """
+        Evict the least recently used frames until the cache fits in its limit.
+        """
+        while self._frames and self._total_nbytes > self._max_bytes:
+            _, frame = self._frames.popitem(last=False)
+            self._total_nbytes -= frame.numel() * frame.element_size()
+            self.nb_evictions += 1
+
+    def get(self, path: Path) -> torch.Tensor:
+        """Get a frame, decoding it if it is not in the cache. The returned tensor is
+        shared with the cache and must not be modified in place.
+
+        Args:
+            path (Path): Path of the frame.
+
+        Returns:
+            torch.Tensor: The frame, of shape (3, H, W) (uint8).
+        """
+        frame = self._frames.get(path)
+
+        if frame is not None:
+            self.nb_hits += 1
+            self._frames.move_to_end(path)
+            return frame
+
+        self.nb_misses += 1
+        frame = read_rgb(path)
+
+        if self._max_bytes > 0:
+            self._frames[path] = frame
+            self._total_nbytes += frame.numel() * frame.element_size()
+            self._evict()
+
+        return frame
+
+    def stats(self) -> Dict[str, float]:
+        """Get the statistics of the cache.
+
+        Returns:
+            Dict[str, float]: Number of hits, misses and evictions, hit rate, number
+                of entries and memory footprint.
+        """
+        nb_lookups = self.nb_hits + self.nb_misses
+
+        return {
+            "nb_hits": float(self.nb_hits),
+            "nb_misses": float(self.nb_misses),
+            "nb_evictions": float(self.nb_evictions),
+            "hit_rate": self.nb_hits / nb_lookups if nb_lookups > 0 else 0.0,
+            "nb_entries": float(len(self._frames)),
+            "nbytes": float(self._total_nbytes),
+        }
+
+    def clear(self) -> None:
+        """
+        Empty the cache (the statistics are kept).
+        """
+        self._frames.clear()
+        self._total_nbytes = 0
@@ -0,0 +1,294 @@
+"""
+Persistent on-disk cache of rendered ground truth masks. Poses and meshes of the
+evaluation datasets are fixed, so the ground truth masks only need to be rendered once:
+they are stored bit-packed in an append-only file of fixed-size records, which is
+memory-mapped when read.
+"""
+# Standard libraries
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import fcntl
+import hashlib
+import json
+import os
+
+# Third-party libraries
+import numpy as np
+import torch
+
+# Custom modules
+from toolbox.datasets.object_set import RigidObjectSet
+
+
+def object_set_digest(
+    object_set_cfg: Dict[str, Any],
+    object_set: RigidObjectSet,
+) -> str:
+    """Get a digest of the configuration of an object set and of its mesh files (path,
+    modification time and size), to be added to the rendering settings so that masks
+    cached before the meshes changed are not reused.
+
+    Args:
+        object_set_cfg (Dict[str, Any]): Configuration of the object set.
+        object_set (RigidObjectSet): The object set.
+
+    Returns:
+        str: The digest.
+    """
+    meshes = []
+    for obj in sorted(object_set.objects, key=lambda obj: obj.label):
+        for path in (obj.mesh_path, obj.baked_mesh_path):
+            if path is None:
+                continue
+            stat = os.stat(path)
+            meshes.append([obj.label, str(path), stat.st_mtime_ns, stat.st_size])
+
+    digest = hashlib.sha1(
+        json.dumps(
+            {"cfg": object_set_cfg, "meshes": meshes},
+            sort_keys=True,
+            default=str,
+        ).encode()
+    ).hexdigest()[:16]
+
+    return digest
+
+
+class GTMaskCache:
+    """
+    Cache of binary masks keyed by a digest of what determines them (dataset, object,
+    pose of the frame, intrinsics, image size and rendering settings). A cache directory
+    holds one records file (`masks.bin`) and one index file (`index.txt`, one
+    "<key> <record>" line per mask) per image size. Writes are serialized with a file
+    lock so that several evaluation processes can share a cache.
+    """
+    def __init__(
+        self,
+        cache_dir: str,
+        namespace: str,
+        image_size: Tuple[int, int],
+    ) -> None:
+        """Constructor.
+
+        Args:
+            cache_dir (str): Root directory of the cache.
+            namespace (str): Name of the dataset (or any string separating caches that
+                must not be mixed).
+            image_size (Tuple[int, int]): Size (height, width) of the masks.
+        """
+        self._image_size = tuple(image_size)
+        self._namespace = namespace
+
+        height, width = self._image_size
+        self._dir = Path(cache_dir) / namespace / f"{height}x{width}"
+        self._dir.mkdir(parents=True, exist_ok=True)
+
+        self._records_path = self._dir / "masks.bin"
+        self._index_path = self._dir / "index.txt"
+        self._lock_path = self._dir / "lock"
+
+        # Size of a bit-packed mask
+        self._record_size = (height * width + 7) // 8
+
+        self._index: Dict[str, int] = {}
+        self._records: Optional[np.memmap] = None
+
+        self.nb_hits = 0
+        self.nb_misses = 0
+
+        self._load_index()
+
+    def _load_index(self) -> None:
+        """
+        (Re)load the index of the cache (it may have been extended by other processes).
+        """
+        if not self._index_path.exists():
+            return
+
+        with open(self._index_path, "r") as f:
+            for line in f:
+                fields = line.split()
+
+                # Ignore a line being written by another process
+                if len(fields) == 2:
+                    self._index[fields[0]] = int(fields[1])
+
+    def _map_records(self) -> np.ndarray:
+        """Memory-map the records file (again if it has grown).
+
+        Returns:
+            np.ndarray: Bit-packed masks, of shape (N, record_size).
+        """
+        nb_records = self._records_path.stat().st_size // self._record_size\
+            if self._records_path.exists() else 0
+
+        if self._records is None or len(self._records) < nb_records:
+            self._records = np.memmap(
+                self._records_path,
+                dtype=np.uint8,
+                mode="r",
+                shape=(nb_records, self._record_size),
+            ) if nb_records > 0 else None
+
+        return self._records
+
+    def make_keys(
+        self,
+        object_label: str,
+        TCO: torch.Tensor,
+        K: torch.Tensor,
+        settings: str = "",
+    ) -> List[str]:
+        """Compute the keys of the masks of a sequence of frames.
+
+        Args:
+            object_label (str): Label of the object.
+            TCO (torch.Tensor): Poses of the object, of shape (T, 4, 4).
+            K (torch.Tensor): Intrinsics matrix, of shape (3, 3).
+            settings (str, optional): Description of the rendering settings (masks
+                rendered with different settings are cached separately). Defaults to "".
+
+        Returns:
+            List[str]: Key of the mask of each frame.
+        """
+        TCO = TCO.detach().to(device="cpu", dtype=torch.float32).numpy()
+        K = K.detach().to(device="cpu", dtype=torch.float32).numpy()
+
+        prefix = hashlib.sha1()
+        prefix.update(
+            f"{self._namespace}|{object_label}|{self._image_size}|{settings}".encode()
+        )
+        prefix.update(K.tobytes())
+
+        keys = []
+
+        for pose in TCO:
+            digest = prefix.copy()
+            digest.update(pose.tobytes())
+            keys.append(digest.hexdigest())
+
+        return keys
+
+    def get(self, keys: List[str]) -> Tuple[Dict[int, torch.Tensor], List[int]]:
+        """Get the cached masks.
+
+        Args:
+            keys (List[str]): Keys of the masks.
+
+        Returns:
+            Tuple[Dict[int, torch.Tensor], List[int]]: Cached masks (H, W) (bool) by
+                position in `keys`, and positions of the masks not in the cache.
+        """
+        if any(key not in self._index for key in keys):
+            self._load_index()
+
+        records = self._map_records()
+        height, width = self._image_size
+
+        masks = {}
+        missing = []
+
+        for i, key in enumerate(keys):
+            record = self._index.get(key)
+
+            if record is None or records is None or record >= len(records):
+                missing.append(i)
+                continue
+
+            mask = np.unpackbits(records[record], count=height * width)
+            masks[i] = torch.from_numpy(mask.reshape(height, width).astype(bool))
+
+        self.nb_hits += len(masks)
+        self.nb_misses += len(missing)
+
+        return masks, missing
+
+    def put(self, keys: List[str], masks: torch.Tensor) -> None:
+        """Store masks in the cache.
+
+        Args:
+            keys (List[str]): Keys of the masks.
+            masks (torch.Tensor): Binary masks, of shape (N, H, W).
+        """
+        packed = np.packbits(
+            masks.detach().bool().cpu().numpy().reshape(len(keys), -1),
+            axis=1,
+        )
+
+        with open(self._lock_path, "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+
+            try:
+                # Another process may have stored some of the masks in the meantime
+                self._load_index()
+
+                with open(self._records_path, "ab") as f:
+                    first_record = f.seek(0, os.SEEK_END) // self._record_size
+                    new_keys = []
+
+                    for key, record in zip(keys, packed):
+                        if key in self._index or key in new_keys:
+                            continue
+                        f.write(record.tobytes())
+                        new_keys.append(key)
+
+                with open(self._index_path, "a") as f:
+                    for i, key in enumerate(new_keys):
+                        f.write(f"{key} {first_record + i}\n")
+                        self._index[key] = first_record + i
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def get_or_render(
+        self,
+        keys: List[str],
+        render_fn: Callable[[List[int]], torch.Tensor],
+        device: Optional[torch.device] = None,
+    ) -> torch.Tensor:
+        """Get masks from the cache, rendering (and caching) the missing ones.
+
+        Args:
+            keys (List[str]): Keys of the masks.
+            render_fn (Callable[[List[int]], torch.Tensor]): Function rendering the
+                masks at the given positions of `keys`, as a (N, H, W) tensor.
+            device (Optional[torch.device], optional): Device of the returned masks.
+                Defaults to None (device of the rendered masks, or CPU).
+
+        Returns:
+            torch.Tensor: Masks, of shape (len(keys), H, W) (float32).
+        """
+        cached, missing = self.get(keys)
+
+        rendered = None
+        if missing:
+            rendered = render_fn(missing)
+            self.put([keys[i] for i in missing], rendered > 0)
+
+            if device is None:
+                device = rendered.device
+
+        masks = torch.empty(
+            (len(keys), *self._image_size),
+            dtype=torch.float32,
+            device=device,
+        )
+
+        for i, mask in cached.items():
+            masks[i] = mask.to(device=masks.device)
+
+        if rendered is not None:
+            masks[missing] = (rendered > 0).to(device=masks.device, dtype=torch.float32)
+
+        return masks
+
+    def stats(self) -> Dict[str, float]:
+        """Get the statistics of the cache.
+
+        Returns:
+            Dict[str, float]: Number of hits and misses, and number of cached masks.
+        """
+        return {
+            "nb_hits": float(self.nb_hits),
+            "nb_misses": float(self.nb_misses),
+            "nb_entries": float(len(self._index)),
+        }
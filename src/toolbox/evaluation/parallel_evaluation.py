@@ -0,0 +1,364 @@
+"""
+Evaluation of a model on sequences sharded across several worker processes. Each worker
+instantiates its own dataset and model replica, evaluates every `nb_shards`-th sequence,
+and streams one row per sequence (labels, errors and timings) to its own append-only
+Arrow IPC file. Once all the workers are done, their files are merged into a single
+Parquet table (and the histograms of the predicted probabilities accumulated by the
+model replicas, if any, are summed).
+"""
+# Standard libraries
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+import os
+import time
+
+# Third-party libraries
+import hydra
+from omegaconf import DictConfig, OmegaConf
+import pyarrow as pa
+import pyarrow.parquet as pq
+import torch
+import torch.multiprocessing as mp
+from torch.utils.data import Subset
+from tqdm import tqdm
+
+# Custom modules
+from toolbox.evaluation.threshold_metrics import ProbabilityHistograms
+
+
+# One row per evaluated sequence
+RESULTS_SCHEMA = pa.schema([
+    ("sequence_idx", pa.int64()),
+    ("object", pa.string()),
+    ("scene", pa.string()),
+    ("error", pa.float64()),
+    ("optimal_error", pa.float64()),
+    ("load_time", pa.float64()),
+    ("forward_time", pa.float64()),
+    ("worker", pa.int32()),
+])
+
+RESULTS_FILE = "results.parquet"
+HISTOGRAMS_FILE = "histograms.pt"
+
+
+def worker_results_path(results_dir: Path, shard: int) -> Path:
+    """Get the path of the results file of a worker.
+
+    Args:
+        results_dir (Path): Directory of the results.
+        shard (int): Index of the shard evaluated by the worker.
+
+    Returns:
+        Path: Path of the results file.
+    """
+    return Path(results_dir) / f"results_worker_{shard}.arrows"
+
+
+def worker_histograms_path(results_dir: Path, shard: int) -> Path:
+    """Get the path of the histograms of the predicted probabilities of a worker.
+
+    Args:
+        results_dir (Path): Directory of the results.
+        shard (int): Index of the shard evaluated by the worker.
+
+    Returns:
+        Path: Path of the histograms file.
+    """
+    return Path(results_dir) / f"histograms_worker_{shard}.pt"
+
+
+def shard_indices(nb_items: int, nb_shards: int, shard: int) -> List[int]:
+    """Get the indexes of the items of a shard. Items are dealt in turn to the shards
+    so that consecutive (similar) sequences are spread over all the workers.
+
+    Args:
+        nb_items (int): Number of items.
+        nb_shards (int): Number of shards.
+        shard (int): Index of the shard.
+
+    Returns:
+        List[int]: Indexes of the items of the shard.
+    """
+    return list(range(shard, nb_items, nb_shards))
+
+
+class ResultsWriter:
+    """
+    Append-only writer of evaluation results in the Arrow IPC stream format. Each call
+    to `write` appends a record batch and flushes it, so that the rows written before an
+    interruption can be read back.
+    """
+    def __init__(self, path: Path) -> None:
+        """Constructor.
+
+        Args:
+            path (Path): Path of the results file (overwritten).
+        """
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+
+        self._sink = pa.OSFile(str(path), "wb")
+        self._writer = pa.ipc.new_stream(self._sink, RESULTS_SCHEMA)
+
+    def write(self, rows: Dict[str, List[Any]]) -> None:
+        """Append rows.
+
+        Args:
+            rows (Dict[str, List[Any]]): Values of each column of the results schema.
+        """
+        self._writer.write_batch(
+            pa.RecordBatch.from_pydict(rows, schema=RESULTS_SCHEMA)
+        )
+        self._sink.flush()
+
+    def close(self) -> None:
+        """
+        Close the stream and the file.
+        """
+        self._writer.close()
+        self._sink.close()
+
+    def __enter__(self) -> "ResultsWriter":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+def read_results(path: Path) -> pa.Table:
+    """Read the results written by a worker, up to the last complete record batch (the
+    worker may have been interrupted).
+
+    Args:
+        path (Path): Path of the results file.
+
+    Returns:
+        pa.Table: The results.
+    """
+    batches = []
+
+    with pa.OSFile(str(path), "rb") as source:
+        try:
+            reader = pa.ipc.open_stream(source)
+            while True:
+                batches.append(reader.read_next_batch())
+        except StopIteration:
+            pass
+        except pa.ArrowException:
+            # Truncated stream
+            pass
+
+    return pa.Table.from_batches(batches, schema=RESULTS_SCHEMA)
+
+
+def merge_results(results_dir: Path) -> pa.Table:
+    """Merge the results of all the workers into a Parquet table sorted by sequence.
+
+    Args:
+        results_dir (Path): Directory of the results.
+
+    Returns:
+        pa.Table: The merged results (also written to `results.parquet`).
+    """
+    results_dir = Path(results_dir)
+
+    tables = [
+        read_results(path)
+        for path in sorted(results_dir.glob("results_worker_*.arrows"))
+    ]
+    if tables:
+        table = pa.concat_tables(tables).sort_by("sequence_idx")
+    else:
+        table = RESULTS_SCHEMA.empty_table()
+
+    pq.write_table(table, results_dir / RESULTS_FILE)
+
+    return table
+
+
+def merge_histograms(results_dir: Path) -> Optional[ProbabilityHistograms]:
+    """Sum the histograms of the predicted probabilities of all the workers.
+
+    Args:
+        results_dir (Path): Directory of the results.
+
+    Returns:
+        Optional[ProbabilityHistograms]: The merged histograms (also written to
+            `histograms.pt`), or None if the model does not accumulate histograms.
+    """
+    results_dir = Path(results_dir)
+
+    histograms = None
+
+    for path in sorted(results_dir.glob("histograms_worker_*.pt")):
+        if histograms is None:
+            histograms = ProbabilityHistograms.load(path)
+        else:
+            histograms.merge(ProbabilityHistograms.load(path))
+
+    if histograms is not None:
+        histograms.save(results_dir / HISTOGRAMS_FILE)
+
+    return histograms
+
+
+@torch.no_grad()
+def evaluate_shard(
+    cfg: Union[DictConfig, Dict],
+    shard: int,
+    nb_shards: int,
+    results_dir: Path,
+    device: Union[str, torch.device] = "cpu",
+    nb_threads: Optional[int] = None,
+    nb_loader_workers: Optional[int] = None,
+) -> None:
+    """Evaluate a model on a shard of the sequences of a dataset.
+
+    Args:
+        cfg (Union[DictConfig, Dict]): Evaluation configuration (resolved), with the
+            configurations of the DataLoader (`data`) and of the model (`model`).
+        shard (int): Index of the shard.
+        nb_shards (int): Number of shards.
+        results_dir (Path): Directory of the results.
+        device (Union[str, torch.device], optional): Device of the model. Defaults to
+            "cpu".
+        nb_threads (Optional[int], optional): Number of intra-op threads of the
+            process. If None, the default of PyTorch is kept. Defaults to None.
+        nb_loader_workers (Optional[int], optional): Number of DataLoader workers. If
+            None, the configured number is used. Defaults to None.
+    """
+    if nb_threads is not None:
+        torch.set_num_threads(nb_threads)
+
+    if not isinstance(cfg, DictConfig):
+        cfg = OmegaConf.create(cfg)
+
+    # Sequences of the shard
+    dataset = hydra.utils.instantiate(cfg.data.dataset)
+    indices = shard_indices(len(dataset), nb_shards, shard)
+
+    loader_kwargs = {}
+    if nb_loader_workers is not None:
+        loader_kwargs = {
+            "num_workers": nb_loader_workers,
+            "persistent_workers": nb_loader_workers > 0,
+        }
+
+    dataloader: torch.utils.data.DataLoader = hydra.utils.instantiate(
+        cfg.data,
+        dataset=Subset(dataset, indices),
+        shuffle=False,
+        **loader_kwargs,
+    )
+
+    # Model replica of the worker
+    model: torch.nn.Module = hydra.utils.instantiate(cfg.model)
+    model.to(device)
+    model.eval()
+
+    nb_sequences = 0
+
+    with ResultsWriter(worker_results_path(results_dir, shard)) as writer:
+
+        batches = iter(tqdm(
+            dataloader,
+            desc=f"Shard {shard}/{nb_shards}",
+            position=shard,
+        ))
+
+        while True:
+            start = time.perf_counter()
+            try:
+                batch = next(batches)
+            except StopIteration:
+                break
+            load_time = time.perf_counter() - start
+
+            # Send the batch to the GPU if it is available
+            batch = batch.to(device)
+
+            start = time.perf_counter()
+            error, optimal_error = model(batch)
+            if torch.device(device).type == "cuda":
+                torch.cuda.synchronize()
+            forward_time = time.perf_counter() - start
+
+            bsz = batch.batch_size
+
+            writer.write({
+                "sequence_idx": indices[nb_sequences:nb_sequences + bsz],
+                "object": list(batch.object_labels),
+                "scene": list(batch.scene_labels),
+                "error": error.cpu().tolist(),
+                "optimal_error": optimal_error.cpu().tolist()
+                if optimal_error is not None else [None] * bsz,
+                # Time spent on the batch, shared between its sequences
+                "load_time": [load_time / bsz] * bsz,
+                "forward_time": [forward_time / bsz] * bsz,
+                "worker": [shard] * bsz,
+            })
+
+            nb_sequences += bsz
+
+    # Histograms accumulated by the model replica over the shard
+    histograms = getattr(model, "probability_histograms", None)
+    if histograms is not None:
+        histograms.save(worker_histograms_path(results_dir, shard))
+
+
+def evaluate_in_parallel(
+    cfg: DictConfig,
+    results_dir: Path,
+    nb_workers: int,
+    nb_threads_per_worker: Optional[int] = None,
+) -> pa.Table:
+    """Evaluate a model on CPU, the sequences being sharded across worker processes.
+
+    Args:
+        cfg (DictConfig): Evaluation configuration, with the configurations of the
+            DataLoader (`data`) and of the model (`model`).
+        results_dir (Path): Directory of the results.
+        nb_workers (int): Number of worker processes.
+        nb_threads_per_worker (Optional[int], optional): Number of intra-op threads of
+            each worker. If None, the cores are shared evenly between the workers.
+            Defaults to None.
+
+    Raises:
+        RuntimeError: If a worker fails.
+
+    Returns:
+        pa.Table: The merged results.
+    """
+    if nb_threads_per_worker is None:
+        nb_threads_per_worker = max(1, (os.cpu_count() or 1) // nb_workers)
+
+    # Interpolations (e.g. hydra's) can only be resolved in the main process
+    cfg_container = OmegaConf.to_container(cfg, resolve=True)
+
+    context = mp.get_context("spawn")
+    processes = [
+        context.Process(
+            target=evaluate_shard,
+            args=(cfg_container, shard, nb_workers, str(results_dir)),
+            kwargs={
+                "device": "cpu",
+                "nb_threads": nb_threads_per_worker,
+                # The cores are already busy with the workers
+                "nb_loader_workers": 0,
+            },
+        )
+        for shard in range(nb_workers)
+    ]
+
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    failed = [
+        shard for shard, process in enumerate(processes) if process.exitcode != 0
+    ]
+    if failed:
+        raise RuntimeError(f"Evaluation workers {failed} failed.")
+
+    return merge_results(results_dir)
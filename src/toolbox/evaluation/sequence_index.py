@@ -0,0 +1,274 @@
+"""
+Persistent index of the sequences of an evaluation dataset. Walking the tree of a
+dataset to list and sort its frames is slow on network filesystems, so the sequences
+(frames of each sequence) and the parsed ground truth (poses and intrinsics) are saved
+as .npy files in a directory next to the dataset root, and memory-mapped when the
+dataset is instantiated again. The index records the modification times of the
+directories that were listed and of the files that were parsed, and is rebuilt if any
+of them has changed.
+"""
+# Standard libraries
+from collections.abc import Mapping
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+import hashlib
+import json
+import os
+
+# Third-party libraries
+import numpy as np
+
+
+# Bump when the layout of the index changes
+SEQUENCE_INDEX_VERSION = 1
+
+META_FILE = "meta.json"
+
+
+class SequenceFrames(Mapping):
+    """
+    Read-only mapping from the index of a sequence to the paths of its frames, backed by
+    an array of relative paths and an array of frame indices per sequence.
+    """
+    def __init__(
+        self,
+        root: Path,
+        frames: np.ndarray,
+        sequences: np.ndarray,
+    ) -> None:
+        """Constructor.
+
+        Args:
+            root (Path): Root directory of the dataset.
+            frames (np.ndarray): Paths of the frames relative to the root, of shape
+                (F,) (str).
+            sequences (np.ndarray): Indices of the frames of each sequence, of shape
+                (S, T).
+        """
+        self._root = Path(root)
+        self._frames = frames
+        self._sequences = sequences
+
+    def __getitem__(self, idx: int) -> List[Path]:
+        if not isinstance(idx, (int, np.integer)) or not 0 <= idx < len(self):
+            raise KeyError(idx)
+
+        return [self._root / str(self._frames[i]) for i in self._sequences[idx]]
+
+    def __len__(self) -> int:
+        return len(self._sequences)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(range(len(self)))
+
+
+@dataclass
+class SequenceIndex:
+    """
+    Sequences and ground truth of a dataset.
+    """
+    # Paths of the frames of each sequence
+    sequences_frames: Mapping
+    # Ground truth poses (N, 4, 4) keyed by the directory they belong to
+    poses: Dict[Path, np.ndarray]
+    # Camera intrinsics (3, 3) keyed by the directory they belong to
+    K: Dict[Path, np.ndarray]
+
+
+def sequence_index_dir(root: Path, params: Dict) -> Path:
+    """Get the directory of the index of a dataset. It is a sibling of the dataset root
+    (one subdirectory per set of parameters).
+
+    Args:
+        root (Path): Root directory of the dataset.
+        params (Dict): Parameters determining the sequences (JSON serializable).
+
+    Returns:
+        Path: Directory of the index.
+    """
+    root = Path(root)
+    digest = hashlib.sha1(
+        json.dumps(params, sort_keys=True).encode()
+    ).hexdigest()[:16]
+
+    return root.parent / f"{root.name}_index" / digest
+
+
+def _mtimes(root: Path, paths: List[Path]) -> Dict[str, int]:
+    """Get the modification times of paths.
+
+    Args:
+        root (Path): Root directory of the dataset.
+        paths (List[Path]): Paths of the directories and files.
+
+    Returns:
+        Dict[str, int]: Modification time (ns) of each path, keyed by the path relative
+            to the root.
+    """
+    return {
+        str(Path(path).relative_to(root)): os.stat(path).st_mtime_ns
+        for path in paths
+    }
+
+
+def _save_array(path: Path, array: np.ndarray) -> None:
+    """Save an array in a .npy file, replacing it atomically.
+
+    Args:
+        path (Path): Path of the file.
+        array (np.ndarray): The array.
+    """
+    tmp_path = path.with_suffix(".tmp.npy")
+    np.save(tmp_path, array)
+    tmp_path.replace(path)
+
+
+def write_sequence_index(
+    index_dir: Path,
+    root: Path,
+    index: SequenceIndex,
+    dependencies: List[Path],
+) -> bool:
+    """Write the index of a dataset.
+
+    Args:
+        index_dir (Path): Directory of the index.
+        root (Path): Root directory of the dataset.
+        index (SequenceIndex): Sequences and ground truth of the dataset.
+        dependencies (List[Path]): Directories listed and files parsed to build the
+            index.
+
+    Returns:
+        bool: True if the index has been written, False if the directory is not
+            writable.
+    """
+    root = Path(root)
+    index_dir = Path(index_dir)
+
+    # Deduplicated relative paths of the frames
+    frames_idx = {}
+    sequences = np.array(
+        [
+            [
+                frames_idx.setdefault(frame.relative_to(root), len(frames_idx))
+                for frame in sequence
+            ]
+            for sequence in index.sequences_frames.values()
+        ],
+        dtype=np.int64,
+    )
+    frames = np.array([str(frame) for frame in frames_idx], dtype=str)
+
+    poses_keys = list(index.poses.keys())
+    K_keys = list(index.K.keys())
+
+    meta = {
+        "version": SEQUENCE_INDEX_VERSION,
+        "mtimes": _mtimes(root, dependencies),
+        "poses": [
+            [str(Path(key).relative_to(root)), len(index.poses[key])]
+            for key in poses_keys
+        ],
+        "K": [str(Path(key).relative_to(root)) for key in K_keys],
+    }
+
+    try:
+        index_dir.mkdir(parents=True, exist_ok=True)
+
+        _save_array(index_dir / "frames.npy", frames)
+        _save_array(index_dir / "sequences.npy", sequences)
+        _save_array(
+            index_dir / "poses.npy",
+            np.concatenate([index.poses[key] for key in poses_keys]).astype(np.float32)
+            if poses_keys else np.zeros((0, 4, 4), dtype=np.float32),
+        )
+        _save_array(
+            index_dir / "K.npy",
+            np.stack([np.asarray(index.K[key]) for key in K_keys]).astype(np.float32)
+            if K_keys else np.zeros((0, 3, 3), dtype=np.float32),
+        )
+
+        # The metadata are written last, an index without metadata is ignored
+        tmp_path = index_dir / (META_FILE + ".tmp")
+        tmp_path.write_text(json.dumps(meta))
+        tmp_path.replace(index_dir / META_FILE)
+
+    except OSError:
+        return False
+
+    return True
+
+
+def read_sequence_index(index_dir: Path, root: Path) -> Optional[SequenceIndex]:
+    """Read the index of a dataset (memory-mapped).
+
+    Args:
+        index_dir (Path): Directory of the index.
+        root (Path): Root directory of the dataset.
+
+    Returns:
+        Optional[SequenceIndex]: Sequences and ground truth of the dataset, or None if
+            there is no index or if it is out of date.
+    """
+    root = Path(root)
+    index_dir = Path(index_dir)
+
+    try:
+        meta = json.loads((index_dir / META_FILE).read_text())
+
+        if meta["version"] != SEQUENCE_INDEX_VERSION:
+            return None
+
+        # Any change in a listed directory or a parsed file invalidates the index
+        for path, mtime in meta["mtimes"].items():
+            if os.stat(root / path).st_mtime_ns != mtime:
+                return None
+
+        frames = np.load(index_dir / "frames.npy", mmap_mode="r")
+        sequences = np.load(index_dir / "sequences.npy", mmap_mode="r")
+        poses = np.load(index_dir / "poses.npy", mmap_mode="r")
+        K = np.load(index_dir / "K.npy", mmap_mode="r")
+
+    except (OSError, ValueError, KeyError):
+        return None
+
+    poses_dict = {}
+    offset = 0
+    for key, nb_poses in meta["poses"]:
+        poses_dict[root / key] = poses[offset:offset + nb_poses]
+        offset += nb_poses
+
+    return SequenceIndex(
+        sequences_frames=SequenceFrames(root, frames, sequences),
+        poses=poses_dict,
+        K={root / key: K[i] for i, key in enumerate(meta["K"])},
+    )
+
+
+def load_sequence_index(
+    root: Path,
+    params: Dict,
+    build: Callable[[], Tuple[SequenceIndex, List[Path]]],
+) -> SequenceIndex:
+    """Load the index of a dataset, building (and saving) it if there is no up to date
+    index.
+
+    Args:
+        root (Path): Root directory of the dataset.
+        params (Dict): Parameters determining the sequences (JSON serializable).
+        build (Callable[[], Tuple[SequenceIndex, List[Path]]]): Function walking the
+            dataset, returning its sequences and ground truth, and the directories
+            listed and files parsed to get them.
+
+    Returns:
+        SequenceIndex: Sequences and ground truth of the dataset.
+    """
+    index_dir = sequence_index_dir(root, params)
+    index = read_sequence_index(index_dir, root)
+
+    if index is None:
+        index, dependencies = build()
+        write_sequence_index(index_dir, root, index, dependencies)
+
+    return index
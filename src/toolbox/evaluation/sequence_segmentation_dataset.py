@@ -7,6 +7,9 @@ from dataclasses import dataclass
 # Third-party libraries
 import torch
 
+# Custom modules
+from toolbox.utils.buffer_ring import BufferRing
+
 
 @dataclass
 class SequenceSegmentationData:
@@ -67,9 +70,13 @@ class BatchSequenceSegmentationData:
         Returns:
             BatchSequenceSegmentationData: Batch with pinned memory.
         """
-        self.rgbs = self.rgbs.pin_memory()
-        self.TCO = self.TCO.pin_memory()
-        self.K = self.K.pin_memory()
+        # Batches collated in pinned buffers do not need to be copied again
+        if not self.rgbs.is_pinned():
+            self.rgbs = self.rgbs.pin_memory()
+        if not self.TCO.is_pinned():
+            self.TCO = self.TCO.pin_memory()
+        if not self.K.is_pinned():
+            self.K = self.K.pin_memory()
         
         return self
     
@@ -111,4 +118,94 @@ class BatchSequenceSegmentationData:
         self.K = self.K.to(*args, **kwargs)
         
         return self
-    
\ No newline at end of file
+
+
+class SequenceSegmentationDataCollator:
+    """
+    Collate SequenceSegmentationData samples by writing them directly into a ring of
+    preallocated (pinned) buffers. The returned batches are views into these buffers.
+    
+    A buffer is reused once `nb_buffers` batches have been produced since it was handed
+    out, so it must be larger than the number of batches alive at the same time (i.e.
+    `prefetch_factor` + 2 per DataLoader worker).
+    """
+    def __init__(
+        self,
+        batch_size: int,
+        sequence_size: int,
+        image_size: Tuple[int, int],
+        nb_buffers: int = 4,
+        pin_memory: bool = True,
+    ) -> None:
+        """Constructor.
+
+        Args:
+            batch_size (int): Batch size of the DataLoader.
+            sequence_size (int): Number of frames per sequence.
+            image_size (Tuple[int, int]): Size (height, width) of the images.
+            nb_buffers (int, optional): Number of buffers in the ring. Defaults to 4.
+            pin_memory (bool, optional): Whether to allocate the buffers in page-locked
+                memory. Defaults to True.
+        """
+        self._batch_size = batch_size
+        self._sequence_size = sequence_size
+        self._image_size = tuple(image_size)
+        self._ring = BufferRing(nb_buffers=nb_buffers, pin_memory=pin_memory)
+    
+    def __call__(
+        self,
+        list_data: List[SequenceSegmentationData],
+    ) -> BatchSequenceSegmentationData:
+        """Collate a list of SequenceSegmentationData into a
+        BatchSequenceSegmentationData.
+
+        Args:
+            list_data (List[SequenceSegmentationData]): List of
+                SequenceSegmentationData.
+
+        Raises:
+            ValueError: If there are more sequences than the configured batch size.
+            ValueError: If a sequence does not match the configured sizes.
+
+        Returns:
+            BatchSequenceSegmentationData: Batch of SequenceSegmentationData (views
+                into the ring buffers).
+        """
+        if len(list_data) > self._batch_size:
+            raise ValueError(
+                f"Expected at most {self._batch_size} sequences, got {len(list_data)}."
+            )
+        
+        if not self._ring.allocated:
+            self._ring.allocate({
+                "rgbs": (
+                    (self._batch_size, self._sequence_size, 3) + self._image_size,
+                    torch.uint8,
+                ),
+                "TCO": ((self._batch_size, self._sequence_size, 4, 4), torch.float32),
+                "K": ((self._batch_size, 3, 3), torch.float32),
+            })
+        
+        buffers = self._ring.next()
+        bsz = len(list_data)
+        
+        # Write the sequences directly into the buffers
+        for i, d in enumerate(list_data):
+            if d.rgbs.shape[0] != self._sequence_size or\
+                tuple(d.rgbs.shape[2:]) != self._image_size:
+                raise ValueError(
+                    f"Expected sequences of shape "
+                    f"{(self._sequence_size, 3) + self._image_size}, got a sequence "
+                    f"of shape {tuple(d.rgbs.shape)}."
+                )
+            buffers["rgbs"][i].copy_(d.rgbs)
+            buffers["TCO"][i].copy_(d.TCO)
+            buffers["K"][i].copy_(d.K)
+        
+        return BatchSequenceSegmentationData(
+            rgbs=buffers["rgbs"][:bsz],
+            K=buffers["K"][:bsz],
+            TCO=buffers["TCO"][:bsz],
+            object_labels=[d.object_label for d in list_data],
+            scene_labels=[d.scene_label for d in list_data],
+        )
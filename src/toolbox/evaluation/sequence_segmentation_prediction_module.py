@@ -1,11 +1,11 @@
 # Standard libraries
-from typing import Optional
+from dataclasses import replace
+from typing import List, Optional, Tuple
 
 # Third-party libraries
 import torch
 from torch import nn
-from omegaconf import DictConfig, ListConfig
-import numpy as np
+from omegaconf import DictConfig, ListConfig, OmegaConf
 from torchmetrics import JaccardIndex
 import matplotlib.pyplot as plt
 from mpl_toolkits.axes_grid1 import make_axes_locatable
@@ -19,6 +19,9 @@ from toolbox.datasets.scene_set import ObjectData
 from toolbox.datasets.make_sets import make_object_set
 from toolbox.modules.mobile_sam_module import MobileSAM
 from toolbox.modules.mask_rendering_module import MaskRendering
+from toolbox.evaluation.gt_mask_cache import GTMaskCache, object_set_digest
+from toolbox.evaluation.threshold_metrics import ProbabilityHistograms
+from toolbox.geometry.mask_geometry import masks_to_bboxes
 
 
 class SequenceSegmentationPredictionModel(nn.Module):
@@ -33,6 +36,13 @@ class SequenceSegmentationPredictionModel(nn.Module):
         error_metric: nn.Module = JaccardIndex(task="binary"),
         return_optimal_error: bool = False,
         compile: bool = False,
+        mask_rendering_backend: str = "pytorch3d",
+        gt_mask_cache_dir: Optional[str] = None,
+        gt_mask_cache_namespace: Optional[str] = None,
+        probability_histograms_bins: int = 0,
+        sam_embedding_cache_size: int = 0,
+        sam_embedding_cache_dir: Optional[str] = None,
+        sam_roi_padding: Optional[float] = None,
     ) -> None:
         """Constructor.
 
@@ -53,6 +63,30 @@ class SequenceSegmentationPredictionModel(nn.Module):
                 optimal segmentation mask. Defaults to False.
             compile (bool, optional): Whether to compile the MobileSAM module. Defaults
                 to False.
+            mask_rendering_backend (str, optional): Backend used to render the ground
+                truth masks, either "pytorch3d" or "silhouette". Defaults to
+                "pytorch3d".
+            gt_mask_cache_dir (Optional[str], optional): Directory of the persistent
+                cache of the ground truth masks. If None, the masks are rendered at
+                every evaluation. Defaults to None.
+            gt_mask_cache_namespace (Optional[str], optional): Name of the dataset in
+                the ground truth masks cache. Defaults to the name of the object set.
+            probability_histograms_bins (int, optional): Number of bins of the
+                histograms of the predicted probabilities of the foreground and
+                background pixels, accumulated over the evaluation to derive the
+                metrics at any threshold (see `probability_histograms`). If 0, no
+                histograms are accumulated. Defaults to 0.
+            sam_embedding_cache_size (int, optional): Number of MobileSAM image
+                embeddings kept in memory (0 to disable the in-memory cache). Defaults
+                to 0.
+            sam_embedding_cache_dir (Optional[str], optional): Directory in which the
+                MobileSAM image embeddings are saved, so that evaluations run again
+                (e.g. with other segmentation checkpoints) do not encode the frames
+                again. If None, they are not saved. Defaults to None.
+            sam_roi_padding (Optional[float], optional): If given, MobileSAM only
+                encodes a square region around each prompt box, enlarged by this
+                fraction on each side, so that small objects are segmented at a higher
+                resolution. If None, the whole frames are encoded. Defaults to None.
         """
         super().__init__()
         
@@ -64,13 +98,38 @@ class SequenceSegmentationPredictionModel(nn.Module):
             object_set=object_set,
             image_size=tuple(image_size),
             debug=True,
+            backend=mask_rendering_backend,
         )
         
+        # Persistent cache of the ground truth masks (poses and meshes are fixed, the
+        # masks rendered from other object set configurations or meshes are not
+        # reused)
+        self._gt_mask_cache = None
+        self._gt_mask_settings = f"backend={mask_rendering_backend}"
+        
+        if gt_mask_cache_dir is not None:
+            if isinstance(object_set_cfg, DictConfig):
+                cfg = OmegaConf.to_container(object_set_cfg, resolve=True)
+            else:
+                cfg = dict(object_set_cfg)
+            self._gt_mask_settings += (
+                f"|objects={object_set_digest(cfg, object_set)}"
+            )
+            
+            self._gt_mask_cache = GTMaskCache(
+                cache_dir=gt_mask_cache_dir,
+                namespace=gt_mask_cache_namespace or object_set_cfg["name"],
+                image_size=tuple(image_size),
+            )
+        
         # Instantiate the MobileSAM module
         # (for explicit object segmentation alignment)
         self._mobile_sam = MobileSAM(
             sam_checkpoint=sam_checkpoint,
             compile=compile,
+            embedding_cache_size=sam_embedding_cache_size,
+            embedding_cache_dir=sam_embedding_cache_dir,
+            roi_padding=sam_roi_padding,
         )
         # Freeze the MobileSAM parameters
         for param in self._mobile_sam.parameters():
@@ -102,141 +161,190 @@ class SequenceSegmentationPredictionModel(nn.Module):
         self._error_metric = error_metric
         
         self._return_optimal_error = return_optimal_error
+        
+        # Histograms of the predicted probabilities (over all the evaluated frames)
+        self.probability_histograms = None
+        if probability_histograms_bins > 0:
+            self.probability_histograms = ProbabilityHistograms(
+                nb_bins=probability_histograms_bins,
+            )
     
     @torch.no_grad()
-    def forward(self, x: BatchSequenceSegmentationData) -> torch.Tensor:
-        """Perform a single forward pass through the network.
+    def forward(
+        self,
+        x: BatchSequenceSegmentationData,
+    ) -> Tuple[torch.Tensor, Optional[torch.Tensor]]:
+        """Perform a single forward pass through the network. The sequences of the
+        batch are processed together: the ground truth masks of all the frames are
+        rendered at once, MobileSAM is prompted once, the parameters of the
+        segmentation models are predicted from the first frames of all the sequences at
+        once, and the remaining frames are segmented one step at a time for all the
+        sequences.
 
         Args:
-            x (BatchSegmentationData): A batch of segmentation data.
+            x (BatchSequenceSegmentationData): A batch of sequences.
 
         Returns:
-            torch.Tensor: A tensor of predictions.
+            Tuple[torch.Tensor, Optional[torch.Tensor]]: Segmentation error of each
+                sequence, of shape (B,), and error of the optimal segmentation masks of
+                each sequence (if `return_optimal_error` is True, None otherwise).
         
         Raises:
-            NotImplementedError: If the batch size is different from 1.
-            ValueError: If no object pixels are found in the first frame.
+            ValueError: If no object pixels are found in the first frame of a sequence
+                (or in any frame if `return_optimal_error` is True).
         """
-        if x.batch_size != 1:
-            raise NotImplementedError(
-                "Batch sizes different from 1 are not supported yet."
-            )
+        bsz, sequence_size = x.batch_size, x.sequence_size
+        
+        # Frames of all the sequences, of shape (B * T, ...)
+        rgbs = x.rgbs.flatten(0, 1)
         
         # Set the input data for the mask rendering module
         batch_segmentation_data = BatchSegmentationData(
-            rgbs=x.rgbs[0],
+            rgbs=rgbs,
             masks=None,
             object_datas=[
-                ObjectData(
-                    label=x.object_labels[0]
-                ) for _ in range(x.sequence_size)],
+                ObjectData(label=label)
+                for label in x.object_labels for _ in range(sequence_size)
+            ],
             bboxes=None,
-            TCO=x.TCO[0],
+            TCO=x.TCO.flatten(0, 1),
             DTO=None,
-            K=x.K.expand(x.sequence_size, -1, -1),
+            K=x.K.repeat_interleave(sequence_size, dim=0),
             depths=None,
         )
         
-        # Compute the ground truth masks by rendering the objects
-        ground_truth_masks = self._mask_rendering_module(batch_segmentation_data)
-        
-        # Get the sequence of RGB images
-        rgb_images = x.rgbs[0]
-        
-        if self._return_optimal_error:
-            # Set the bounding boxes coordinates for each frame of the sequence
-            contour_points_list = []
-
-            for i in range(x.sequence_size):
-
-                indices = torch.nonzero(ground_truth_masks[i])
-
-                if len(indices) == 0:
-                    raise ValueError(f"No object pixels found in frame {i}.")
-
-                min_coords, _ = torch.min(indices, dim=0)
-                max_coords, _ = torch.max(indices, dim=0)
-
-                bbox = torch.tensor([
-                    min_coords[1].item(),
-                    min_coords[0].item(),
-                    max_coords[1].item(),
-                    max_coords[0].item(),
-                ])
-
-                # Set the MobileSAM expected input
-                contour_points_list.append([np.array(bbox).reshape(-1, 2),])
+        # Compute the ground truth masks by rendering the objects (or get them from
+        # the cache)
+        if self._gt_mask_cache is None:
+            ground_truth_masks = self._mask_rendering_module(batch_segmentation_data)
         else:
-            # Get the first ground truth mask
-            first_ground_truth_mask = ground_truth_masks[0]
-
-            # Set the bounding box coordinates for the first frame of the sequence
-            indices = torch.nonzero(first_ground_truth_mask)
-
-            if len(indices) == 0:
-                raise ValueError("No object pixels found in the first frame.")
-            else:
-                min_coords, _ = torch.min(indices, dim=0)
-                max_coords, _ = torch.max(indices, dim=0)
-
-                bbox = torch.tensor([
-                    min_coords[1].item(),
-                    min_coords[0].item(),
-                    max_coords[1].item(),
-                    max_coords[0].item(),
-                ])
-
-            # Set the MobileSAM expected input
-            contour_points_list=[
-                # First example of the batch
-                [np.array(bbox).reshape(-1, 2),],
-                # Second example of the batch...
+            keys = [
+                key
+                for i in range(bsz)
+                for key in self._gt_mask_cache.make_keys(
+                    x.object_labels[i],
+                    TCO=x.TCO[i],
+                    K=x.K[i],
+                    settings=self._gt_mask_settings,
+                )
             ]
+            
+            def render_gt_masks(frames_idx: List[int]) -> torch.Tensor:
+                return self._mask_rendering_module(
+                    replace(
+                        batch_segmentation_data,
+                        rgbs=batch_segmentation_data.rgbs[frames_idx],
+                        object_datas=[
+                            batch_segmentation_data.object_datas[i]
+                            for i in frames_idx
+                        ],
+                        TCO=batch_segmentation_data.TCO[frames_idx],
+                        K=batch_segmentation_data.K[frames_idx],
+                    )
+                )
+            
+            ground_truth_masks = self._gt_mask_cache.get_or_render(
+                keys,
+                render_gt_masks,
+                device=x.rgbs.device,
+            )
+        
+        ground_truth_masks = ground_truth_masks.view(
+            bsz,
+            sequence_size,
+            *ground_truth_masks.shape[1:],
+        )
         
+        # Frames from which MobileSAM is prompted with the bounding boxes of the
+        # ground truth masks (all the frames, or the first frame of each sequence)
         if self._return_optimal_error:
-            # Predict the masks for the sequence
-            mobile_sam_outputs = self._mobile_sam(rgb_images, contour_points_list)
+            prompted_masks = ground_truth_masks.flatten(0, 1)
+            prompted_rgbs = rgbs
         else:
-            # Predict the mask for the first image
-            mobile_sam_outputs = self._mobile_sam(rgb_images[0:1], contour_points_list)
+            prompted_masks = ground_truth_masks[:, 0]
+            prompted_rgbs = x.rgbs[:, 0]
         
-        # Stack the mask(s) from the MobileSAM outputs
-        binary_masks = torch.stack([
-            output["masks"][:, torch.argmax(output["iou_predictions"])]
-            for output in mobile_sam_outputs
-        ])
+        # Sequences having a prompted frame without object pixels
+        empty = (~prompted_masks.flatten(1).any(dim=1)).view(bsz, -1).any(dim=1)
+        
+        if empty.any():
+            i = int(torch.nonzero(empty)[0, 0])
+            raise ValueError(
+                "No object pixels found in the prompted frames of the sequence "
+                f"({x.scene_labels[i]}, {x.object_labels[i]})."
+            )
         
-        # Compute the probabilistic segmentation mask for the first image
-        # (parameters of the implicit segmentation model are set internally)
-        first_probabilistic_mask = self._probabilistic_segmentation_model(
-            rgb_images[0:1],
-            binary_masks[0:1],
+        # Predict the masks of the prompted frames, of shape (N, 1, H, W)
+        binary_masks, _ = self._mobile_sam(
+            prompted_rgbs,
+            bboxes=masks_to_bboxes(prompted_masks),
         )
         
-        # Use the segmentation model with parameters set for the first image to
-        # predict the masks for the rest of the sequence
-        other_probabilistic_masks =\
-            self._probabilistic_segmentation_model.forward_pixel_segmentation(
-                rgb_images[1:],
+        if self._return_optimal_error:
+            binary_masks = binary_masks.view(
+                bsz,
+                sequence_size,
+                *binary_masks.shape[1:],
             )
+            first_binary_masks = binary_masks[:, 0]
+        else:
+            first_binary_masks = binary_masks
         
-        # Stack the probabilistic masks
-        probabilistic_masks = torch.cat([
-            first_probabilistic_mask,
-            other_probabilistic_masks,
-        ])
+        # Compute the probabilistic segmentation masks for the first images
+        # (parameters of the implicit segmentation model are set internally, one set
+        # per sequence)
+        probabilistic_masks = [
+            self._probabilistic_segmentation_model(
+                x.rgbs[:, 0],
+                first_binary_masks,
+            ).unsqueeze(1)
+        ]
         
-        # Compute the segmentation error
-        error = self._error_metric(
-            preds=probabilistic_masks,
-            target=ground_truth_masks,
-        )
+        # Use the segmentation model with parameters set for the first images to
+        # predict the masks for the rest of the sequences
+        if bsz == 1:
+            # A single set of parameters is shared by all the frames
+            probabilistic_masks.append(
+                self._probabilistic_segmentation_model.forward_pixel_segmentation(
+                    x.rgbs[0, 1:],
+                ).unsqueeze(0)
+            )
+        else:
+            # The i-th set of parameters applies to the i-th image of a batch, so the
+            # frames of all the sequences are segmented one step at a time
+            probabilistic_masks.extend(
+                self._probabilistic_segmentation_model.forward_pixel_segmentation(
+                    x.rgbs[:, t],
+                ).unsqueeze(1)
+                for t in range(1, sequence_size)
+            )
         
-        if self._return_optimal_error:
-            optimal_error = self._error_metric(
-                preds=binary_masks[:, 0, ...],
+        # Stack the probabilistic masks, of shape (B, T, H, W)
+        probabilistic_masks = torch.cat(probabilistic_masks, dim=1)
+        
+        if self.probability_histograms is not None:
+            self.probability_histograms.update(
+                preds=probabilistic_masks,
                 target=ground_truth_masks,
             )
+        
+        # Compute the segmentation error of each sequence
+        error = torch.stack([
+            self._error_metric(
+                preds=probabilistic_masks[i],
+                target=ground_truth_masks[i],
+            )
+            for i in range(bsz)
+        ])
+        
+        if self._return_optimal_error:
+            optimal_error = torch.stack([
+                self._error_metric(
+                    preds=binary_masks[i, :, 0, ...],
+                    target=ground_truth_masks[i],
+                )
+                for i in range(bsz)
+            ])
         else:
             optimal_error = None
         
@@ -0,0 +1,253 @@
+"""
+Segmentation metrics at any set of thresholds from a single evaluation pass. The
+predicted probabilities of the ground truth foreground and background pixels are
+accumulated in two histograms, from which the confusion counts at any threshold (and
+thus IoU, precision and recall) as well as the calibration of the probabilities are
+derived in O(bins). Histograms are summed when merged, so the states accumulated by
+several processes can be combined.
+"""
+# Standard libraries
+from pathlib import Path
+from typing import Dict, Sequence, Union
+
+# Third-party libraries
+import torch
+from torchmetrics import Metric
+
+
+class ProbabilityHistograms(Metric):
+    """
+    Histograms of the predicted probabilities of the foreground and background pixels.
+    Bin k holds the probabilities in [k / nb_bins, (k + 1) / nb_bins) (the last bin
+    includes 1), and thresholds are rounded to the closest bin edge.
+    """
+    full_state_update = False
+
+    def __init__(self, nb_bins: int = 1000, **kwargs) -> None:
+        """Constructor.
+
+        Args:
+            nb_bins (int, optional): Number of bins of the histograms. Defaults to
+                1000.
+            **kwargs: Additional arguments of `torchmetrics.Metric`.
+        """
+        super().__init__(**kwargs)
+
+        self.nb_bins = nb_bins
+
+        self.add_state(
+            "foreground",
+            default=torch.zeros(nb_bins, dtype=torch.long),
+            dist_reduce_fx="sum",
+        )
+        self.add_state(
+            "background",
+            default=torch.zeros(nb_bins, dtype=torch.long),
+            dist_reduce_fx="sum",
+        )
+
+    def update(self, preds: torch.Tensor, target: torch.Tensor) -> None:
+        """Accumulate the probabilities of a batch of masks.
+
+        Args:
+            preds (torch.Tensor): Predicted probabilities, of shape (..., H, W).
+            target (torch.Tensor): Ground truth binary masks, of shape (..., H, W).
+        """
+        bins = (preds.detach().flatten().float() * self.nb_bins).long()
+        bins = bins.clamp(min=0, max=self.nb_bins - 1)
+
+        target = target.flatten().bool()
+
+        self.foreground += torch.bincount(bins[target], minlength=self.nb_bins)
+        self.background += torch.bincount(bins[~target], minlength=self.nb_bins)
+
+    def compute(self) -> Dict[str, torch.Tensor]:
+        """Get the histograms.
+
+        Returns:
+            Dict[str, torch.Tensor]: Histograms of the probabilities of the foreground
+                ("foreground") and background ("background") pixels, of shape
+                (nb_bins,).
+        """
+        return {"foreground": self.foreground, "background": self.background}
+
+    def merge(self, other: "ProbabilityHistograms") -> None:
+        """Add the histograms of another accumulator (e.g. of another process).
+
+        Args:
+            other (ProbabilityHistograms): The other accumulator.
+
+        Raises:
+            ValueError: If the numbers of bins differ.
+        """
+        if other.nb_bins != self.nb_bins:
+            raise ValueError(
+                f"Cannot merge histograms of {other.nb_bins} bins into histograms of "
+                f"{self.nb_bins} bins."
+            )
+
+        self.foreground += other.foreground.to(self.foreground.device)
+        self.background += other.background.to(self.background.device)
+
+    def save(self, path: Union[str, Path]) -> None:
+        """Save the histograms.
+
+        Args:
+            path (Union[str, Path]): Path of the file.
+        """
+        torch.save(
+            {
+                "foreground": self.foreground.cpu(),
+                "background": self.background.cpu(),
+            },
+            path,
+        )
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> "ProbabilityHistograms":
+        """Load histograms saved with `save`.
+
+        Args:
+            path (Union[str, Path]): Path of the file.
+
+        Returns:
+            ProbabilityHistograms: The accumulator.
+        """
+        histograms = torch.load(path)
+
+        metric = cls(nb_bins=len(histograms["foreground"]))
+        metric.foreground += histograms["foreground"]
+        metric.background += histograms["background"]
+
+        return metric
+
+    def confusion(self, thresholds: Sequence[float]) -> Dict[str, torch.Tensor]:
+        """Get the confusion counts at several thresholds (pixels whose probability is
+        greater than or equal to the threshold are predicted as foreground).
+
+        Args:
+            thresholds (Sequence[float]): Thresholds, in [0, 1].
+
+        Returns:
+            Dict[str, torch.Tensor]: Numbers of true positives ("tp"), false positives
+                ("fp"), false negatives ("fn") and true negatives ("tn") at each
+                threshold, of shape (N,).
+        """
+        thresholds = torch.as_tensor(
+            thresholds,
+            dtype=torch.float64,
+            device=self.foreground.device,
+        )
+        edges = torch.round(thresholds * self.nb_bins).long()
+        edges = edges.clamp(min=0, max=self.nb_bins)
+
+        zero = self.foreground.new_zeros(1)
+
+        # Number of pixels at or above each bin edge
+        foreground_above = torch.cat([
+            self.foreground.flip(0).cumsum(0).flip(0),
+            zero,
+        ])
+        background_above = torch.cat([
+            self.background.flip(0).cumsum(0).flip(0),
+            zero,
+        ])
+
+        tp = foreground_above[edges]
+        fp = background_above[edges]
+
+        return {
+            "tp": tp,
+            "fp": fp,
+            "fn": self.foreground.sum() - tp,
+            "tn": self.background.sum() - fp,
+        }
+
+    def iou(self, thresholds: Sequence[float]) -> torch.Tensor:
+        """Get the foreground IoU at several thresholds.
+
+        Args:
+            thresholds (Sequence[float]): Thresholds, in [0, 1].
+
+        Returns:
+            torch.Tensor: IoU at each threshold, of shape (N,) (0 if the union is
+                empty).
+        """
+        counts = self.confusion(thresholds)
+        union = counts["tp"] + counts["fp"] + counts["fn"]
+
+        return counts["tp"] / union.clamp(min=1)
+
+    def precision_recall(self, thresholds: Sequence[float]) -> Dict[str, torch.Tensor]:
+        """Get the precision and the recall at several thresholds.
+
+        Args:
+            thresholds (Sequence[float]): Thresholds, in [0, 1].
+
+        Returns:
+            Dict[str, torch.Tensor]: Precision ("precision", 1 if no pixel is
+                predicted as foreground) and recall ("recall") at each threshold, of
+                shape (N,).
+        """
+        counts = self.confusion(thresholds)
+        nb_predicted = counts["tp"] + counts["fp"]
+
+        precision = torch.where(
+            nb_predicted > 0,
+            counts["tp"] / nb_predicted.clamp(min=1),
+            torch.ones_like(counts["tp"], dtype=torch.float32),
+        )
+        recall = counts["tp"] / (counts["tp"] + counts["fn"]).clamp(min=1)
+
+        return {"precision": precision, "recall": recall}
+
+    def calibration(self, nb_bins: int = 10) -> Dict[str, torch.Tensor]:
+        """Get the reliability diagram of the predicted probabilities, and their
+        expected calibration error.
+
+        Args:
+            nb_bins (int, optional): Number of bins of the diagram (must divide the
+                number of bins of the histograms). Defaults to 10.
+
+        Raises:
+            ValueError: If the number of bins of the diagram does not divide the
+                number of bins of the histograms.
+
+        Returns:
+            Dict[str, torch.Tensor]: Mean predicted probability ("confidence"),
+                observed frequency of the foreground ("frequency") and number of
+                pixels ("count") in each bin of the diagram, of shape (nb_bins,), and
+                expected calibration error ("ece").
+        """
+        if self.nb_bins % nb_bins != 0:
+            raise ValueError(
+                f"The number of bins of the diagram ({nb_bins}) must divide the number "
+                f"of bins of the histograms ({self.nb_bins})."
+            )
+
+        # Centers of the bins of the histograms
+        centers = (
+            torch.arange(self.nb_bins, device=self.foreground.device) + 0.5
+        ) / self.nb_bins
+
+        foreground = self.foreground.double()
+        counts = foreground + self.background.double()
+
+        # Group the bins of the histograms into the bins of the diagram
+        group = self.nb_bins // nb_bins
+        diagram_counts = counts.view(nb_bins, group).sum(dim=1)
+        confidence = (counts * centers).view(nb_bins, group).sum(dim=1)\
+            / diagram_counts.clamp(min=1)
+        frequency = foreground.view(nb_bins, group).sum(dim=1)\
+            / diagram_counts.clamp(min=1)
+
+        ece = (
+            diagram_counts * (confidence - frequency).abs()
+        ).sum() / counts.sum().clamp(min=1)
+
+        return {
+            "confidence": confidence,
+            "frequency": frequency,
+            "count": diagram_counts,
+            "ece": ece,
+        }
@@ -0,0 +1,334 @@
+"""
+Batched SE(3) transforms backed by a (N, 4, 4) array. Unlike `Transform`, which wraps
+a single pinocchio `SE3` object, a `BatchTransform` holds the poses of several objects
+(or a single one) and composes, inverts and applies them with vectorized operations.
+The array is either a NumPy array or a torch tensor (on any device), and every
+operation keeps the backend (and the device) of its inputs.
+"""
+from __future__ import annotations
+
+# Standard libraries
+from typing import Sequence, Union
+
+# Third-party libraries
+import numpy as np
+import torch
+
+
+Array = Union[np.ndarray, torch.Tensor]
+
+
+def _stack(arrays: Sequence[Array], axis: int) -> Array:
+    """Stack NumPy arrays or torch tensors along a new axis.
+
+    Args:
+        arrays (Sequence[Array]): Arrays of the same backend and shape.
+        axis (int): Axis along which the arrays are stacked.
+
+    Returns:
+        Array: The stacked array.
+    """
+    if isinstance(arrays[0], torch.Tensor):
+        return torch.stack(list(arrays), dim=axis)
+    return np.stack(arrays, axis=axis)
+
+
+def _concatenate(arrays: Sequence[Array], axis: int) -> Array:
+    """Concatenate NumPy arrays or torch tensors along an existing axis.
+
+    Args:
+        arrays (Sequence[Array]): Arrays of the same backend.
+        axis (int): Axis along which the arrays are concatenated.
+
+    Returns:
+        Array: The concatenated array.
+    """
+    if isinstance(arrays[0], torch.Tensor):
+        return torch.cat(list(arrays), dim=axis)
+    return np.concatenate(arrays, axis=axis)
+
+
+def quaternions_to_matrices(quaternions: Array) -> Array:
+    """Convert quaternions to rotation matrices.
+
+    Args:
+        quaternions (Array): Quaternions in the xyzw convention (normalized here), of
+            shape (N, 4).
+
+    Returns:
+        Array: Rotation matrices, of shape (N, 3, 3).
+    """
+    if isinstance(quaternions, torch.Tensor):
+        norms = torch.linalg.norm(quaternions, dim=-1, keepdim=True)
+    else:
+        norms = np.linalg.norm(quaternions, axis=-1, keepdims=True)
+    quaternions = quaternions / norms
+
+    x, y, z, w = (quaternions[..., i] for i in range(4))
+
+    rows = [
+        [1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w)],
+        [2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w)],
+        [2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y)],
+    ]
+
+    return _stack([_stack(row, axis=-1) for row in rows], axis=-2)
+
+
+def matrices_to_quaternions(rotations: Array) -> Array:
+    """Convert rotation matrices to quaternions. For each matrix, the quaternion is
+    computed from the largest of its four squared components (numerically stable
+    for any rotation), and its real part is made non-negative.
+
+    Args:
+        rotations (Array): Rotation matrices, of shape (N, 3, 3).
+
+    Returns:
+        Array: Quaternions in the xyzw convention, of shape (N, 4).
+    """
+    r = rotations
+    r00, r01, r02 = r[..., 0, 0], r[..., 0, 1], r[..., 0, 2]
+    r10, r11, r12 = r[..., 1, 0], r[..., 1, 1], r[..., 1, 2]
+    r20, r21, r22 = r[..., 2, 0], r[..., 2, 1], r[..., 2, 2]
+
+    # 4 x (squared component) for x, y, z and w
+    t = _stack([
+        1 + r00 - r11 - r22,
+        1 - r00 + r11 - r22,
+        1 - r00 - r11 + r22,
+        1 + r00 + r11 + r22,
+    ], axis=-1)
+
+    # Candidate quaternions (up to scale), one per largest component
+    candidates = _stack([
+        _stack([t[..., 0], r01 + r10, r02 + r20, r21 - r12], axis=-1),
+        _stack([r01 + r10, t[..., 1], r12 + r21, r02 - r20], axis=-1),
+        _stack([r02 + r20, r12 + r21, t[..., 2], r10 - r01], axis=-1),
+        _stack([r21 - r12, r02 - r20, r10 - r01, t[..., 3]], axis=-1),
+    ], axis=-2)
+
+    if isinstance(rotations, torch.Tensor):
+        best = t.argmax(dim=-1)
+        arange = torch.arange(len(best), device=best.device)
+        scales = 0.5 / torch.sqrt(t[arange, best].clamp(min=1e-12))
+        signs = 1 - 2 * (candidates[arange, best, 3] < 0).to(t.dtype)
+    else:
+        best = t.argmax(axis=-1)
+        arange = np.arange(len(best))
+        scales = 0.5 / np.sqrt(np.maximum(t[arange, best], 1e-12))
+        signs = 1 - 2 * (candidates[arange, best, 3] < 0).astype(t.dtype)
+
+    return candidates[arange, best] * (scales * signs)[:, None]
+
+
+class BatchTransform:
+    """
+    Batch of N rigid transforms, stored as homogeneous matrices of shape (N, 4, 4).
+    The last row of the matrices is assumed to be [0, 0, 0, 1] (it is not checked).
+    Binary operations between batches of N and 1 transforms broadcast.
+    """
+    def __init__(self, T: Union[BatchTransform, Array]) -> None:
+        """Constructor.
+
+        Args:
+            T (Union[BatchTransform, Array]): Homogeneous matrices, of shape (N, 4, 4)
+                or (4, 4), or poses made of a xyzw quaternion followed by a
+                translation, of shape (N, 7) or (7,). NumPy arrays or torch tensors
+                (the backend is kept, and the tensors are not detached).
+
+        Raises:
+            ValueError: If the shape of the poses is invalid.
+        """
+        if isinstance(T, BatchTransform):
+            T = T._T
+        elif not isinstance(T, torch.Tensor):
+            T = np.asarray(T)
+
+        if T.shape[-2:] == (4, 4) and T.ndim in (2, 3):
+            self._T = T.reshape(-1, 4, 4)
+        elif T.shape[-1] == 7 and T.ndim in (1, 2):
+            T = T.reshape(-1, 7)
+            self._T = BatchTransform.from_quaternions_translations(
+                T[:, :4],
+                T[:, 4:],
+            )._T
+        else:
+            raise ValueError(
+                "Expected poses of shape (N, 4, 4), (4, 4), (N, 7) or (7,) but got "
+                f"poses of shape {tuple(T.shape)}."
+            )
+
+    @classmethod
+    def from_quaternions_translations(
+        cls,
+        quaternions: Array,
+        translations: Array,
+    ) -> BatchTransform:
+        """Make transforms from rotations and translations.
+
+        Args:
+            quaternions (Array): Rotations as xyzw quaternions, of shape (N, 4), or as
+                rotation matrices, of shape (N, 3, 3).
+            translations (Array): Translations, of shape (N, 3).
+
+        Returns:
+            BatchTransform: The transforms.
+        """
+        if not isinstance(quaternions, torch.Tensor):
+            quaternions = np.asarray(quaternions, dtype=np.float64)
+            translations = np.asarray(translations, dtype=np.float64)
+
+        if quaternions.shape[-2:] == (3, 3):
+            rotations = quaternions.reshape(-1, 3, 3)
+        else:
+            rotations = quaternions_to_matrices(quaternions.reshape(-1, 4))
+
+        translations = translations.reshape(-1, 3)
+
+        if isinstance(rotations, torch.Tensor):
+            bottom = rotations.new_tensor([0.0, 0.0, 0.0, 1.0])
+            bottom = bottom.expand(len(rotations), 1, 4)
+        else:
+            bottom = np.tile(
+                np.array([0.0, 0.0, 0.0, 1.0], dtype=rotations.dtype),
+                (len(rotations), 1, 1),
+            )
+
+        top = _concatenate([rotations, translations[:, :, None]], axis=2)
+
+        return cls(_concatenate([top, bottom], axis=1))
+
+    @classmethod
+    def identity(
+        cls,
+        n: int = 1,
+        device: Union[str, torch.device, None] = None,
+    ) -> BatchTransform:
+        """Make identity transforms.
+
+        Args:
+            n (int, optional): Number of transforms. Defaults to 1.
+            device (Union[str, torch.device, None], optional): Device of the tensor. If
+                None, a NumPy array is used. Defaults to None.
+
+        Returns:
+            BatchTransform: The transforms.
+        """
+        if device is None:
+            return cls(np.tile(np.eye(4), (n, 1, 1)))
+        return cls(torch.eye(4, device=device).repeat(n, 1, 1))
+
+    @classmethod
+    def concatenate(cls, transforms: Sequence[BatchTransform]) -> BatchTransform:
+        """Concatenate batches of transforms.
+
+        Args:
+            transforms (Sequence[BatchTransform]): Batches of the same backend.
+
+        Returns:
+            BatchTransform: The concatenated batch.
+        """
+        return cls(_concatenate([T._T for T in transforms], axis=0))
+
+    def __len__(self) -> int:
+        return len(self._T)
+
+    def __getitem__(self, idx) -> BatchTransform:
+        return BatchTransform(self._T[idx].reshape(-1, 4, 4))
+
+    def __repr__(self) -> str:
+        return f"BatchTransform({self._T!r})"
+
+    def __mul__(self, other: BatchTransform) -> BatchTransform:
+        """Compose the transforms (self applied after other).
+
+        Args:
+            other (BatchTransform): Transforms applied first.
+
+        Returns:
+            BatchTransform: The composed transforms.
+        """
+        return BatchTransform(self._T @ other._T)
+
+    def inverse(self) -> BatchTransform:
+        """Invert the transforms (without a general matrix inversion).
+
+        Returns:
+            BatchTransform: The inverse transforms.
+        """
+        R_inv = self._T[:, :3, :3].swapaxes(-1, -2)
+        t_inv = -(R_inv @ self._T[:, :3, 3:])
+
+        if isinstance(self._T, torch.Tensor):
+            T_inv = self._T.clone()
+        else:
+            T_inv = self._T.copy()
+        T_inv[:, :3, :3] = R_inv
+        T_inv[:, :3, 3:] = t_inv
+
+        return BatchTransform(T_inv)
+
+    def apply(self, points: Array) -> Array:
+        """Transform points.
+
+        Args:
+            points (Array): Points, of shape (P, 3) (each point transformed by every
+                transform) or (N, P, 3) (points of each transform).
+
+        Returns:
+            Array: Transformed points, of shape (N, P, 3).
+        """
+        R = self._T[:, :3, :3]
+        t = self._T[:, None, :3, 3]
+
+        return points @ R.swapaxes(-1, -2) + t
+
+    @property
+    def rotation(self) -> Array:
+        """Rotation matrices, of shape (N, 3, 3)."""
+        return self._T[:, :3, :3]
+
+    @property
+    def translation(self) -> Array:
+        """Translations, of shape (N, 3)."""
+        return self._T[:, :3, 3]
+
+    @property
+    def quaternion(self) -> Array:
+        """Rotations as xyzw quaternions, of shape (N, 4)."""
+        return matrices_to_quaternions(self._T[:, :3, :3])
+
+    @property
+    def pose7(self) -> Array:
+        """Poses as xyzw quaternions followed by translations, of shape (N, 7)."""
+        return _concatenate([self.quaternion, self.translation], axis=1)
+
+    @property
+    def data(self) -> Array:
+        """Homogeneous matrices, of shape (N, 4, 4), in their own backend."""
+        return self._T
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """Homogeneous matrices as a float32 NumPy array, of shape (N, 4, 4)."""
+        if isinstance(self._T, torch.Tensor):
+            return self._T.detach().cpu().numpy().astype(np.float32)
+        return self._T.astype(np.float32)
+
+    @property
+    def tensor(self) -> torch.Tensor:
+        """Homogeneous matrices as a float32 tensor, of shape (N, 4, 4)."""
+        if isinstance(self._T, torch.Tensor):
+            return self._T.float()
+        return torch.as_tensor(self._T, dtype=torch.float32)
+
+    def to(self, device: Union[str, torch.device]) -> BatchTransform:
+        """Move the transforms to a device (as a tensor).
+
+        Args:
+            device (Union[str, torch.device]): The device.
+
+        Returns:
+            BatchTransform: The transforms on the device.
+        """
+        return BatchTransform(torch.as_tensor(self._T).to(device))
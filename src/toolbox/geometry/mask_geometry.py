@@ -0,0 +1,91 @@
+"""
+Batched, tensor-native geometry of binary masks (boundaries and bounding boxes). The
+computations stay on the device of the masks; only the requested points are copied to
+the host.
+"""
+# Standard libraries
+from typing import List
+
+# Third-party libraries
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+
+def masks_to_bboxes(masks: torch.Tensor) -> torch.Tensor:
+    """Compute the bounding boxes of a batch of binary masks.
+
+    Args:
+        masks (torch.Tensor): Binary masks, of shape (B, H, W).
+
+    Returns:
+        torch.Tensor: Bounding boxes in the format [xmin, ymin, xmax, ymax] (pixel
+            coordinates, inclusive), of shape (B, 4) (float). Empty masks have a
+            [0, 0, 0, 0] box.
+    """
+    masks = masks.bool()
+    _, height, width = masks.shape
+
+    cols = masks.any(dim=1)
+    rows = masks.any(dim=2)
+
+    xs = torch.arange(width, device=masks.device)
+    ys = torch.arange(height, device=masks.device)
+
+    # Smallest and largest indexes of the non-empty columns and rows
+    xmin = torch.where(cols, xs, width).min(dim=1).values
+    xmax = torch.where(cols, xs, -1).max(dim=1).values
+    ymin = torch.where(rows, ys, height).min(dim=1).values
+    ymax = torch.where(rows, ys, -1).max(dim=1).values
+
+    bboxes = torch.stack([xmin, ymin, xmax, ymax], dim=1)
+
+    # Empty masks
+    bboxes[~cols.any(dim=1)] = 0
+
+    return bboxes.float()
+
+
+def masks_boundaries(masks: torch.Tensor) -> torch.Tensor:
+    """Compute the boundary pixels of a batch of binary masks, i.e. the pixels of the
+    masks which have at least one 4-neighbor outside the mask (pixels on the border of
+    the image included). This is the set of pixels `cv2.findContours` traces, except
+    that the boundaries of the holes are included too.
+
+    Args:
+        masks (torch.Tensor): Binary masks, of shape (B, H, W).
+
+    Returns:
+        torch.Tensor: Binary boundaries, of shape (B, H, W) (bool).
+    """
+    masks = masks.bool()
+
+    # Pixels out of the image are considered out of the masks
+    outside = F.pad((~masks).unsqueeze(1).float(), (1, 1, 1, 1), value=1.0)
+    outside = outside.squeeze(1).bool()
+
+    has_outside_neighbor = outside[:, :-2, 1:-1] | outside[:, 2:, 1:-1] |\
+        outside[:, 1:-1, :-2] | outside[:, 1:-1, 2:]
+
+    return masks & has_outside_neighbor
+
+
+def boundaries_to_points(boundaries: torch.Tensor) -> List[List[np.ndarray]]:
+    """Copy the boundary pixels of a batch to the host, in the format of the contours
+    returned by `cv2.findContours` (a list of (N, 2) arrays of (x, y) coordinates per
+    image, here a single array gathering all the boundary pixels of the image).
+
+    Args:
+        boundaries (torch.Tensor): Binary boundaries, of shape (B, H, W).
+
+    Returns:
+        List[List[np.ndarray]]: Boundary points of each image (empty list if the
+            image has no boundary pixel).
+    """
+    # Only the coordinates of the boundary pixels are copied (sorted by image)
+    idx = torch.nonzero(boundaries).cpu().numpy()
+    counts = boundaries.flatten(1).sum(dim=1).cpu().numpy()
+
+    points_per_image = np.split(idx[:, [2, 1]], np.cumsum(counts)[:-1])
+
+    return [[points] if len(points) > 0 else [] for points in points_per_image]
@@ -0,0 +1,250 @@
+"""
+Vectorized sampling of random pose perturbations. The perturbations of a whole batch
+are drawn at once from a seeded torch generator, on the device of the batch, so that
+they can be applied on the fly (e.g. after the batch has been transferred to the GPU)
+instead of being sampled one sample at a time in the dataloader workers.
+"""
+# Standard libraries
+from typing import Dict, Optional, Union
+import math
+
+# Third-party libraries
+import torch
+
+
+def sample_unit_vectors(
+    n: int,
+    generator: Optional[torch.Generator] = None,
+    device: Union[str, torch.device] = "cpu",
+    dtype: torch.dtype = torch.float32,
+) -> torch.Tensor:
+    """Sample unit vectors uniformly on the sphere (normalized Gaussian vectors).
+
+    Args:
+        n (int): Number of vectors.
+        generator (Optional[torch.Generator], optional): Random number generator (on
+            the device). Defaults to None.
+        device (Union[str, torch.device], optional): Device of the vectors. Defaults to
+            "cpu".
+        dtype (torch.dtype, optional): Data type of the vectors. Defaults to
+            torch.float32.
+
+    Returns:
+        torch.Tensor: Unit vectors, of shape (N, 3).
+    """
+    vectors = torch.randn(n, 3, generator=generator, device=device, dtype=dtype)
+
+    return vectors / vectors.norm(dim=1, keepdim=True).clamp(min=1e-12)
+
+
+def axis_angle_to_matrix(axes: torch.Tensor, angles: torch.Tensor) -> torch.Tensor:
+    """Convert rotations given as unit axes and angles to rotation matrices (Rodrigues'
+    formula, for all the rotations at once).
+
+    Args:
+        axes (torch.Tensor): Unit rotation axes, of shape (N, 3).
+        angles (torch.Tensor): Rotation angles (radians), of shape (N,).
+
+    Returns:
+        torch.Tensor: Rotation matrices, of shape (N, 3, 3).
+    """
+    x, y, z = axes.unbind(dim=1)
+    zeros = torch.zeros_like(x)
+
+    # Cross-product matrices of the axes
+    skew = torch.stack([
+        zeros, -z, y,
+        z, zeros, -x,
+        -y, x, zeros,
+    ], dim=1).view(-1, 3, 3)
+
+    sin = torch.sin(angles)[:, None, None]
+    cos = torch.cos(angles)[:, None, None]
+
+    identity = torch.eye(3, dtype=axes.dtype, device=axes.device)
+
+    return identity + sin * skew + (1 - cos) * (skew @ skew)
+
+
+def sample_pose_perturbations(
+    bboxes: torch.Tensor,
+    K: torch.Tensor,
+    Z: torch.Tensor,
+    rel_translation_scale: Optional[float] = None,
+    abs_rotation_scale: Optional[float] = None,
+    prob: float = 1.0,
+    generator: Optional[torch.Generator] = None,
+) -> torch.Tensor:
+    """Sample random pose perturbations of a batch of objects.
+
+    The translation has a random direction and a magnitude uniformly sampled in
+    [-s, s], where s is `rel_translation_scale` times the smallest side of the
+    bounding box back-projected at the depth of the object. The rotation has a random
+    axis and an angle uniformly sampled in [-`abs_rotation_scale`,
+    `abs_rotation_scale`] degrees. Axes are sampled on the whole sphere.
+
+    Args:
+        bboxes (torch.Tensor): Bounding boxes of the objects in the images, in the
+            format [xmin, ymin, xmax, ymax], of shape (N, 4).
+        K (torch.Tensor): Camera intrinsic matrices, of shape (N, 3, 3).
+        Z (torch.Tensor): Depths of the objects in the camera frames, of shape (N,).
+        rel_translation_scale (Optional[float], optional): Relative scale of the
+            translation (no units). If None, the perturbations have no translation.
+            Defaults to None.
+        abs_rotation_scale (Optional[float], optional): Absolute scale of the rotation
+            (degrees). If None, the perturbations have no rotation. Defaults to None.
+        prob (float, optional): Probability of perturbing each pose (the other
+            perturbations are the identity). Defaults to 1.0.
+        generator (Optional[torch.Generator], optional): Random number generator, on
+            the device of the inputs. Defaults to None.
+
+    Returns:
+        torch.Tensor: Pose perturbations represented as transform matrices, of shape
+            (N, 4, 4) (float32, on the device of the inputs).
+    """
+    n = bboxes.size(0)
+    device = bboxes.device
+    dtype = torch.float32
+
+    DT = torch.eye(4, dtype=dtype, device=device).repeat(n, 1, 1)
+
+    # Poses which are perturbed
+    perturbed = torch.rand(n, generator=generator, device=device) <= prob
+
+    if rel_translation_scale is not None:
+        bboxes = bboxes.to(dtype)
+
+        # Size of the bounding boxes in the camera frames (at the depth of the
+        # objects)
+        sizes = Z.to(dtype) / K[:, 0, 0].to(dtype) * torch.minimum(
+            bboxes[:, 2] - bboxes[:, 0],
+            bboxes[:, 3] - bboxes[:, 1],
+        )
+
+        # Set the absolute translation scale (adapted to the object size and
+        # visibility)
+        abs_translation_scale = rel_translation_scale * sizes
+
+        # Random translation (random direction, uniform magnitude)
+        axes = sample_unit_vectors(n, generator, device, dtype)
+        magnitudes = abs_translation_scale * (
+            2 * torch.rand(n, generator=generator, device=device, dtype=dtype) - 1
+        )
+        DT[:, :3, 3] = magnitudes[:, None] * axes
+
+    if abs_rotation_scale is not None:
+
+        # Random angle and axis
+        angles = math.radians(abs_rotation_scale) * (
+            2 * torch.rand(n, generator=generator, device=device, dtype=dtype) - 1
+        )
+        axes = sample_unit_vectors(n, generator, device, dtype)
+
+        DT[:, :3, :3] = axis_angle_to_matrix(axes, angles)
+
+    DT[~perturbed] = torch.eye(4, dtype=dtype, device=device)
+
+    return DT
+
+
+class PosePerturbationSampler:
+    """
+    Sample the pose perturbations of whole batches from a seeded generator, created on
+    the device of the first batch it is applied to.
+    """
+    def __init__(
+        self,
+        prob: float = 1.0,
+        rel_translation_scale: Optional[float] = None,
+        abs_rotation_scale: Optional[float] = None,
+        seed: Optional[int] = None,
+    ) -> None:
+        """Constructor.
+
+        Args:
+            prob (float, optional): Probability of perturbing each pose. Defaults to
+                1.0.
+            rel_translation_scale (Optional[float], optional): Relative scale of the
+                translation (no units). Defaults to None.
+            abs_rotation_scale (Optional[float], optional): Absolute scale of the
+                rotation (degrees). Defaults to None.
+            seed (Optional[int], optional): Seed of the generator. If None, a
+                non-deterministic seed is used. Defaults to None.
+        """
+        self._prob = prob
+        self._rel_translation_scale = rel_translation_scale
+        self._abs_rotation_scale = abs_rotation_scale
+        self._seed = seed
+
+        self._generator: Optional[torch.Generator] = None
+        self._pending_state: Optional[torch.Tensor] = None
+
+    def _get_generator(self, device: torch.device) -> torch.Generator:
+        """Get the generator, (re)creating it if the device has changed.
+
+        Args:
+            device (torch.device): Device of the batch.
+
+        Returns:
+            torch.Generator: The generator.
+        """
+        if self._generator is None or self._generator.device != device:
+            self._generator = torch.Generator(device=device)
+
+            if self._pending_state is not None:
+                self._generator.set_state(self._pending_state)
+                self._pending_state = None
+            elif self._seed is not None:
+                self._generator.manual_seed(self._seed)
+            else:
+                self._generator.seed()
+
+        return self._generator
+
+    def __call__(
+        self,
+        bboxes: torch.Tensor,
+        K: torch.Tensor,
+        Z: torch.Tensor,
+    ) -> torch.Tensor:
+        """Sample the pose perturbations of a batch.
+
+        Args:
+            bboxes (torch.Tensor): Bounding boxes of the objects, of shape (N, 4).
+            K (torch.Tensor): Camera intrinsic matrices, of shape (N, 3, 3).
+            Z (torch.Tensor): Depths of the objects, of shape (N,).
+
+        Returns:
+            torch.Tensor: Pose perturbations, of shape (N, 4, 4).
+        """
+        return sample_pose_perturbations(
+            bboxes,
+            K,
+            Z,
+            rel_translation_scale=self._rel_translation_scale,
+            abs_rotation_scale=self._abs_rotation_scale,
+            prob=self._prob,
+            generator=self._get_generator(bboxes.device),
+        )
+
+    def state_dict(self) -> Dict[str, Optional[torch.Tensor]]:
+        """Get the state of the generator (to resume the stream of perturbations).
+
+        Returns:
+            Dict[str, Optional[torch.Tensor]]: State of the generator (None if no
+                perturbation has been sampled yet).
+        """
+        if self._generator is None:
+            return {"generator": self._pending_state}
+        return {"generator": self._generator.get_state()}
+
+    def load_state_dict(self, state_dict: Dict[str, Optional[torch.Tensor]]) -> None:
+        """Restore the state of the generator. It is applied when the generator is
+        (re)created on the device of the next batch.
+
+        Args:
+            state_dict (Dict[str, Optional[torch.Tensor]]): State returned by
+                `state_dict`.
+        """
+        self._pending_state = state_dict.get("generator")
+        self._generator = None
@@ -1,14 +1,14 @@
 # Standard libraries
-from typing import Tuple
+from typing import Optional, Tuple
 
 # Third-party libraries
 import torch
 import torch.nn as nn
-from pytorch3d.io import load_objs_as_meshes
 from pytorch3d.renderer import (
     MeshRasterizer,
     RasterizationSettings,
 )
+from pytorch3d.structures import Meshes
 from pytorch3d.utils import cameras_from_opencv_projection
 import matplotlib.pyplot as plt
 import matplotlib.patches as patches
@@ -18,6 +18,20 @@ import numpy as np
 # Custom modules
 from toolbox.datasets.object_set import RigidObjectSet
 from toolbox.datasets.segmentation_dataset import BatchSegmentationData
+from toolbox.datasets.baked_mesh import load_scaled_meshes
+from toolbox.datasets.mesh_lod import load_lod_meshes
+from toolbox.utils.mesh_cache import MeshCache
+from toolbox.modules.roi_rendering import render_roi_masks
+from toolbox.modules.lod_selection import select_lods
+from toolbox.modules.scene_rendering import (
+    instance_maps_to_masks,
+    render_instance_maps,
+)
+from toolbox.geometry.mask_geometry import (
+    boundaries_to_points,
+    masks_boundaries,
+    masks_to_bboxes,
+)
 
 
 class ContourRendering(nn.Module):
@@ -29,10 +43,29 @@ class ContourRendering(nn.Module):
         object_set: RigidObjectSet,
         image_size: Tuple[int, int],
         debug: bool = True,
+        mesh_cache_max_entries: Optional[int] = None,
+        mesh_cache_max_bytes: Optional[int] = 2**30,
+        contour_extraction: str = "opencv",
+        roi_rendering: bool = False,
+        roi_margin: int = 8,
+        roi_resolution_scale: float = 1.0,
+        lod_iou_tolerance: Optional[float] = None,
     ) -> None:
         
         super().__init__()
         
+        if contour_extraction not in {"opencv", "tensor"}:
+            raise ValueError(f"Unknown contour extraction method: {contour_extraction}")
+        
+        # Contours traced by OpenCV on the host, or boundary pixels extracted on the
+        # device
+        self._contour_extraction = contour_extraction
+        
+        # Rasterize the regions of interest of the objects only
+        self._roi_rendering = roi_rendering
+        self._roi_margin = roi_margin
+        self._roi_resolution_scale = roi_resolution_scale
+        
         self._object_set = object_set
         
         self._image_size = image_size
@@ -53,23 +86,25 @@ class ContourRendering(nn.Module):
             raster_settings=raster_settings,
         )
         
+        # Meshes of the objects rendered in debug mode, loaded on demand
+        self._mesh_cache = MeshCache(
+            object_set,
+            max_entries=mesh_cache_max_entries,
+            max_bytes=mesh_cache_max_bytes,
+        ) if self._debug else None
+        
+        # Render the objects with the coarsest level of detail of their meshes which
+        # keeps the silhouettes within this tolerance on the IoU (if not None)
+        self._lod_iou_tolerance = lod_iou_tolerance
+        
         if not self._debug:
             
-            # Get the paths to the meshes of the objects
-            mesh_paths = [object.mesh_path for object in object_set]
-
-            # Load the meshes (without textures)
-            self._meshes = load_objs_as_meshes(files=mesh_paths,
-                                               load_textures=False,
-            )
-
-            # In-place scaling of the vertices
-            if object_set.scale is not None:
-                self._meshes.scale_verts_(object_set.scale)
+            if self._lod_iou_tolerance is not None:
+                # Load the scaled meshes of the objects with all their levels of detail
+                self._meshes, self._lods_idx = load_lod_meshes(object_set.objects)
             else:
-                raise NotImplementedError(
-                    "Scaling the meshes to different scales is not supported."
-                )
+                # Load the scaled meshes of the objects (from their baked files if any)
+                self._meshes = load_scaled_meshes(object_set.objects)
     
     @staticmethod
     def _generate_valid_contour(masks: np.ndarray) -> Tuple[Tuple, np.ndarray]:
@@ -99,47 +134,111 @@ class ContourRendering(nn.Module):
         return contours_list
     
     
-    @torch.no_grad()
-    def forward(self, x: BatchSegmentationData) -> Tuple:
-        
-        if self._debug:
-            
-            # Create the set of labels to filter the objects
-            keep_labels = set(x.object_datas[i].label for i in range(x.batch_size))
+    @property
+    def mesh_cache(self) -> Optional[MeshCache]:
+        """Get the cache of the meshes rendered in debug mode.
 
-            # Create a new temporary object set with only the objects of the batch
-            object_set = self._object_set.filter_objects(keep_labels)
+        Returns:
+            Optional[MeshCache]: The mesh cache (None if not in debug mode).
+        """
+        return self._mesh_cache
+    
+    def _get_batch_meshes(
+        self,
+        x: BatchSegmentationData,
+        TCO: torch.Tensor,
+    ) -> Meshes:
+        """Get the meshes of the objects of a batch.
 
-            # Get the paths to the meshes of the objects
-            mesh_paths = [object.mesh_path for object in object_set]
+        Args:
+            x (BatchSegmentationData): A batch of segmentation data.
+            TCO (torch.Tensor): Poses in which the objects are rendered, of shape
+                (B, 4, 4) (used to select the levels of detail of the meshes).
 
-            # Load the meshes (without textures)
-            meshes = load_objs_as_meshes(files=mesh_paths,
-                                         load_textures=False,
+        Returns:
+            Meshes: The meshes, one per sample of the batch.
+        """
+        labels = [obj_data.label for obj_data in x.object_datas]
+        
+        # Level of detail of the mesh of each object (0 for the full meshes)
+        lods = select_lods(
+            [self._object_set[label] for label in labels],
+            K=x.K,
+            TCO=TCO,
+            iou_tolerance=self._lod_iou_tolerance,
+        ) if self._lod_iou_tolerance is not None else None
+        
+        if self._debug:
+            
+            # Get the meshes of the objects of the batch from the cache (they are only
+            # loaded the first time they are rendered)
+            return self._mesh_cache.get_batch(
+                labels,
+                device=x.rgbs.device,
+                lods=lods,
             )
-
-            # In-place scaling of the vertices
-            if self._object_set.scale is not None:
-                meshes.scale_verts_(self._object_set.scale)
-            else:
-                raise NotImplementedError(
-                    "Scaling the meshes to different scales is not supported."
-                )
-        else:
-            object_set = self._object_set
-            meshes = self._meshes
         
-        meshes = meshes.to(device=x.rgbs.device)
+        meshes = self._meshes.to(device=x.rgbs.device)
         
         # Get the indexes of the objects in the object set that correspond to the
         # objects in the batch
         batch_objects_idx = [
-            object_set.get_id_from_label(obj_data.label) for obj_data in x.object_datas
+            self._object_set.get_id_from_label(label) for label in labels
         ]
         
+        if lods is not None:
+            batch_objects_idx = [
+                self._lods_idx[idx][lod] for idx, lod in zip(batch_objects_idx, lods)
+            ]
+        
+        return meshes[batch_objects_idx]
+    
+    @torch.no_grad()
+    def render_masks(
+        self,
+        x: BatchSegmentationData,
+        frame_ids: Optional[torch.Tensor] = None,
+    ) -> torch.Tensor:
+        """Render the silhouettes of the objects of a batch in their perturbed poses.
+
+        Args:
+            x (BatchSegmentationData): A batch of segmentation data.
+            frame_ids (Optional[torch.Tensor], optional): Identifier of the frame of
+                each object of the batch, of shape (B,). If not None, the objects
+                sharing a frame are rendered together (single rasterizer call, one
+                instance-id map per frame) and their masks only cover their visible
+                parts. Defaults to None (one frame per object).
+
+        Returns:
+            torch.Tensor: Binary masks, of shape (B, H, W) (bool), on the device of
+                the batch.
+        """
         # Apply the perturbation to the ground truth pose
         TCO = torch.bmm(x.TCO, x.DTO)
         
+        batch_meshes = self._get_batch_meshes(x, TCO)
+        
+        if frame_ids is not None:
+            return instance_maps_to_masks(*render_instance_maps(
+                self._rasterizer,
+                batch_meshes,
+                K=x.K,
+                TCO=TCO,
+                frame_ids=frame_ids,
+                image_size=self._image_size,
+            ))
+        
+        if self._roi_rendering:
+            return render_roi_masks(
+                self._rasterizer,
+                batch_meshes,
+                K=x.K,
+                TCO=TCO,
+                image_size=self._image_size,
+                margin=self._roi_margin,
+                resolution_scale=self._roi_resolution_scale,
+            )
+        
         # Rotation matrices and translation vectors
         R = TCO[:, :3, :3]
         tvec = TCO[:, :3, 3]
@@ -152,15 +251,51 @@ class ContourRendering(nn.Module):
             image_size=torch.Tensor(x.image_size).unsqueeze(0),
         ).to(device=x.rgbs.device)
         
-        # Generate the depth map
-        depth_maps = self._rasterizer(
-            meshes[batch_objects_idx],
+        # Rasterize the meshes (pixels not covered by any face have a -1 index)
+        pix_to_face = self._rasterizer(
+            batch_meshes,
             cameras=cameras,
-        ).zbuf[..., 0]
+        ).pix_to_face[..., 0]
+        
+        return pix_to_face >= 0
+    
+    @torch.no_grad()
+    def render_bboxes(
+        self,
+        x: BatchSegmentationData,
+        frame_ids: Optional[torch.Tensor] = None,
+    ) -> torch.Tensor:
+        """Render the objects of a batch and compute the bounding boxes of their
+        silhouettes, without leaving the device.
+
+        Args:
+            x (BatchSegmentationData): A batch of segmentation data.
+            frame_ids (Optional[torch.Tensor], optional): Identifier of the frame of
+                each object of the batch (see `render_masks`). Defaults to None.
+
+        Returns:
+            torch.Tensor: Bounding boxes in the format [xmin, ymin, xmax, ymax], of
+                shape (B, 4).
+        """
+        return masks_to_bboxes(self.render_masks(x, frame_ids=frame_ids))
+    
+    @torch.no_grad()
+    def forward(
+        self,
+        x: BatchSegmentationData,
+        frame_ids: Optional[torch.Tensor] = None,
+    ) -> Tuple:
+        
+        masks = self.render_masks(x, frame_ids=frame_ids)
+        
+        if self._contour_extraction == "tensor":
+            # Boundary pixels extracted on the device, only the points are copied to
+            # the host
+            return boundaries_to_points(masks_boundaries(masks))
         
-        # Create masks from the depth maps, send them to the CPU and convert them to
-        # numpy arrays for OpenCV processing
-        masks = (depth_maps > 0).type(torch.float32).cpu().numpy()
+        # Send the masks to the CPU and convert them to numpy arrays for OpenCV
+        # processing
+        masks = masks.type(torch.float32).cpu().numpy()
         
         # Get the contour points
         contour_points_list = ContourRendering._generate_valid_contour(
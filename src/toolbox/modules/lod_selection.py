@@ -0,0 +1,185 @@
+"""
+Selection of the level of detail (LOD) of the meshes to render. The projected diameter
+of each object (pixels) is computed from its diameter, the intrinsics and its pose, and
+the coarsest level whose silhouettes stay within a tolerance on the IoU with the
+silhouettes of the full mesh at this size is picked. Small or distant objects are thus
+rendered from decimated meshes rather than from full-resolution scans.
+"""
+# Standard libraries
+import math
+from typing import List, Sequence
+
+# Third-party libraries
+import torch
+import torch.nn.functional as F
+from pytorch3d.structures import Meshes
+from pytorch3d.transforms import quaternion_to_matrix
+
+# Custom modules
+from toolbox.datasets.object_set import RigidObject
+from toolbox.modules.silhouette_rasterizer import SilhouetteRasterizer
+
+
+def projected_diameters(
+    diameters: torch.Tensor,
+    K: torch.Tensor,
+    TCO: torch.Tensor,
+) -> torch.Tensor:
+    """Compute the projected diameters of objects (pinhole approximation at the depth
+    of the origin of the objects).
+
+    Args:
+        diameters (torch.Tensor): Diameters of the objects, of shape (B,).
+        K (torch.Tensor): Intrinsics matrices, of shape (B, 3, 3).
+        TCO (torch.Tensor): Poses of the objects in the camera frames, of shape
+            (B, 4, 4).
+
+    Returns:
+        torch.Tensor: Projected diameters (pixels), of shape (B,). Objects whose
+            origin is not in front of the camera have an infinite diameter.
+    """
+    focal_lengths = (K[:, 0, 0] + K[:, 1, 1]) / 2
+    z = TCO[:, 2, 3]
+
+    return torch.where(
+        z > 0,
+        focal_lengths * diameters.to(z.dtype) / z.clamp(min=1e-12),
+        torch.full_like(z, float("inf")),
+    )
+
+
+def select_lods(
+    objects: List[RigidObject],
+    K: torch.Tensor,
+    TCO: torch.Tensor,
+    iou_tolerance: float,
+) -> List[int]:
+    """Select the level of detail of the mesh of each object of a batch.
+
+    Args:
+        objects (List[RigidObject]): Objects of the batch.
+        K (torch.Tensor): Intrinsics matrices, of shape (B, 3, 3).
+        TCO (torch.Tensor): Poses of the objects in the camera frames, of shape
+            (B, 4, 4).
+        iou_tolerance (float): Tolerated loss of silhouette IoU w.r.t. the full
+            meshes.
+
+    Returns:
+        List[int]: Level of detail of each object (0 for the full mesh, i > 0 for
+            `obj.lods[i - 1]`).
+    """
+    # Objects of unknown diameter are always rendered with their full mesh
+    diameters = torch.tensor(
+        [
+            obj.mesh_diameter * obj.scale if obj.mesh_diameter is not None
+            else float("inf")
+            for obj in objects
+        ],
+        device=TCO.device,
+    )
+
+    pixel_diameters = projected_diameters(diameters, K, TCO).tolist()
+
+    lods = []
+
+    for obj, pixel_diameter in zip(objects, pixel_diameters):
+        lod = 0
+
+        # Coarsest level accurate enough at this size
+        for i in range(len(obj.lods), 0, -1):
+            if pixel_diameter <= obj.lods[i - 1].max_pixel_diameter(iou_tolerance):
+                lod = i
+                break
+
+        lods.append(lod)
+
+    return lods
+
+
+def _random_rotations(nb_rotations: int, generator: torch.Generator) -> torch.Tensor:
+    """Sample rotation matrices uniformly.
+
+    Args:
+        nb_rotations (int): Number of rotations.
+        generator (torch.Generator): Random number generator.
+
+    Returns:
+        torch.Tensor: Rotation matrices, of shape (N, 3, 3).
+    """
+    quaternions = F.normalize(torch.randn(nb_rotations, 4, generator=generator), dim=1)
+
+    return quaternion_to_matrix(quaternions)
+
+
+@torch.no_grad()
+def calibrate_lod(
+    mesh: Meshes,
+    lod_mesh: Meshes,
+    diameter: float,
+    pixel_diameters: Sequence[float],
+    nb_views: int = 16,
+    seed: int = 0,
+) -> List[float]:
+    """Compare the silhouettes of a decimated mesh with the silhouettes of the full
+    mesh, seen from random viewpoints at several projected diameters.
+
+    Args:
+        mesh (Meshes): Full mesh of the object (scaled).
+        lod_mesh (Meshes): Decimated mesh of the object (scaled).
+        diameter (float): Diameter of the object (scaled).
+        pixel_diameters (Sequence[float]): Projected diameters of the object (pixels).
+        nb_views (int, optional): Number of viewpoints. Defaults to 16.
+        seed (int, optional): Seed of the viewpoints. Defaults to 0.
+
+    Returns:
+        List[float]: Smallest IoU over the viewpoints at each projected diameter.
+    """
+    generator = torch.Generator().manual_seed(seed)
+    R = _random_rotations(nb_views, generator)
+
+    # Look at the center of the bounding box of the object
+    bounds = mesh.get_bounding_boxes()[0]
+    center = bounds.mean(dim=1)
+
+    # Arbitrary focal length (only the projected diameter matters)
+    focal_length = 1000.0
+
+    ious = []
+
+    for pixel_diameter in pixel_diameters:
+
+        # Image large enough to contain the object
+        size = math.ceil(1.2 * pixel_diameter) + 8
+
+        K = torch.tensor([
+            [focal_length, 0.0, size / 2],
+            [0.0, focal_length, size / 2],
+            [0.0, 0.0, 1.0],
+        ]).expand(nb_views, 3, 3)
+
+        TCO = torch.eye(4).repeat(nb_views, 1, 1)
+        TCO[:, :3, :3] = R
+        TCO[:, :3, 3] = -R @ center
+        TCO[:, 2, 3] += focal_length * diameter / pixel_diameter
+
+        rasterizer = SilhouetteRasterizer(image_size=(size, size))
+
+        silhouettes = rasterizer(mesh.extend(nb_views), K=K, TCO=TCO).flatten(1)
+        lod_silhouettes = rasterizer(
+            lod_mesh.extend(nb_views),
+            K=K,
+            TCO=TCO,
+        ).flatten(1)
+
+        intersections = (silhouettes & lod_silhouettes).sum(dim=1)
+        unions = (silhouettes | lod_silhouettes).sum(dim=1)
+
+        # Two empty silhouettes match
+        view_ious = torch.where(
+            unions > 0,
+            intersections / unions.clamp(min=1),
+            torch.ones_like(unions, dtype=torch.float32),
+        )
+        ious.append(float(view_ious.min()))
+
+    return ious
@@ -1,19 +1,32 @@
 # Standard libraries
-from typing import Tuple
+from typing import Dict, Optional, Tuple
 
 # Third-party libraries
 import torch
 import torch.nn as nn
-from pytorch3d.io import load_objs_as_meshes
 from pytorch3d.renderer import (
     MeshRasterizer,
     RasterizationSettings,
 )
+from pytorch3d.structures import Meshes
 from pytorch3d.utils import cameras_from_opencv_projection
 
 # Custom modules
 from toolbox.datasets.object_set import RigidObjectSet
 from toolbox.datasets.segmentation_dataset import BatchSegmentationData
+from toolbox.datasets.baked_mesh import load_scaled_meshes
+from toolbox.datasets.mesh_lod import load_lod_meshes
+from toolbox.utils.mesh_cache import MeshCache
+from toolbox.modules.roi_rendering import render_roi_masks
+from toolbox.modules.lod_selection import select_lods
+from toolbox.modules.scene_rendering import (
+    instance_maps_to_masks,
+    render_instance_maps,
+)
+from toolbox.modules.silhouette_rasterizer import (
+    SilhouetteRasterizer,
+    silhouettes_mismatch,
+)
 
 
 class MaskRendering(nn.Module):
@@ -25,6 +38,13 @@ class MaskRendering(nn.Module):
         object_set: RigidObjectSet,
         image_size: Tuple[int, int],
         debug: bool = False,
+        mesh_cache_max_entries: Optional[int] = None,
+        mesh_cache_max_bytes: Optional[int] = 2**30,
+        backend: str = "pytorch3d",
+        roi_rendering: bool = False,
+        roi_margin: int = 8,
+        roi_resolution_scale: float = 1.0,
+        lod_iou_tolerance: Optional[float] = None,
     ) -> None:
         """Constructor.
 
@@ -32,11 +52,32 @@ class MaskRendering(nn.Module):
             object_set (RigidObjectSet): Object set containing the objects to render.
             image_size (Tuple[int, int]): Size of the rendered masks.
             debug (bool, optional): Flag to enable debug mode. If False, all the meshes
-                are loaded and scaled at the beginning. Defaults to False.
+                are loaded and scaled at the beginning. Otherwise, they are loaded the
+                first time they are rendered and kept in an LRU cache. Defaults to
+                False.
+            mesh_cache_max_entries (Optional[int], optional): Maximum number of meshes
+                in the cache (debug mode). If None, it is not limited. Defaults to None.
+            mesh_cache_max_bytes (Optional[int], optional): Maximum memory footprint of
+                the meshes in the cache (debug mode). If None, it is not limited.
+                Defaults to 1 GiB.
+            backend (str, optional): Rasterization backend. Either "pytorch3d" (mesh
+                rasterizer of pytorch3d) or "silhouette" (lightweight rasterizer of
+                binary silhouettes, much faster on CPU). Defaults to "pytorch3d".
+            roi_rendering (bool, optional): Whether to rasterize only the regions of
+                interest of the objects (projected bounds of the meshes) instead of the
+                full images. Defaults to False.
+            roi_margin (int, optional): Margin added around the projected bounds of the
+                meshes (pixels). Defaults to 8.
+            roi_resolution_scale (float, optional): Resolution at which the regions of
+                interest are rendered, relative to the resolution of the images.
+                Defaults to 1.0.
+            lod_iou_tolerance (Optional[float], optional): If not None, each object is
+                rendered with the coarsest level of detail of its mesh whose silhouette
+                IoU with the full mesh, at the projected size of the object, is within
+                this tolerance (see `toolbox.datasets.mesh_lod`). Defaults to None.
 
         Raises:
-            NotImplementedError: Scaling the meshes to different scales is not
-                supported.
+            ValueError: If the backend is unknown.
         """
         super().__init__()
         
@@ -45,6 +86,16 @@ class MaskRendering(nn.Module):
         self._image_size = image_size
         self._debug = debug
         
+        if backend not in {"pytorch3d", "silhouette"}:
+            raise ValueError(f"Unknown rasterization backend: {backend}")
+        
+        self._backend = backend
+        
+        # Rasterize the regions of interest of the objects only (pytorch3d backend)
+        self._roi_rendering = roi_rendering
+        self._roi_margin = roi_margin
+        self._roi_resolution_scale = roi_resolution_scale
+        
         # Set rasterization settings
         raster_settings = RasterizationSettings(
             image_size=image_size,
@@ -60,73 +111,112 @@ class MaskRendering(nn.Module):
             raster_settings=raster_settings,
         )
         
+        self._silhouette_rasterizer = SilhouetteRasterizer(image_size=image_size)
+        
+        # Meshes of the objects rendered in debug mode, loaded on demand
+        self._mesh_cache = MeshCache(
+            object_set,
+            max_entries=mesh_cache_max_entries,
+            max_bytes=mesh_cache_max_bytes,
+        ) if self._debug else None
+        
+        # Render the objects with the coarsest level of detail of their meshes which
+        # keeps the silhouettes within this tolerance on the IoU (if not None)
+        self._lod_iou_tolerance = lod_iou_tolerance
+        
         if not self._debug:
             
-            # Get the paths to the meshes of the objects
-            mesh_paths = [object.mesh_path for object in object_set]
-
-            # Load the meshes (without textures)
-            self._meshes = load_objs_as_meshes(files=mesh_paths,
-                                               load_textures=False,
-            )
-
-            # In-place scaling of the vertices
-            if object_set.scale is not None:
-                self._meshes.scale_verts_(object_set.scale)
+            if self._lod_iou_tolerance is not None:
+                # Load the scaled meshes of the objects with all their levels of detail
+                self._meshes, self._lods_idx = load_lod_meshes(object_set.objects)
             else:
-                raise NotImplementedError(
-                    "Scaling the meshes to different scales is not supported."
-                )
+                # Load the scaled meshes of the objects (from their baked files if any)
+                self._meshes = load_scaled_meshes(object_set.objects)
     
-    @torch.no_grad()
-    def forward(self, x: BatchSegmentationData) -> torch.Tensor:
-        """Forward pass.
+    @property
+    def mesh_cache(self) -> Optional[MeshCache]:
+        """Get the cache of the meshes rendered in debug mode.
+
+        Returns:
+            Optional[MeshCache]: The mesh cache (None if not in debug mode).
+        """
+        return self._mesh_cache
+    
+    def _get_batch_meshes(
+        self,
+        x: BatchSegmentationData,
+        TCO: torch.Tensor,
+    ) -> Meshes:
+        """Get the meshes of the objects of a batch.
 
         Args:
             x (BatchSegmentationData): A batch of segmentation data.
-
-        Raises:
-            NotImplementedError: Scaling the meshes to different scales is not
-                supported.
+            TCO (torch.Tensor): Poses in which the objects are rendered, of shape
+                (B, 4, 4) (used to select the levels of detail of the meshes).
 
         Returns:
-            torch.Tensor: A tensor of masks.
+            Meshes: The meshes, one per sample of the batch.
         """
+        labels = [obj_data.label for obj_data in x.object_datas]
+        
+        # Level of detail of the mesh of each object (0 for the full meshes)
+        lods = select_lods(
+            [self._object_set[label] for label in labels],
+            K=x.K,
+            TCO=TCO,
+            iou_tolerance=self._lod_iou_tolerance,
+        ) if self._lod_iou_tolerance is not None else None
+        
         if self._debug:
             
-            # Create the set of labels to filter the objects
-            keep_labels = set(x.object_datas[i].label for i in range(x.batch_size))
-            
-            # Create a new temporary object set with only the objects of the batch
-            object_set = self._object_set.filter_objects(keep_labels)
-
-            # Get the paths to the meshes of the objects
-            mesh_paths = [object.mesh_path for object in object_set]
-
-            # Load the meshes (without textures)
-            meshes = load_objs_as_meshes(files=mesh_paths,
-                                         load_textures=False,
+            # Get the meshes of the objects of the batch from the cache (they are only
+            # loaded the first time they are rendered)
+            return self._mesh_cache.get_batch(
+                labels,
+                device=x.rgbs.device,
+                lods=lods,
             )
-
-            # In-place scaling of the vertices
-            if self._object_set.scale is not None:
-                meshes.scale_verts_(self._object_set.scale)
-            else:
-                raise NotImplementedError(
-                    "Scaling the meshes to different scales is not supported."
-                )
-        else:
-            object_set = self._object_set
-            meshes = self._meshes
         
-        meshes = meshes.to(device=x.rgbs.device)
+        meshes = self._meshes.to(device=x.rgbs.device)
         
         # Get the indexes of the objects in the object set that correspond to the
         # objects in the batch
         batch_objects_idx = [
-            object_set.get_id_from_label(obj_data.label) for obj_data in x.object_datas
+            self._object_set.get_id_from_label(label) for label in labels
         ]
         
+        if lods is not None:
+            batch_objects_idx = [
+                self._lods_idx[idx][lod] for idx, lod in zip(batch_objects_idx, lods)
+            ]
+        
+        return meshes[batch_objects_idx]
+    
+    def _render_pytorch3d(
+        self,
+        meshes: Meshes,
+        x: BatchSegmentationData,
+    ) -> torch.Tensor:
+        """Render masks with the pytorch3d mesh rasterizer.
+
+        Args:
+            meshes (Meshes): The meshes, one per sample of the batch.
+            x (BatchSegmentationData): A batch of segmentation data.
+
+        Returns:
+            torch.Tensor: A tensor of masks.
+        """
+        if self._roi_rendering:
+            return render_roi_masks(
+                self._rasterizer,
+                meshes,
+                K=x.K,
+                TCO=x.TCO,
+                image_size=self._image_size,
+                margin=self._roi_margin,
+                resolution_scale=self._roi_resolution_scale,
+            ).type(torch.float32)
+        
         # Rotation matrices and translation vectors
         R = x.TCO[:, :3, :3]
         tvec = x.TCO[:, :3, 3]
@@ -141,12 +231,92 @@ class MaskRendering(nn.Module):
         
         # Generate the depth map
         depth_maps = self._rasterizer(
-            meshes[batch_objects_idx],
+            meshes,
             cameras=cameras,
         ).zbuf[..., 0]
         
-        # Create masks from the depth maps, send them to the CPU and convert them to
-        # numpy arrays for OpenCV processing
+        # Create masks from the depth maps
         masks = (depth_maps > 0).type(torch.float32)
         
         return masks
+    
+    @torch.no_grad()
+    def render_instance_maps(
+        self,
+        x: BatchSegmentationData,
+        frame_ids: torch.Tensor,
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Render the objects of a batch sharing frames with a single rasterizer call
+        (the objects of a frame are joined into one scene). The pytorch3d rasterizer is
+        used whatever the backend, since the silhouettes have no depth test.
+
+        Args:
+            x (BatchSegmentationData): A batch of segmentation data.
+            frame_ids (torch.Tensor): Identifier of the frame of each object of the
+                batch, of shape (B,).
+
+        Returns:
+            Tuple[torch.Tensor, torch.Tensor]: Index of the object visible at each pixel
+                of each frame (-1 for the background), of shape (F, H, W), and index of
+                the frame of each object, of shape (B,).
+        """
+        return render_instance_maps(
+            self._rasterizer,
+            self._get_batch_meshes(x, x.TCO),
+            K=x.K,
+            TCO=x.TCO,
+            frame_ids=frame_ids,
+            image_size=self._image_size,
+        )
+    
+    @torch.no_grad()
+    def forward(
+        self,
+        x: BatchSegmentationData,
+        frame_ids: Optional[torch.Tensor] = None,
+    ) -> torch.Tensor:
+        """Forward pass.
+
+        Args:
+            x (BatchSegmentationData): A batch of segmentation data.
+            frame_ids (Optional[torch.Tensor], optional): Identifier of the frame of
+                each object of the batch, of shape (B,). If not None, the objects
+                sharing a frame are rendered together and their masks only cover their
+                visible parts. Defaults to None (one frame per object).
+
+        Returns:
+            torch.Tensor: A tensor of masks.
+        """
+        if frame_ids is not None:
+            return instance_maps_to_masks(
+                *self.render_instance_maps(x, frame_ids)
+            ).type(torch.float32)
+        
+        batch_meshes = self._get_batch_meshes(x, x.TCO)
+        
+        if self._backend == "silhouette":
+            return self._silhouette_rasterizer(
+                batch_meshes,
+                K=x.K,
+                TCO=x.TCO,
+            ).type(torch.float32)
+        
+        return self._render_pytorch3d(batch_meshes, x)
+    
+    @torch.no_grad()
+    def compare_backends(self, x: BatchSegmentationData) -> Dict[str, float]:
+        """Render the masks of a batch with both backends and compare them
+        pixel-for-pixel (used to validate the silhouette backend against pytorch3d).
+
+        Args:
+            x (BatchSegmentationData): A batch of segmentation data.
+
+        Returns:
+            Dict[str, float]: Number and fraction of mismatched pixels.
+        """
+        batch_meshes = self._get_batch_meshes(x, x.TCO)
+        
+        silhouettes = self._silhouette_rasterizer(batch_meshes, K=x.K, TCO=x.TCO)
+        reference_masks = self._render_pytorch3d(batch_meshes, x)
+        
+        return silhouettes_mismatch(silhouettes, reference_masks)
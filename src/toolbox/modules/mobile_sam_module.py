@@ -1,4 +1,5 @@
 # Standard libraries
+from pathlib import Path
 from typing import Tuple, Optional
 
 # Third-party libraries
@@ -6,10 +7,14 @@ import torch
 import torch.nn as nn
 from mobile_sam import sam_model_registry
 from mobile_sam.utils.transforms import ResizeLongestSide
+from torchvision.ops import roi_align
 
 import numpy as np
 import cv2
 
+# Custom modules
+from toolbox.utils.embedding_cache import EmbeddingCache
+
 
 class MobileSAM(nn.Module):
     """
@@ -19,8 +24,34 @@ class MobileSAM(nn.Module):
         self,
         sam_checkpoint: Optional[str] = None,
         compile: bool = False,
+        embedding_cache_size: int = 0,
+        embedding_cache_dir: Optional[str] = None,
+        roi_padding: Optional[float] = None,
+        roi_min_size: int = 64,
     ) -> None:
-        
+        """Constructor.
+
+        Args:
+            sam_checkpoint (Optional[str], optional): Pre-trained MobileSAM parameters.
+                Defaults to None.
+            compile (bool, optional): Whether to compile the image encoder and the
+                transformer of the mask decoder. Defaults to False.
+            embedding_cache_size (int, optional): Number of image embeddings kept in
+                memory, so that the image encoder does not run again for images already
+                encoded (0 to disable the in-memory cache). Defaults to 0.
+            embedding_cache_dir (Optional[str], optional): Directory in which the image
+                embeddings are also saved (persistent across runs). If None, they are
+                only kept in memory. Defaults to None.
+            roi_padding (Optional[float], optional): If given, only a square region
+                around each prompt box is encoded (resized to the input size of the
+                encoder) rather than the whole image, and the predicted masks are
+                pasted back in the images. The side of the region is the longest side
+                of the box enlarged by this fraction on each side. Small objects are
+                thus segmented at a higher resolution. If None, the whole images are
+                encoded. Defaults to None.
+            roi_min_size (int, optional): Minimum side of the regions (pixels).
+                Defaults to 64.
+        """
         super().__init__()
         
         # Choose the image encoder
@@ -31,45 +62,434 @@ class MobileSAM(nn.Module):
         self._mobile_sam.eval()
         
         if compile:
-            self._mobile_sam = torch.compile(self._mobile_sam)
+            self._mobile_sam.image_encoder =\
+                torch.compile(self._mobile_sam.image_encoder)
+            self._mobile_sam.mask_decoder.transformer =\
+                torch.compile(self._mobile_sam.mask_decoder.transformer)
         
+        self._roi_padding = roi_padding
+        self._roi_min_size = roi_min_size
+        
+        # Cache of the image embeddings (keyed by the content of the images)
+        self._embedding_cache = None
+        
+        if embedding_cache_size > 0 or embedding_cache_dir is not None:
+            self._embedding_cache = EmbeddingCache(
+                max_entries=embedding_cache_size,
+                cache_dir=embedding_cache_dir,
+                # Embeddings of different weights must not be mixed
+                namespace=f"{model_type}:{Path(sam_checkpoint).name}"
+                if sam_checkpoint is not None else model_type,
+            )
+    
+    @property
+    def embedding_cache(self) -> Optional[EmbeddingCache]:
+        """Getter for the cache of the image embeddings.
+
+        Returns:
+            Optional[EmbeddingCache]: The cache (None if disabled).
+        """
+        return self._embedding_cache
+    
     @staticmethod
-    def _get_bboxes_from_contours(contours: list) -> torch.Tensor:
-        """Compute the bounding box from a list of contours
+    def _get_bboxes_from_contours(contour_points_list: list) -> torch.Tensor:
+        """Compute the bounding boxes of the contours of each image of a batch (all the
+        points of a batch are reduced at once).
+
+        Args:
+            contour_points_list (list): List of contours per image. Each contour is a
+                np.ndarray of shape Nx2.
+
+        Returns:
+            torch.Tensor: Bounding boxes in the format [xmin, ymin, xmax, ymax], of
+                shape (B, 4) ([0, 0, 0, 0] for images without contour points).
+        """
+        bsz = len(contour_points_list)
+        
+        # Number of points of each image
+        nb_points = [
+            sum(len(contour) for contour in contours)
+            for contours in contour_points_list
+        ]
+        
+        if sum(nb_points) == 0:
+            return torch.zeros((bsz, 4))
+        
+        points = torch.from_numpy(np.concatenate([
+            np.asarray(contour, dtype=np.float32).reshape(-1, 2)
+            for contours in contour_points_list
+            for contour in contours
+        ]))
+        images_idx = torch.repeat_interleave(
+            torch.arange(bsz),
+            torch.tensor(nb_points),
+        )
+        
+        index = images_idx.unsqueeze(1).expand(-1, 2)
+        mins = torch.full((bsz, 2), float("inf")).scatter_reduce(
+            0, index, points, reduce="amin",
+        )
+        maxs = torch.full((bsz, 2), -float("inf")).scatter_reduce(
+            0, index, points, reduce="amax",
+        )
+        
+        bboxes = torch.cat([mins, maxs], dim=1)
+        
+        # Images without contour points
+        bboxes[torch.tensor(nb_points) == 0] = 0
+        
+        return bboxes
+    
+    def _encode(self, resized_imgs: torch.Tensor) -> torch.Tensor:
+        """Compute the embeddings of resized images with the image encoder.
+
+        Args:
+            resized_imgs (torch.Tensor): Batch of images resized to the input size of
+                the encoder (longest side), of shape (B, 3, H', W') (float).
+
+        Returns:
+            torch.Tensor: Image embeddings, of shape (B, C, h, w).
+        """
+        # Normalize and pad all the images at once
+        input_images = self._mobile_sam.preprocess(resized_imgs)
+        
+        return self._mobile_sam.image_encoder(input_images)
+    
+    def _image_embeddings(
+        self,
+        imgs: torch.Tensor,
+        resized_imgs: torch.Tensor,
+        regions: Optional[torch.Tensor] = None,
+    ) -> torch.Tensor:
+        """Get the embeddings of images, running the image encoder only on the images
+        whose embeddings are not in the cache.
+
+        Args:
+            imgs (torch.Tensor): Batch of images as given to the model, of shape
+                (B, 3, H, W).
+            resized_imgs (torch.Tensor): The same images (or their regions) resized to
+                the input size of the encoder, of shape (B, 3, H', W') (float).
+            regions (Optional[torch.Tensor], optional): Regions of the images which
+                are encoded, in the format [xmin, ymin, xmax, ymax], of shape (B, 4).
+                If None, the whole images are encoded. Defaults to None.
+
+        Returns:
+            torch.Tensor: Image embeddings, of shape (B, C, h, w).
+        """
+        if self._embedding_cache is None:
+            return self._encode(resized_imgs)
+        
+        input_size = resized_imgs.shape[2:]
+        keys = [
+            self._embedding_cache.make_key(
+                img,
+                input_size,
+                region=regions[i].tolist() if regions is not None else None,
+            )
+            for i, img in enumerate(imgs)
+        ]
+        
+        embeddings = [
+            self._embedding_cache.get(key, device=imgs.device) for key in keys
+        ]
+        
+        # Encode the images which are not in the cache in a single call
+        misses = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        
+        if misses:
+            new_embeddings = self._encode(resized_imgs[misses])
+            
+            for i, embedding in zip(misses, new_embeddings):
+                self._embedding_cache.put(keys[i], embedding)
+                embeddings[i] = embedding
+        
+        return torch.stack(embeddings)
+    
+    def _predict_masks(
+        self,
+        image_embeddings: torch.Tensor,
+        sparse_prompt_embeddings: torch.Tensor,
+        dense_prompt_embeddings: torch.Tensor,
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Predict the masks of a batch of images, one prompt per image, in a single
+        pass through the mask decoder. `MaskDecoder.predict_masks` repeats the image
+        embeddings for every prompt (it decodes several prompts of a single image),
+        here the i-th prompt is decoded with the i-th image embedding.
+
+        Args:
+            image_embeddings (torch.Tensor): Image embeddings, of shape (B, C, h, w).
+            sparse_prompt_embeddings (torch.Tensor): Embeddings of the prompt boxes,
+                of shape (B, N, C).
+            dense_prompt_embeddings (torch.Tensor): Dense prompt embeddings, of shape
+                (B, C, h, w).
+
+        Returns:
+            Tuple[torch.Tensor, torch.Tensor]: Low resolution mask logits, of shape
+                (B, M, 4h, 4w), and predicted IoUs, of shape (B, M), of the M mask
+                tokens.
+        """
+        decoder = self._mobile_sam.mask_decoder
+        
+        # Concatenate the output tokens
+        output_tokens = torch.cat(
+            [decoder.iou_token.weight, decoder.mask_tokens.weight],
+            dim=0,
+        )
+        output_tokens = output_tokens.unsqueeze(0).expand(
+            sparse_prompt_embeddings.size(0), -1, -1
+        )
+        tokens = torch.cat((output_tokens, sparse_prompt_embeddings), dim=1)
+        
+        src = image_embeddings + dense_prompt_embeddings
+        pos_src = self._mobile_sam.prompt_encoder.get_dense_pe().expand(
+            src.size(0), -1, -1, -1
+        )
+        b, c, h, w = src.shape
+        
+        # Run the transformer
+        hs, src = decoder.transformer(src, pos_src, tokens)
+        iou_token_out = hs[:, 0, :]
+        mask_tokens_out = hs[:, 1:(1 + decoder.num_mask_tokens), :]
+        
+        # Upscale the mask embeddings and predict the masks using the mask tokens
+        src = src.transpose(1, 2).reshape(b, c, h, w)
+        upscaled_embedding = decoder.output_upscaling(src)
+        hyper_in = torch.stack(
+            [
+                decoder.output_hypernetworks_mlps[i](mask_tokens_out[:, i, :])
+                for i in range(decoder.num_mask_tokens)
+            ],
+            dim=1,
+        )
+        b, c, h, w = upscaled_embedding.shape
+        masks = (hyper_in @ upscaled_embedding.view(b, c, h * w)).view(b, -1, h, w)
+        
+        # Predict the masks quality
+        iou_predictions = decoder.iou_prediction_head(iou_token_out)
+        
+        return masks, iou_predictions
+    
+    def _decode(
+        self,
+        image_embeddings: torch.Tensor,
+        bboxes: torch.Tensor,
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Predict the masks of the objects from the image embeddings and the prompt
+        boxes (one box per image), for all the images at once.
+
+        Args:
+            image_embeddings (torch.Tensor): Image embeddings, of shape (B, C, h, w).
+            bboxes (torch.Tensor): Prompt boxes in the input frame of the encoder, of
+                shape (B, 4).
+
+        Returns:
+            Tuple[torch.Tensor, torch.Tensor]: Low resolution mask logits in the input
+                frame of the encoder, of shape (B, 1, 4h, 4w), and predicted IoUs of
+                the masks, of shape (B, 1).
+        """
+        sparse_embeddings, dense_embeddings = self._mobile_sam.prompt_encoder(
+            points=None,
+            boxes=bboxes,
+            masks=None,
+        )
+        low_res_masks, iou_predictions = self._predict_masks(
+            image_embeddings,
+            sparse_embeddings,
+            dense_embeddings,
+        )
+        
+        # Single mask output (first mask token)
+        return low_res_masks[:, :1], iou_predictions[:, :1]
+    
+    def _roi_regions(
+        self,
+        bboxes: torch.Tensor,
+        image_size: Tuple[int, int],
+    ) -> torch.Tensor:
+        """Compute the square regions encoded around the prompt boxes.
 
         Args:
-            contours (list): List of contours. Each contour is a np.ndarray of
-            shape Nx2.
+            bboxes (torch.Tensor): Prompt boxes in the format [xmin, ymin, xmax, ymax],
+                of shape (B, 4).
+            image_size (Tuple[int, int]): Size of the images.
 
         Returns:
-            torch.Tensor: Bounding box in the format [xmin, ymin, xmax, ymax]
+            torch.Tensor: Regions in the format [xmin, ymin, xmax, ymax], of shape
+                (B, 4). They may extend beyond the images.
         """
-        try:
-            xmin, ymin = np.min(contours[0], axis=0)
-            xmax, ymax = np.max(contours[0], axis=0)
-        except IndexError:
-            return torch.Tensor([0, 0, 0, 0])
+        centers = (bboxes[:, :2] + bboxes[:, 2:]) / 2
+        sides = (bboxes[:, 2:] - bboxes[:, :2]).amax(dim=1)
+        sides = (sides * (1 + 2 * self._roi_padding)).clamp(
+            min=self._roi_min_size,
+            max=max(image_size),
+        )
         
-        for contour in contours[1:]:
+        return torch.cat([
+            centers - sides[:, None] / 2,
+            centers + sides[:, None] / 2,
+        ], dim=1)
+    
+    def _paste_masks(
+        self,
+        low_res_masks: torch.Tensor,
+        regions: torch.Tensor,
+        image_size: Tuple[int, int],
+    ) -> torch.Tensor:
+        """Paste the masks predicted in regions back in the images.
+
+        Args:
+            low_res_masks (torch.Tensor): Low resolution mask logits of the regions, of
+                shape (B, 1, h, w).
+            regions (torch.Tensor): Regions in the format [xmin, ymin, xmax, ymax], of
+                shape (B, 4).
+            image_size (Tuple[int, int]): Size (H, W) of the images.
+
+        Returns:
+            torch.Tensor: Binary masks, of shape (B, 1, H, W) (bool). Pixels outside
+                the regions are background.
+        """
+        height, width = image_size
+        device = low_res_masks.device
+        
+        x0, y0 = regions[:, 0:1], regions[:, 1:2]
+        sides = regions[:, 2:3] - regions[:, 0:1]
+        
+        # Coordinates of the centers of the pixels in the regions, in [-1, 1]
+        u = ((torch.arange(width, device=device) + 0.5) - x0) / sides * 2 - 1
+        v = ((torch.arange(height, device=device) + 0.5) - y0) / sides * 2 - 1
+        
+        grid = torch.stack([
+            u[:, None, :].expand(-1, height, -1),
+            v[:, :, None].expand(-1, -1, width),
+        ], dim=-1)
+        
+        # Logits outside the regions are 0 (background at the default threshold)
+        masks = nn.functional.grid_sample(
+            low_res_masks,
+            grid.to(low_res_masks.dtype),
+            mode="bilinear",
+            padding_mode="zeros",
+            align_corners=False,
+        )
+        
+        return masks > self._mobile_sam.mask_threshold
+    
+    def _prepare_inputs(
+        self,
+        imgs: torch.Tensor,
+        bboxes: torch.Tensor,
+    ) -> Tuple[torch.Tensor, torch.Tensor, Optional[torch.Tensor]]:
+        """Resize the images (or crop the regions around the boxes) to the input size
+        of the encoder, and express the boxes in the resized images.
+
+        Args:
+            imgs (torch.Tensor): Batch of images, of shape (B, 3, H, W).
+            bboxes (torch.Tensor): Prompt boxes in the format [xmin, ymin, xmax, ymax],
+                of shape (B, 4).
+
+        Returns:
+            Tuple[torch.Tensor, torch.Tensor, Optional[torch.Tensor]]: Resized images
+                (float), of shape (B, 3, H', W'), boxes in the resized images, of
+                shape (B, 4), and encoded regions, of shape (B, 4) (None if the whole
+                images are encoded).
+        """
+        original_size = imgs.shape[2:]
+        bboxes = bboxes.to(device=imgs.device, dtype=torch.float32)
+        
+        if self._roi_padding is None:
+            
+            # Set the resizing transformation
+            resize_transform =\
+                ResizeLongestSide(self._mobile_sam.image_encoder.img_size)
+
+            # The MobileSAM model expects float images
+            resized_imgs = resize_transform.apply_image_torch(imgs.float())
             
-            # Get the min and max values of the next contour
-            xmin_tmp, ymin_tmp = np.min(contour, axis=0)
-            xmax_tmp, ymax_tmp = np.max(contour, axis=0)
+            # Resize the bounding boxes
+            bboxes = resize_transform.apply_boxes_torch(bboxes, original_size)
             
-            # Update the bounding box   
-            xmin = min(xmin, xmin_tmp)
-            xmax = max(xmax, xmax_tmp)
-            ymin = min(ymin, ymin_tmp)
-            ymax = max(ymax, ymax_tmp)
+            return resized_imgs, bboxes, None
+        
+        input_size = self._mobile_sam.image_encoder.img_size
+        
+        # Crop the regions around the boxes and resize them to the input size of the
+        # encoder (zeros outside the images)
+        regions = self._roi_regions(bboxes, original_size)
+        resized_imgs = roi_align(
+            imgs.float(),
+            torch.cat([
+                torch.arange(len(imgs), device=imgs.device)[:, None].float(),
+                regions,
+            ], dim=1),
+            output_size=input_size,
+            spatial_scale=1.0,
+            sampling_ratio=2,
+            aligned=True,
+        )
+        
+        # Express the boxes in the resized regions
+        scales = input_size / (regions[:, 2] - regions[:, 0])
+        bboxes = (bboxes - regions[:, :2].repeat(1, 2)) * scales[:, None]
+        
+        return resized_imgs, bboxes, regions
+    
+    def _postprocess(
+        self,
+        low_res_masks: torch.Tensor,
+        input_size: Tuple[int, int],
+        original_size: Tuple[int, int],
+        regions: Optional[torch.Tensor] = None,
+    ) -> torch.Tensor:
+        """Upscale the low resolution masks to the images and binarize them.
+
+        Args:
+            low_res_masks (torch.Tensor): Low resolution mask logits, of shape
+                (B, 1, h, w).
+            input_size (Tuple[int, int]): Size of the resized images.
+            original_size (Tuple[int, int]): Size (H, W) of the images.
+            regions (Optional[torch.Tensor], optional): Encoded regions, of shape
+                (B, 4) (None if the whole images are encoded). Defaults to None.
+
+        Returns:
+            torch.Tensor: Binary masks, of shape (B, 1, H, W) (bool).
+        """
+        if regions is not None:
+            # Paste the masks back in the images
+            return self._paste_masks(low_res_masks, regions, original_size)
         
-        return torch.Tensor([xmin, ymin, xmax, ymax])
+        return self._mobile_sam.postprocess_masks(
+            low_res_masks,
+            input_size=input_size,
+            original_size=original_size,
+        ) > self._mobile_sam.mask_threshold
     
     @torch.no_grad()
     def forward(
         self,
         imgs: torch.Tensor,
-        contour_points_list: list[Tuple],
-    ) -> torch.Tensor:
+        contour_points_list: Optional[list[Tuple]] = None,
+        bboxes: Optional[torch.Tensor] = None,
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Predict the masks of the objects of a batch of images, prompted with boxes.
+        The images are encoded in a single pass and the masks decoded in another.
+
+        Args:
+            imgs (torch.Tensor): Batch of images, of shape (B, 3, H, W).
+            contour_points_list (Optional[list[Tuple]], optional): Contours of the
+                objects in each image, from which the prompt boxes are computed. Not
+                needed if `bboxes` is given. Defaults to None.
+            bboxes (Optional[torch.Tensor], optional): Prompt boxes in the format
+                [xmin, ymin, xmax, ymax], of shape (B, 4). Defaults to None.
+
+        Raises:
+            ValueError: If neither the contours nor the boxes are given.
+
+        Returns:
+            Tuple[torch.Tensor, torch.Tensor]: Binary masks of the objects, of shape
+                (B, 1, H, W) (bool), and predicted IoUs of the masks, of shape (B, 1).
+        """
+        if contour_points_list is None and bboxes is None:
+            raise ValueError("Either the contours or the boxes must be given.")
         
         # Get the first image for visualization
         img = imgs[0]
@@ -77,40 +497,26 @@ class MobileSAM(nn.Module):
         # Store the original size of the images before resizing them
         original_size = imgs.shape[2:]
         
-        # Set the resizing transformation
-        resize_transform = ResizeLongestSide(self._mobile_sam.image_encoder.img_size)
-
-        # The MobileSAM model expects float images
-        imgs = imgs.float()
-        
-        # Resize the images
-        imgs = resize_transform.apply_image_torch(imgs)
-        
         # Compute the bounding boxes
-        bboxes = torch.stack([
-            MobileSAM._get_bboxes_from_contours(contour)
-            for contour in contour_points_list
-        ]).to(device=imgs.device)
-        
-        # Resize the bounding boxes
-        bboxes = resize_transform.apply_boxes_torch(
-            bboxes,
-            original_size,
-        )
+        if bboxes is None:
+            bboxes = MobileSAM._get_bboxes_from_contours(contour_points_list)
         
-        # Prepare the (batched) input for the MobileSAM model
-        batched_input = [
-            {
-                "image": imgs[i],
-                "boxes": bboxes[i].unsqueeze(0),
-                "original_size": original_size,
-            }
-            for i in range(imgs.shape[0])
-        ]
+        # Resize the images (or crop their regions) and the boxes
+        resized_imgs, input_bboxes, regions = self._prepare_inputs(imgs, bboxes)
+        
+        # Encode the images (or get their embeddings from the cache)
+        image_embeddings = self._image_embeddings(imgs, resized_imgs, regions)
         
-        # Get the predictions from the MobileSAM model
-        batched_output = self._mobile_sam(batched_input, multimask_output=False)
+        # Get the predictions from the prompt encoder and the mask decoder
+        low_res_masks, iou_predictions = self._decode(image_embeddings, input_bboxes)
         
+        # Bring the masks back to the images
+        masks = self._postprocess(
+            low_res_masks,
+            resized_imgs.shape[2:],
+            original_size,
+            regions,
+        )
         
         ###########################################################################
         # Debugging
@@ -124,15 +530,14 @@ class MobileSAM(nn.Module):
         # img_original = cv2.cvtColor(img_original, cv2.COLOR_RGB2BGR)
         # img_to_display = cv2.cvtColor(img_to_display, cv2.COLOR_RGB2BGR)
         
-        # scores = batched_output[0]["iou_predictions"][0].cpu().numpy()
-        # # logits = batched_output[0]["low_res_logits"][0].cpu().numpy()
-        # masks = batched_output[0]["masks"][0].cpu().numpy()
+        # scores = iou_predictions[0].cpu().numpy()
+        # masks = masks[0].cpu().numpy()
 
         
         # print("Scores:", scores)
         # # print("Logits:", logits.shape)
         
-        # bbox = MobileSAM._get_bboxes_from_contours(contour_points_list[0])
+        # bbox = MobileSAM._get_bboxes_from_contours(contour_points_list[:1])[0]
         
         # # Convert to int
         # bbox = bbox.int().cpu().numpy()
@@ -158,7 +563,7 @@ class MobileSAM(nn.Module):
         # cv2.waitKey(0)
         ###########################################################################
         
-        return batched_output
+        return masks, iou_predictions
 
 
 if __name__ == "__main__":
@@ -41,6 +41,10 @@ class ObjectSegmentationPredictionModel(nn.Module):
         self,
         probabilistic_segmentation_model: nn.Module,
         compile: bool = False,
+        sam_checkpoint: str = "../weights/mobile_sam.ckpt",
+        sam_embedding_cache_size: int = 0,
+        sam_embedding_cache_dir: Optional[str] = None,
+        sam_roi_padding: Optional[float] = None,
     ) -> None:
         """Constructor of the ObjectSegmentationPredictionModel.
 
@@ -49,14 +53,27 @@ class ObjectSegmentationPredictionModel(nn.Module):
                 probabilistic segmentations.
             compile (bool, optional): Whether to compile parts of the model.
                 Defaults to False.
+            sam_checkpoint (str, optional): Pre-trained MobileSAM parameters. Defaults
+                to "../weights/mobile_sam.ckpt".
+            sam_embedding_cache_size (int, optional): Number of MobileSAM image
+                embeddings kept in memory, so that MobileSAM prompted again on an
+                image does not encode it again (0 to disable). Defaults to 0.
+            sam_embedding_cache_dir (Optional[str], optional): Directory in which the
+                MobileSAM image embeddings are also saved. Defaults to None.
+            sam_roi_padding (Optional[float], optional): If given, MobileSAM only
+                encodes a region around each prompt box, enlarged by this fraction on
+                each side (see `MobileSAM`). Defaults to None.
         """
         super().__init__()
         
         # Instantiate the MobileSAM module
         # (for explicit object segmentation alignment)
         self._mobile_sam = MobileSAM(
-            sam_checkpoint="../weights/mobile_sam.ckpt",
+            sam_checkpoint=sam_checkpoint,
             compile=compile,
+            embedding_cache_size=sam_embedding_cache_size,
+            embedding_cache_dir=sam_embedding_cache_dir,
+            roi_padding=sam_roi_padding,
         )
         self._binary_masks = None
         
@@ -101,14 +118,11 @@ class ObjectSegmentationPredictionModel(nn.Module):
             return probabilistic_masks
         
         else:
-            # Predict masks, scores and logits using the MobileSAM model
-            mobile_sam_outputs = self._mobile_sam(x.rgbs, x.contour_points_list)
-
-            # Stack the masks from the MobileSAM outputs
-            self._binary_masks = torch.stack([
-                output["masks"][:, torch.argmax(output["iou_predictions"])]
-                for output in mobile_sam_outputs
-            ])
+            # Predict the masks of the batch using the MobileSAM model
+            self._binary_masks, _ = self._mobile_sam(
+                x.rgbs,
+                x.contour_points_list,
+            )
             
             # Compute the probabilistic segmentation masks
             probabilistic_masks = self._probabilistic_segmentation_model(
@@ -128,6 +142,9 @@ class ObjectSegmentationPredictionModule(nn.Module):
         self,
         probabilistic_segmentation_model: nn.Module,
         compile: bool = False,
+        sam_embedding_cache_size: int = 0,
+        sam_embedding_cache_dir: Optional[str] = None,
+        sam_roi_padding: Optional[float] = None,
     ) -> None:
         """
         Constructor of the ObjectSegmentationPredictionModule.
@@ -137,12 +154,22 @@ class ObjectSegmentationPredictionModule(nn.Module):
                 probabilistic segmentations.
             compile (bool, optional): Whether to compile parts of the model.
                 Defaults to False.
+            sam_embedding_cache_size (int, optional): Number of MobileSAM image
+                embeddings kept in memory (0 to disable). Defaults to 0.
+            sam_embedding_cache_dir (Optional[str], optional): Directory in which the
+                MobileSAM image embeddings are also saved. Defaults to None.
+            sam_roi_padding (Optional[float], optional): If given, MobileSAM only
+                encodes a region around each prompt box, enlarged by this fraction on
+                each side (see `MobileSAM`). Defaults to None.
         """
         super().__init__()
         
         self._model = ObjectSegmentationPredictionModel(
             probabilistic_segmentation_model=probabilistic_segmentation_model,
             compile=compile,
+            sam_embedding_cache_size=sam_embedding_cache_size,
+            sam_embedding_cache_dir=sam_embedding_cache_dir,
+            sam_roi_padding=sam_roi_padding,
         )
     
     @property
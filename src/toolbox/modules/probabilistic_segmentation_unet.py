@@ -1,6 +1,6 @@
 # Standard libraries
 from functools import partial
-from typing import Union, List
+from typing import Union, List, Optional
 
 # Third-party libraries
 import torch
@@ -67,29 +67,32 @@ class ProbabilisticSegmentationUNet(nn.Module):
         else:
             self._color_transform = lambda x: x
 
-    def forward(
+    @property
+    def context_vectors(self) -> Optional[torch.Tensor]:
+        """Getter for the context vectors of the last reference frames.
+
+        Returns:
+            Optional[torch.Tensor]: Context vectors (B, D), or None if they have not
+                been computed yet.
+        """
+        return self._context_vectors
+    
+    def _predict_context_vectors(
         self,
         rgb_images: torch.Tensor,
         binary_masks: torch.Tensor,
-        clines_rgbs: torch.Tensor,
     ) -> torch.Tensor:
-        """Forward pass through the module.
+        """Predict the context vectors from the RGB images and binary masks.
 
         Args:
             rgb_images (torch.Tensor): Batch of RGB images (B, C, H, W). Values should
                 be in the range [0, 255] and of type torch.uint8.
-            binary_masks (torch.Tensor): Batch of binary masks (B, H, W). Values should
-                be either 0 or 1 and of type torch.float32.
-            clines_rgbs (torch.Tensor): Batch of RGB contour lines (B, C, N, L). Values
-                should be in the range [0, 255] and of type torch.uint8.
+            binary_masks (torch.Tensor): Batch of binary masks (B, 1, H, W). Values
+                should be either 0 or 1 and of type torch.float32.
 
         Returns:
-            torch.Tensor: Batch of probabilistic segmentation maps (B, N, L). Values are
-                of type torch.float32.
+            torch.Tensor: Batch of context vectors (B, D).
         """
-        #-----------------------------------------------------------------#
-        # Context vectors prediction from the RGB images and binary masks #
-        #-----------------------------------------------------------------#
         # Convert [0, 255] -> [0.0, 1.0]
         rgb_images = rgb_images.to(dtype=torch.float32)
         rgb_images /= 255.0
@@ -101,12 +104,26 @@ class ProbabilisticSegmentationUNet(nn.Module):
         input_implicit_segmentation = torch.cat([rgb_images, binary_masks], dim=1)
 
         # Predict as many context vectors as the number of images in the batch
-        self._context_vectors = self._net(input_implicit_segmentation)
-        
-        
-        #-----------------------------------------------------------------#
-        # Probabilistic segmentation of the contour lines                 #
-        #-----------------------------------------------------------------#
+        return self._net(input_implicit_segmentation)
+    
+    def _segment_lines(
+        self,
+        clines_rgbs: torch.Tensor,
+        context_vectors: Optional[torch.Tensor] = None,
+    ) -> torch.Tensor:
+        """Predict the probabilistic segmentation of correspondence lines.
+
+        Args:
+            clines_rgbs (torch.Tensor): Batch of RGB contour lines (B, C, N, L). Values
+                should be in the range [0, 255] and of type torch.uint8.
+            context_vectors (Optional[torch.Tensor], optional): Context vectors (B, D).
+                If None, the FiLM parameters precomputed by `compute_context` are used.
+                Defaults to None.
+
+        Returns:
+            torch.Tensor: Batch of probabilistic segmentation maps (B, N, L). Values are
+                of type torch.float32.
+        """
         # Apply color transformations to the RGB lines
         clines_rgbs = self._color_transform(clines_rgbs)
         
@@ -117,6 +134,7 @@ class ProbabilisticSegmentationUNet(nn.Module):
         # Normalize the RGB correspondence lines
         clines_rgbs = self._normalize_transform(clines_rgbs)
         
+        nb_images = clines_rgbs.size(0)
         nb_lines_per_image = clines_rgbs.size(2)
         
         # Concatenate the lines from all the images to simultaneously predict the
@@ -136,17 +154,113 @@ class ProbabilisticSegmentationUNet(nn.Module):
         # Compute the probabilistic mask for the lines
         clines_probabilistic_masks = self._lines_segmentation_model(
             clines_rgbs,
-            self._context_vectors,
+            context_vectors,
         ).squeeze(1)
         
         # Recover the original shape of the probabilistic masks
         clines_probabilistic_masks = clines_probabilistic_masks.view(
-            rgb_images.size(0),
+            nb_images,
             nb_lines_per_image,
             clines_probabilistic_masks.size(1),
         )
         
         return clines_probabilistic_masks
+    
+    def compute_context(
+        self,
+        rgb_images: torch.Tensor,
+        binary_masks: torch.Tensor,
+    ) -> torch.Tensor:
+        """Compute the context vectors of reference frames and cache them, along with
+        the FiLM scale and shift factors of the line segmentation model, so that the
+        lines of the following frames can be segmented with `segment_lines` without
+        running the image network again.
+
+        Args:
+            rgb_images (torch.Tensor): Batch of reference RGB images (B, C, H, W).
+                Values should be in the range [0, 255] and of type torch.uint8.
+            binary_masks (torch.Tensor): Batch of binary masks (B, 1, H, W). Values
+                should be either 0 or 1 and of type torch.float32.
+
+        Returns:
+            torch.Tensor: Batch of context vectors (B, D).
+        """
+        self._context_vectors = self._predict_context_vectors(
+            rgb_images,
+            binary_masks,
+        )
+        
+        # Precompute the FiLM parameters for the fixed context
+        self._lines_segmentation_model.set_context(self._context_vectors)
+        
+        return self._context_vectors
+    
+    def segment_lines(self, clines_rgbs: torch.Tensor) -> torch.Tensor:
+        """Predict the probabilistic segmentation of correspondence lines with the
+        context cached by `compute_context`. The number of lines may change from one
+        call to another.
+
+        Args:
+            clines_rgbs (torch.Tensor): Batch of RGB contour lines (B, C, N, L), B being
+                the number of reference frames given to `compute_context`. Values
+                should be in the range [0, 255] and of type torch.uint8.
+
+        Raises:
+            ValueError: If no context has been computed, or if the number of images
+                does not match the number of context vectors.
+
+        Returns:
+            torch.Tensor: Batch of probabilistic segmentation maps (B, N, L). Values are
+                of type torch.float32.
+        """
+        if not self._lines_segmentation_model.has_context:
+            raise ValueError(
+                "The context has not been computed. "
+                "Please run the compute_context method first."
+            )
+        elif clines_rgbs.size(0) != self._context_vectors.size(0):
+            raise ValueError(
+                f"Expected lines from {self._context_vectors.size(0)} images but got "
+                f"lines from {clines_rgbs.size(0)} images."
+            )
+        
+        return self._segment_lines(clines_rgbs)
+    
+    def forward(
+        self,
+        rgb_images: torch.Tensor,
+        binary_masks: torch.Tensor,
+        clines_rgbs: torch.Tensor,
+    ) -> torch.Tensor:
+        """Forward pass through the module.
+
+        Args:
+            rgb_images (torch.Tensor): Batch of RGB images (B, C, H, W). Values should
+                be in the range [0, 255] and of type torch.uint8.
+            binary_masks (torch.Tensor): Batch of binary masks (B, H, W). Values should
+                be either 0 or 1 and of type torch.float32.
+            clines_rgbs (torch.Tensor): Batch of RGB contour lines (B, C, N, L). Values
+                should be in the range [0, 255] and of type torch.uint8.
+
+        Returns:
+            torch.Tensor: Batch of probabilistic segmentation maps (B, N, L). Values are
+                of type torch.float32.
+        """
+        # The context of a previous call to compute_context is no longer valid
+        self._lines_segmentation_model.clear_context()
+        
+        #-----------------------------------------------------------------#
+        # Context vectors prediction from the RGB images and binary masks #
+        #-----------------------------------------------------------------#
+        self._context_vectors = self._predict_context_vectors(
+            rgb_images,
+            binary_masks,
+        )
+        
+        #-----------------------------------------------------------------#
+        # Probabilistic segmentation of the contour lines                 #
+        #-----------------------------------------------------------------#
+        return self._segment_lines(clines_rgbs, self._context_vectors)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,241 @@
+"""
+Rendering of the region of interest (ROI) of objects only. The bounding box of each mesh
+is projected in the image to find the region covered by the object, the camera
+intrinsics are adjusted so that only this region is rasterized (optionally at a reduced
+resolution), and the rendered masks are pasted back into full-size masks. The cost of
+the rasterization then scales with the size of the objects rather than with the size of
+the frames.
+"""
+# Standard libraries
+from typing import Tuple
+
+# Third-party libraries
+import torch
+import torch.nn.functional as F
+from pytorch3d.renderer import MeshRasterizer, RasterizationSettings
+from pytorch3d.structures import Meshes
+from pytorch3d.utils import cameras_from_opencv_projection
+
+
+def project_mesh_bounds(
+    meshes: Meshes,
+    K: torch.Tensor,
+    TCO: torch.Tensor,
+    image_size: Tuple[int, int],
+) -> torch.Tensor:
+    """Project the bounding boxes of meshes in images.
+
+    Args:
+        meshes (Meshes): Meshes of the batch (one per image).
+        K (torch.Tensor): Intrinsics matrices, of shape (B, 3, 3).
+        TCO (torch.Tensor): Poses of the objects in the camera frames, of shape
+            (B, 4, 4).
+        image_size (Tuple[int, int]): Size (height, width) of the images.
+
+    Returns:
+        torch.Tensor: Projected bounds [xmin, ymin, xmax, ymax] (pixels), of shape
+            (B, 4). Objects partially behind the camera cover the whole image.
+    """
+    height, width = image_size
+
+    # Corners of the axis-aligned bounding boxes in the object frames, (B, 8, 3)
+    bounds = meshes.get_bounding_boxes().to(TCO.dtype)
+    corners = torch.stack([
+        torch.stack([bounds[:, 0, i], bounds[:, 1, j], bounds[:, 2, k]], dim=1)
+        for i in range(2) for j in range(2) for k in range(2)
+    ], dim=1)
+
+    # Project the corners
+    corners_camera = corners @ TCO[:, :3, :3].transpose(1, 2) +\
+        TCO[:, :3, 3].unsqueeze(1)
+    z = corners_camera[..., 2]
+    uv = corners_camera @ K.transpose(1, 2)
+    uv = uv[..., :2] / z.clamp(min=1e-12).unsqueeze(-1)
+
+    projected_bounds = torch.cat([uv.min(dim=1).values, uv.max(dim=1).values], dim=1)
+
+    # The projection of objects crossing the camera plane is unbounded
+    full_image = torch.tensor(
+        [0, 0, width, height],
+        dtype=projected_bounds.dtype,
+        device=projected_bounds.device,
+    )
+    behind = (z <= 0).any(dim=1)
+    projected_bounds[behind] = full_image
+
+    return projected_bounds
+
+
+def compute_rois(
+    projected_bounds: torch.Tensor,
+    image_size: Tuple[int, int],
+    margin: int = 0,
+) -> Tuple[torch.Tensor, Tuple[int, int]]:
+    """Compute the regions of interest of a batch. All the ROIs have the same size (the
+    size of the largest one) so that they can be rasterized together.
+
+    Args:
+        projected_bounds (torch.Tensor): Projected bounds of the objects
+            [xmin, ymin, xmax, ymax], of shape (B, 4).
+        image_size (Tuple[int, int]): Size (height, width) of the images.
+        margin (int, optional): Margin added around the projected bounds (pixels).
+            Defaults to 0.
+
+    Returns:
+        Tuple[torch.Tensor, Tuple[int, int]]: Top-left corners (x0, y0) of the ROIs, of
+            shape (B, 2) (long), and size (height, width) of the ROIs.
+    """
+    height, width = image_size
+
+    # Pixels whose center may be covered by the objects
+    x_min = torch.floor(projected_bounds[:, 0] - margin).clamp(0, width - 1)
+    y_min = torch.floor(projected_bounds[:, 1] - margin).clamp(0, height - 1)
+    x_max = torch.ceil(projected_bounds[:, 2] + margin).clamp(1, width)
+    y_max = torch.ceil(projected_bounds[:, 3] + margin).clamp(1, height)
+
+    # Common size of the ROIs
+    roi_width = int((x_max - x_min).clamp(min=1).max())
+    roi_height = int((y_max - y_min).clamp(min=1).max())
+
+    # Center the ROIs on the objects and keep them inside the images
+    x0 = torch.round((x_min + x_max - roi_width) / 2).clamp(0, width - roi_width)
+    y0 = torch.round((y_min + y_max - roi_height) / 2).clamp(0, height - roi_height)
+
+    return torch.stack([x0, y0], dim=1).long(), (roi_height, roi_width)
+
+
+def roi_intrinsics(
+    K: torch.Tensor,
+    corners: torch.Tensor,
+    scale: Tuple[float, float],
+) -> torch.Tensor:
+    """Adjust intrinsics matrices to render regions of interest.
+
+    Args:
+        K (torch.Tensor): Intrinsics matrices of the full images, of shape (B, 3, 3).
+        corners (torch.Tensor): Top-left corners (x0, y0) of the ROIs, of shape (B, 2).
+        scale (Tuple[float, float]): Scale factors (sx, sy) between the rendering
+            resolution and the resolution of the images.
+
+    Returns:
+        torch.Tensor: Intrinsics matrices of the ROIs, of shape (B, 3, 3).
+    """
+    sx, sy = scale
+
+    K_roi = K.clone()
+    K_roi[:, 0, 2] -= corners[:, 0].to(K.dtype)
+    K_roi[:, 1, 2] -= corners[:, 1].to(K.dtype)
+    K_roi[:, 0] *= sx
+    K_roi[:, 1] *= sy
+
+    return K_roi
+
+
+def paste_rois(
+    roi_masks: torch.Tensor,
+    corners: torch.Tensor,
+    image_size: Tuple[int, int],
+) -> torch.Tensor:
+    """Paste masks of regions of interest into full-size masks.
+
+    Args:
+        roi_masks (torch.Tensor): Masks of the ROIs, of shape (B, h, w).
+        corners (torch.Tensor): Top-left corners (x0, y0) of the ROIs, of shape (B, 2).
+        image_size (Tuple[int, int]): Size (height, width) of the full masks.
+
+    Returns:
+        torch.Tensor: Full-size masks, of shape (B, H, W).
+    """
+    bsz, roi_height, roi_width = roi_masks.shape
+    device = roi_masks.device
+
+    masks = torch.zeros(
+        (bsz, *image_size),
+        dtype=roi_masks.dtype,
+        device=device,
+    )
+
+    rows = corners[:, 1:2] + torch.arange(roi_height, device=device)
+    cols = corners[:, 0:1] + torch.arange(roi_width, device=device)
+    batch_idx = torch.arange(bsz, device=device)
+
+    masks[
+        batch_idx[:, None, None],
+        rows[:, :, None],
+        cols[:, None, :],
+    ] = roi_masks
+
+    return masks
+
+
+def render_roi_masks(
+    rasterizer: MeshRasterizer,
+    meshes: Meshes,
+    K: torch.Tensor,
+    TCO: torch.Tensor,
+    image_size: Tuple[int, int],
+    margin: int = 8,
+    resolution_scale: float = 1.0,
+) -> torch.Tensor:
+    """Render the silhouettes of meshes by rasterizing their regions of interest only.
+
+    Args:
+        rasterizer (MeshRasterizer): Rasterizer (its settings other than the image size
+            are used).
+        meshes (Meshes): Meshes of the batch (one per image).
+        K (torch.Tensor): Intrinsics matrices, of shape (B, 3, 3).
+        TCO (torch.Tensor): Poses of the objects in the camera frames, of shape
+            (B, 4, 4).
+        image_size (Tuple[int, int]): Size (height, width) of the masks.
+        margin (int, optional): Margin added around the projected bounds of the meshes
+            (pixels). Defaults to 8.
+        resolution_scale (float, optional): Resolution at which the ROIs are rendered,
+            relative to the resolution of the images. With 1.0, the masks are the same
+            as when rendering the full images. Defaults to 1.0.
+
+    Returns:
+        torch.Tensor: Binary masks, of shape (B, H, W) (bool).
+    """
+    projected_bounds = project_mesh_bounds(meshes, K, TCO, image_size)
+    corners, (roi_height, roi_width) = compute_rois(
+        projected_bounds,
+        image_size,
+        margin=margin,
+    )
+
+    # Rendering resolution of the ROIs
+    render_height = max(1, round(roi_height * resolution_scale))
+    render_width = max(1, round(roi_width * resolution_scale))
+    scale = (render_width / roi_width, render_height / roi_height)
+
+    cameras = cameras_from_opencv_projection(
+        R=TCO[:, :3, :3],
+        tvec=TCO[:, :3, 3],
+        camera_matrix=roi_intrinsics(K, corners, scale),
+        image_size=torch.Tensor([render_height, render_width]).unsqueeze(0),
+    ).to(device=TCO.device)
+
+    settings = rasterizer.raster_settings
+    raster_settings = RasterizationSettings(
+        image_size=(render_height, render_width),
+        blur_radius=settings.blur_radius,
+        faces_per_pixel=settings.faces_per_pixel,
+        bin_size=settings.bin_size,
+        max_faces_per_bin=settings.max_faces_per_bin,
+    )
+
+    roi_masks = rasterizer(
+        meshes,
+        cameras=cameras,
+        raster_settings=raster_settings,
+    ).pix_to_face[..., 0] >= 0
+
+    # Back to the resolution of the images
+    if (render_height, render_width) != (roi_height, roi_width):
+        roi_masks = F.interpolate(
+            roi_masks.unsqueeze(1).float(),
+            size=(roi_height, roi_width),
+            mode="nearest",
+        ).squeeze(1).bool()
+
+    return paste_rois(roi_masks, corners, image_size)
@@ -0,0 +1,157 @@
+"""
+Rendering of several objects per frame with a single rasterizer call. The meshes of the
+objects sharing a frame are expressed in the camera frame and joined into one scene
+mesh, all the scenes of a batch are rasterized together, and the rasterized faces are
+mapped back to the objects they belong to, giving an instance-id map per frame from
+which the mask of each object is split out.
+"""
+# Standard libraries
+from typing import Tuple
+
+# Third-party libraries
+import torch
+from pytorch3d.renderer import MeshRasterizer
+from pytorch3d.structures import Meshes
+from pytorch3d.utils import cameras_from_opencv_projection
+
+
+def join_frame_scenes(
+    meshes: Meshes,
+    TCO: torch.Tensor,
+    frame_ids: torch.Tensor,
+) -> Tuple[Meshes, torch.Tensor, torch.Tensor]:
+    """Join the meshes of the objects sharing a frame into scene meshes expressed in
+    the camera frames.
+
+    Args:
+        meshes (Meshes): Meshes of the objects (one per object).
+        TCO (torch.Tensor): Poses of the objects in the camera frames, of shape
+            (B, 4, 4).
+        frame_ids (torch.Tensor): Identifier of the frame of each object, of shape
+            (B,). Objects having the same identifier are rendered in the same frame.
+
+    Returns:
+        Tuple[Meshes, torch.Tensor, torch.Tensor]: Scene meshes (one per frame, in
+            the order of the sorted frame identifiers), index of the object each face
+            of the packed scene meshes belongs to (long), and index of the frame of
+            each object, of shape (B,) (long).
+    """
+    device = TCO.device
+    _, frames_idx = torch.unique(frame_ids, return_inverse=True)
+    frames_idx = frames_idx.to(device)
+
+    # Express the vertices of all the objects in the camera frames at once
+    verts = meshes.verts_packed().to(TCO.dtype)
+    verts_objects_idx = meshes.verts_packed_to_mesh_idx()
+    verts_camera = torch.einsum(
+        "vij,vj->vi",
+        TCO[verts_objects_idx, :3, :3],
+        verts,
+    ) + TCO[verts_objects_idx, :3, 3]
+
+    verts_list = verts_camera.split(meshes.num_verts_per_mesh().tolist())
+    faces_list = meshes.faces_list()
+
+    scene_verts_list = []
+    scene_faces_list = []
+    faces_objects_idx_list = []
+
+    for frame_idx in range(int(frames_idx.max()) + 1):
+
+        verts_offset = 0
+        frame_verts = []
+        frame_faces = []
+
+        for object_idx in torch.nonzero(frames_idx == frame_idx)[:, 0].tolist():
+            frame_verts.append(verts_list[object_idx])
+            frame_faces.append(faces_list[object_idx] + verts_offset)
+            faces_objects_idx_list.append(torch.full(
+                (len(faces_list[object_idx]),),
+                object_idx,
+                dtype=torch.long,
+                device=device,
+            ))
+            verts_offset += len(verts_list[object_idx])
+
+        scene_verts_list.append(torch.cat(frame_verts))
+        scene_faces_list.append(torch.cat(frame_faces))
+
+    scenes = Meshes(verts=scene_verts_list, faces=scene_faces_list)
+
+    return scenes, torch.cat(faces_objects_idx_list), frames_idx
+
+
+def render_instance_maps(
+    rasterizer: MeshRasterizer,
+    meshes: Meshes,
+    K: torch.Tensor,
+    TCO: torch.Tensor,
+    frame_ids: torch.Tensor,
+    image_size: Tuple[int, int],
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """Render the instance-id maps of frames containing several objects, with a single
+    rasterizer call.
+
+    Args:
+        rasterizer (MeshRasterizer): Rasterizer.
+        meshes (Meshes): Meshes of the objects (one per object).
+        K (torch.Tensor): Intrinsics matrices, of shape (B, 3, 3). Objects sharing a
+            frame share its intrinsics (those of the first object are used).
+        TCO (torch.Tensor): Poses of the objects in the camera frames, of shape
+            (B, 4, 4).
+        frame_ids (torch.Tensor): Identifier of the frame of each object, of shape
+            (B,).
+        image_size (Tuple[int, int]): Size (height, width) of the frames.
+
+    Returns:
+        Tuple[torch.Tensor, torch.Tensor]: Index of the object visible at each pixel
+            of each frame (-1 for the background), of shape (F, H, W) (long), and
+            index of the frame of each object, of shape (B,) (long).
+    """
+    scenes, faces_objects_idx, frames_idx = join_frame_scenes(meshes, TCO, frame_ids)
+    nb_frames = len(scenes)
+
+    # Intrinsics of each frame (those of its first object)
+    first_objects_idx = torch.stack([
+        torch.nonzero(frames_idx == frame_idx)[0, 0]
+        for frame_idx in range(nb_frames)
+    ])
+
+    # The scenes are already expressed in the camera frames
+    cameras = cameras_from_opencv_projection(
+        R=torch.eye(3, dtype=TCO.dtype, device=TCO.device).expand(nb_frames, 3, 3),
+        tvec=torch.zeros((nb_frames, 3), dtype=TCO.dtype, device=TCO.device),
+        camera_matrix=K[first_objects_idx],
+        image_size=torch.Tensor(image_size).unsqueeze(0),
+    ).to(device=TCO.device)
+
+    # Rasterize the scenes (pixels not covered by any face have a -1 index)
+    pix_to_face = rasterizer(scenes, cameras=cameras).pix_to_face[..., 0]
+
+    instance_ids = torch.where(
+        pix_to_face >= 0,
+        faces_objects_idx[pix_to_face.clamp(min=0)],
+        torch.full_like(pix_to_face, -1),
+    )
+
+    return instance_ids.long(), frames_idx
+
+
+def instance_maps_to_masks(
+    instance_ids: torch.Tensor,
+    frames_idx: torch.Tensor,
+) -> torch.Tensor:
+    """Split instance-id maps into the masks of the objects. The masks only cover the
+    visible parts of the objects (parts occluded by other objects of the same frame are
+    excluded).
+
+    Args:
+        instance_ids (torch.Tensor): Instance-id maps, of shape (F, H, W).
+        frames_idx (torch.Tensor): Index of the frame of each object, of shape (B,).
+
+    Returns:
+        torch.Tensor: Binary masks of the objects, of shape (B, H, W) (bool).
+    """
+    objects_idx = torch.arange(len(frames_idx), device=instance_ids.device)
+
+    return instance_ids[frames_idx] == objects_idx[:, None, None]
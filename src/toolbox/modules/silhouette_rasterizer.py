@@ -0,0 +1,208 @@
+"""
+Lightweight rasterizer producing only binary silhouettes. Contrary to pytorch3d's
+MeshRasterizer, it computes neither z-buffers nor barycentric coordinates, which makes
+it much faster on CPU. Triangles are rasterized with a vectorized scanline algorithm: the
+span covered by each triangle on each pixel row is computed at once for all the
+triangles of the batch, and the spans are filled with a cumulative sum.
+"""
+# Standard libraries
+from typing import Dict, Tuple
+
+# Third-party libraries
+import torch
+import torch.nn as nn
+from pytorch3d.structures import Meshes
+
+
+class SilhouetteRasterizer(nn.Module):
+    """
+    Render binary silhouettes of meshes from OpenCV cameras (intrinsics K and poses
+    TCO). It follows the pixel conventions of pytorch3d's rasterizer used with
+    `cameras_from_opencv_projection` (pixel (i, j) is covered if its center
+    (j + 0.5, i + 0.5) lies inside a projected triangle), so that both produce the same
+    masks up to pixels whose center lies exactly on the edge of a triangle.
+    """
+    def __init__(self, image_size: Tuple[int, int], z_near: float = 1e-6) -> None:
+        """Constructor.
+
+        Args:
+            image_size (Tuple[int, int]): Size (height, width) of the silhouettes.
+            z_near (float, optional): Triangles having a vertex closer to the camera
+                plane than this depth are discarded. Defaults to 1e-6.
+        """
+        super().__init__()
+
+        self._image_size = image_size
+        self._z_near = z_near
+
+    @staticmethod
+    def _project(
+        verts: torch.Tensor,
+        K: torch.Tensor,
+        TCO: torch.Tensor,
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Project vertices expressed in the object frame onto the image plane.
+
+        Args:
+            verts (torch.Tensor): Vertices in the object frame, of shape (V, 3).
+            K (torch.Tensor): Intrinsics matrix, of shape (3, 3).
+            TCO (torch.Tensor): Pose of the object in the camera frame, of shape (4, 4).
+
+        Returns:
+            Tuple[torch.Tensor, torch.Tensor]: Pixel coordinates (V, 2) and depths (V,).
+        """
+        verts_camera = verts @ TCO[:3, :3].T + TCO[:3, 3]
+        z = verts_camera[:, 2]
+
+        uv = verts_camera @ K.T
+        uv = uv[:, :2] / z.clamp(min=1e-12).unsqueeze(1)
+
+        return uv, z
+
+    def _triangles(
+        self,
+        meshes: Meshes,
+        K: torch.Tensor,
+        TCO: torch.Tensor,
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Project the triangles of the meshes of a batch.
+
+        Args:
+            meshes (Meshes): Meshes of the batch (one per image).
+            K (torch.Tensor): Intrinsics matrices, of shape (B, 3, 3).
+            TCO (torch.Tensor): Poses of the objects in the camera frames, of shape
+                (B, 4, 4).
+
+        Returns:
+            Tuple[torch.Tensor, torch.Tensor]: Projected triangles (T, 3, 2) and index
+                of the image of each triangle (T,).
+        """
+        triangles_list = []
+        images_idx_list = []
+
+        for b, (verts, faces) in enumerate(
+            zip(meshes.verts_list(), meshes.faces_list())
+        ):
+            uv, z = SilhouetteRasterizer._project(
+                verts.to(TCO.dtype),
+                K[b],
+                TCO[b],
+            )
+
+            # Discard the triangles (partially) behind the camera
+            valid = (z[faces] > self._z_near).all(dim=1)
+            faces = faces[valid]
+
+            triangles_list.append(uv[faces])
+            images_idx_list.append(
+                torch.full((len(faces),), b, dtype=torch.long, device=uv.device)
+            )
+
+        return torch.cat(triangles_list), torch.cat(images_idx_list)
+
+    @torch.no_grad()
+    def forward(
+        self,
+        meshes: Meshes,
+        K: torch.Tensor,
+        TCO: torch.Tensor,
+    ) -> torch.Tensor:
+        """Render the silhouettes of a batch of meshes.
+
+        Args:
+            meshes (Meshes): Meshes of the batch (one per image).
+            K (torch.Tensor): Intrinsics matrices, of shape (B, 3, 3).
+            TCO (torch.Tensor): Poses of the objects in the camera frames, of shape
+                (B, 4, 4).
+
+        Returns:
+            torch.Tensor: Binary silhouettes, of shape (B, H, W) (bool).
+        """
+        height, width = self._image_size
+        bsz = len(meshes)
+        device = TCO.device
+
+        triangles, images_idx = self._triangles(meshes, K, TCO)
+
+        # Pixel rows whose center (y = row + 0.5) is covered by each triangle
+        y = triangles[..., 1]
+        row_min = torch.ceil(y.min(dim=1).values - 0.5).long().clamp(min=0)
+        row_max = torch.floor(y.max(dim=1).values - 0.5).long().clamp(max=height - 1)
+        nb_rows = (row_max - row_min + 1).clamp(min=0)
+
+        # One element per (triangle, row) pair
+        triangles_idx = torch.repeat_interleave(
+            torch.arange(len(triangles), device=device),
+            nb_rows,
+        )
+        offsets = torch.arange(len(triangles_idx), device=device) -\
+            torch.repeat_interleave(torch.cumsum(nb_rows, dim=0) - nb_rows, nb_rows)
+        rows = row_min[triangles_idx] + offsets
+        y_rows = rows.to(triangles.dtype) + 0.5
+
+        # Intersections of the rows with the 3 edges of the triangles
+        spans_triangles = triangles[triangles_idx]
+        a = spans_triangles
+        b = spans_triangles.roll(shifts=-1, dims=1)
+        ya, yb = a[..., 1], b[..., 1]
+        xa, xb = a[..., 0], b[..., 0]
+        y_rows = y_rows.unsqueeze(1)
+
+        crosses = ((ya - y_rows) * (yb - y_rows) <= 0) & (ya != yb)
+        t = (y_rows - ya) / torch.where(ya != yb, yb - ya, torch.ones_like(ya))
+        x = xa + t * (xb - xa)
+
+        x_left = torch.where(crosses, x, torch.full_like(x, float("inf")))
+        x_right = torch.where(crosses, x, torch.full_like(x, float("-inf")))
+        x_left = x_left.min(dim=1).values
+        x_right = x_right.max(dim=1).values
+
+        # Pixel columns whose center (x = col + 0.5) lies in the span
+        col_min = torch.ceil(x_left - 0.5).clamp(min=0, max=width)
+        col_max = torch.floor(x_right - 0.5).clamp(min=-1, max=width - 1)
+        valid = col_min <= col_max
+
+        col_min = col_min[valid].long()
+        col_max = col_max[valid].long()
+        flat_rows = images_idx[triangles_idx[valid]] * height + rows[valid]
+
+        # Fill the spans: +1 at the start of a span, -1 after its end
+        coverage = torch.zeros(
+            (bsz * height, width + 1),
+            dtype=torch.int32,
+            device=device,
+        )
+        ones = torch.ones(len(flat_rows), dtype=torch.int32, device=device)
+        coverage.index_put_((flat_rows, col_min), ones, accumulate=True)
+        coverage.index_put_((flat_rows, col_max + 1), -ones, accumulate=True)
+
+        silhouettes = torch.cumsum(coverage, dim=1)[:, :width] > 0
+
+        return silhouettes.view(bsz, height, width)
+
+
+def silhouettes_mismatch(
+    masks: torch.Tensor,
+    reference_masks: torch.Tensor,
+) -> Dict[str, float]:
+    """Compare binary masks pixel-for-pixel with reference masks (e.g. the silhouettes
+    rendered by pytorch3d).
+
+    Args:
+        masks (torch.Tensor): Masks to compare, of shape (B, H, W).
+        reference_masks (torch.Tensor): Reference masks, of shape (B, H, W).
+
+    Returns:
+        Dict[str, float]: Number and fraction of mismatched pixels, and fraction of
+            mismatched pixels in the worst image.
+    """
+    mismatch = masks.bool() != reference_masks.bool()
+    nb_pixels_per_image = mismatch[0].numel()
+
+    return {
+        "nb_mismatched_pixels": float(mismatch.sum()),
+        "mismatch_rate": float(mismatch.float().mean()),
+        "max_image_mismatch_rate": float(
+            mismatch.flatten(1).sum(dim=1).max() / nb_pixels_per_image
+        ),
+    }
@@ -108,7 +108,41 @@ class FiLM(nn.Module):
         self._beta_fc.weight.data.fill_(0)
         self._beta_fc.bias.data.fill_(0)
         
-    def forward(self, x: torch.Tensor, context: torch.Tensor) -> torch.Tensor:
+        # Scale and shift factors precomputed for a fixed context
+        self._gamma = None
+        self._beta = None
+    
+    @property
+    def has_context(self) -> bool:
+        """Whether scale and shift factors have been precomputed.
+
+        Returns:
+            bool: True if `set_context` has been called (and not cleared).
+        """
+        return self._gamma is not None
+    
+    def set_context(self, context: torch.Tensor) -> None:
+        """Precompute the scale and shift factors of a fixed context, used by the
+        forward pass when no context vector is given.
+
+        Args:
+            context (torch.Tensor): Context vector. [B, D].
+        """
+        self._gamma = self._gamma_fc(context)
+        self._beta = self._beta_fc(context)
+    
+    def clear_context(self) -> None:
+        """
+        Discard the precomputed scale and shift factors.
+        """
+        self._gamma = None
+        self._beta = None
+        
+    def forward(
+        self,
+        x: torch.Tensor,
+        context: Optional[torch.Tensor] = None,
+    ) -> torch.Tensor:
         """Forward pass.
 
         Args:
@@ -116,38 +150,44 @@ class FiLM(nn.Module):
                 C the number of channels and L the length of the line and B the
                 pseudo-batch size (each batch of lines will have its own scale and shift
                 factors).
-            context (torch.Tensor): Context vector. [B, D]. The same context vector is
-                used for all the lines of a same pseudo-batch. D is the dimension of the
-                context space.
+            context (torch.Tensor, optional): Context vector. [B, D]. The same context
+                vector is used for all the lines of a same pseudo-batch. D is the
+                dimension of the context space. If None, the scale and shift factors
+                precomputed with `set_context` are used. Defaults to None.
 
         Returns:
             torch.Tensor: Output tensor. Shape [BxN, C, L].
         
         Raises:
-            ValueError: If the number of lines and/or context vectors is invalid.
+            ValueError: If the number of lines and/or context vectors is invalid, or if
+                no context vector is given and none has been set.
         """
+        # Compute the scale and shift factors
+        if context is not None:
+            gamma = self._gamma_fc(context)
+            beta = self._beta_fc(context)
+        elif self._gamma is not None:
+            gamma = self._gamma
+            beta = self._beta
+        else:
+            raise ValueError("FiLM requires a context vector")
+        
         # We allow to use different context vectors for different lines
         # - If 1 context vector is provided, we duplicate it for all the lines of the
         # batch
         # - If multiple context vectors are provided, 1 context vector is used for
         # [total number of lines] / [number of context vectors] consecutive lines
-        if x.size(0) % context.size(0) != 0:
+        if x.size(0) % gamma.size(0) != 0:
             raise ValueError("Invalid number of lines and/or context vectors")
         
-        # Compute the scale and shift factors
-        gamma = self._gamma_fc(context)
-        beta = self._beta_fc(context)
-        
-        nb_lines_per_batch = x.size(0) // context.size(0)
+        nb_lines_per_batch = x.size(0) // gamma.size(0)
         
-        # Expand the gamma and beta vectors to match the number of lines in
-        # the batch
-        gamma = gamma.repeat_interleave(nb_lines_per_batch, 0).unsqueeze(2)
-        beta = beta.repeat_interleave(nb_lines_per_batch, 0).unsqueeze(2)
+        # Transform the lines of each pseudo-batch with their scale and shift factors
+        # (broadcasting, without duplicating the factors for every line)
+        x = x.reshape(gamma.size(0), nb_lines_per_batch, x.size(1), x.size(2))
+        x = gamma[:, None, :, None] * x + beta[:, None, :, None]
         
-        
-        # Transform the input tensor (broadcasting)
-        return gamma * x + beta  # [B, C, L]
+        return x.view(-1, x.size(2), x.size(3))  # [BxN, C, L]
 
 
 class ConvBlock1d(nn.Module):
@@ -240,31 +280,30 @@ class ConvBlock1d(nn.Module):
             torch.Tensor: Output tensor.
         
         Raises:
-            ValueError: If FiLM is used but no context vector is provided.
+            ValueError: If FiLM is used but no context vector is provided (nor
+                precomputed).
         """
         # First layer to adjust the number of channels if needed
+        # (FiLM layers use the precomputed scale and shift factors if no context
+        # vector is given, and raise an error if there are none)
         if self._first_conv is not None:
-            if len(self._conv_layers) == 0 and self._use_film and context is not None:
+            if len(self._conv_layers) == 0 and self._use_film:
                 for mod in self._first_conv:
                     x = mod(x, context) if isinstance(mod, FiLM) else mod(x)
-            elif len(self._conv_layers) > 0 or not self._use_film:
-                x = self._first_conv(x)
             else:
-                raise ValueError("FiLM requires a context vector")
+                x = self._first_conv(x)
         
         # Store the initial tensor to perform the residual connection if needed
         if self._use_residual:
             x_at_start = x.clone()
             
         # Apply the convolutional layers
-        if self._use_film and context is not None:
+        if self._use_film:
             for conv_layer in self._conv_layers:
                 for mod in conv_layer:
                     x = mod(x, context) if isinstance(mod, FiLM) else mod(x)
-        elif not self._use_film:
-            x = self._conv_layers(x)
         else:
-            raise ValueError("FiLM requires a context vector")
+            x = self._conv_layers(x)
         
         # Perform the residual connection if needed
         if self._use_residual:
@@ -497,6 +536,42 @@ class UNet1d(nn.Module):
         # it is usually included in the loss function to ensure numerical stability
         self._output_activation = nn.Identity() if output_logits else nn.Sigmoid()
         
+    def _film_layers(self) -> list[FiLM]:
+        """Get the FiLM layers of the network.
+
+        Returns:
+            list[FiLM]: The FiLM layers.
+        """
+        return [module for module in self.modules() if isinstance(module, FiLM)]
+    
+    @property
+    def has_context(self) -> bool:
+        """Whether the FiLM scale and shift factors have been precomputed.
+
+        Returns:
+            bool: True if `set_context` has been called (and not cleared).
+        """
+        film_layers = self._film_layers()
+        return len(film_layers) > 0 and all(film.has_context for film in film_layers)
+    
+    def set_context(self, context: torch.Tensor) -> None:
+        """Precompute the scale and shift factors of all the FiLM layers for a fixed
+        context, so that lines can then be segmented without giving the context
+        vectors (and without projecting them again).
+
+        Args:
+            context (torch.Tensor): Context vector for FiLM. Shape [B, D].
+        """
+        for film in self._film_layers():
+            film.set_context(context)
+    
+    def clear_context(self) -> None:
+        """
+        Discard the precomputed FiLM scale and shift factors.
+        """
+        for film in self._film_layers():
+            film.clear_context()
+    
     def forward(self, x: torch.Tensor, context: torch.Tensor = None) -> torch.Tensor:
         """Forward pass.
 
@@ -507,7 +582,8 @@ class UNet1d(nn.Module):
                 be processed as 2 pseudo-batches of 8 lines, since the context vector
                 is shared for all the lines of a same pseudo-batch).
             context (torch.Tensor, optional): Context vector for FiLM. Shape [B, D].
-                Defaults to None.
+                If None, the factors precomputed with `set_context` are used. Defaults
+                to None.
 
         Raises:
             ValueError: If the width of the input tensor is not divisible by the scale
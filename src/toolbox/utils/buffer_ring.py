@@ -0,0 +1,154 @@
+"""
+Ring of preallocated tensor buffers. Batches are collated by writing the samples
+directly into the next buffer of the ring, which avoids allocating (and pinning) new
+tensors for every batch.
+"""
+# Standard libraries
+from typing import Dict, Optional, Tuple
+
+# Third-party libraries
+import torch
+
+
+# Shape and data type of a named buffer
+BufferSpec = Tuple[Tuple[int, ...], torch.dtype]
+
+
+class BufferRing:
+    """
+    A fixed number of sets of named tensors that are handed out in turn. A set of
+    buffers is reused once all the other sets of the ring have been handed out, so the
+    number of buffers must be larger than the number of batches that can be alive at
+    the same time (batches prefetched by the DataLoader plus the one being consumed).
+    """
+    def __init__(self, nb_buffers: int = 4, pin_memory: bool = True) -> None:
+        """Constructor.
+
+        Args:
+            nb_buffers (int, optional): Number of sets of buffers in the ring.
+                Defaults to 4.
+            pin_memory (bool, optional): Whether to allocate the buffers in page-locked
+                memory. Only honored in the main process when CUDA is available; in
+                DataLoader worker processes the buffers are allocated in shared memory
+                instead so that batches are sent to the main process without being
+                copied. Defaults to True.
+
+        Raises:
+            ValueError: If the number of buffers is less than 2.
+        """
+        if nb_buffers < 2:
+            raise ValueError(
+                f"The ring must contain at least 2 buffers, got {nb_buffers}."
+            )
+
+        self._nb_buffers = nb_buffers
+        self._pin_memory = pin_memory
+
+        self._specs: Optional[Dict[str, BufferSpec]] = None
+        self._buffers = []
+        self._next_idx = 0
+
+    @property
+    def allocated(self) -> bool:
+        """Whether the buffers have been allocated.
+
+        Returns:
+            bool: True if the buffers have been allocated.
+        """
+        return self._specs is not None
+
+    @property
+    def specs(self) -> Optional[Dict[str, BufferSpec]]:
+        """Get the shapes and data types of the buffers.
+
+        Returns:
+            Optional[Dict[str, BufferSpec]]: Specifications of the buffers, or None if
+                they have not been allocated yet.
+        """
+        return self._specs
+
+    def _empty(self, shape: Tuple[int, ...], dtype: torch.dtype) -> torch.Tensor:
+        """Allocate a single buffer.
+
+        Args:
+            shape (Tuple[int, ...]): Shape of the buffer.
+            dtype (torch.dtype): Data type of the buffer.
+
+        Returns:
+            torch.Tensor: The (uninitialized) buffer.
+        """
+        # Tensors produced in worker processes are moved to shared memory when sent to
+        # the main process, allocate them there directly to avoid this copy
+        if torch.utils.data.get_worker_info() is not None:
+            return torch.empty(shape, dtype=dtype).share_memory_()
+
+        if self._pin_memory and torch.cuda.is_available():
+            return torch.empty(shape, dtype=dtype, pin_memory=True)
+
+        return torch.empty(shape, dtype=dtype)
+
+    def allocate(self, specs: Dict[str, BufferSpec]) -> None:
+        """Allocate the sets of buffers of the ring.
+
+        Args:
+            specs (Dict[str, BufferSpec]): Shape and data type of each named buffer.
+        """
+        self._specs = dict(specs)
+        self._buffers = [
+            {
+                name: self._empty(shape, dtype)
+                for name, (shape, dtype) in self._specs.items()
+            }
+            for _ in range(self._nb_buffers)
+        ]
+        self._next_idx = 0
+
+    def matches(self, name: str, shape: Tuple[int, ...], dtype: torch.dtype) -> bool:
+        """Check whether an item of the given shape and data type fits in a row of a
+        buffer.
+
+        Args:
+            name (str): Name of the buffer.
+            shape (Tuple[int, ...]): Shape of the item (without the batch dimension).
+            dtype (torch.dtype): Data type of the item.
+
+        Returns:
+            bool: True if the item can be written in the buffer.
+        """
+        if self._specs is None or name not in self._specs:
+            return False
+
+        buffer_shape, buffer_dtype = self._specs[name]
+
+        return tuple(buffer_shape[1:]) == tuple(shape) and buffer_dtype == dtype
+
+    def next(self) -> Dict[str, torch.Tensor]:
+        """Hand out the next set of buffers of the ring.
+
+        Raises:
+            RuntimeError: If the buffers have not been allocated.
+
+        Returns:
+            Dict[str, torch.Tensor]: The set of buffers.
+        """
+        if not self.allocated:
+            raise RuntimeError("The buffers of the ring have not been allocated.")
+
+        buffers = self._buffers[self._next_idx]
+        self._next_idx = (self._next_idx + 1) % self._nb_buffers
+
+        return buffers
+
+    def __getstate__(self) -> dict:
+        """Drop the buffers when the ring is pickled (e.g. sent to a DataLoader worker
+        process): each process allocates its own ring.
+
+        Returns:
+            dict: The state of the ring.
+        """
+        state = self.__dict__.copy()
+        state["_specs"] = None
+        state["_buffers"] = []
+        state["_next_idx"] = 0
+
+        return state
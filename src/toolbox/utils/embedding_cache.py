@@ -0,0 +1,206 @@
+"""
+Cache of image embeddings keyed by the content of the images. Encoding an image with a
+large backbone (e.g. the image encoder of MobileSAM) is much more expensive than
+hashing it, so the embeddings of images already seen (e.g. when an evaluation is run
+again with another segmentation model) are kept in a bounded in-memory LRU cache and,
+optionally, in a directory of files which persists across runs.
+"""
+# Standard libraries
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional, Sequence, Union
+import hashlib
+import os
+
+# Third-party libraries
+import torch
+
+
+class EmbeddingCache:
+    """
+    LRU cache of embeddings keyed by a digest of the image they are computed from, of
+    the input size of the encoder and of a namespace (e.g. the encoder weights). The
+    least recently used embeddings are evicted from memory when the number of entries
+    exceeds the limit, and remain on disk if a directory is given.
+    """
+    def __init__(
+        self,
+        max_entries: int = 0,
+        cache_dir: Optional[str] = None,
+        namespace: str = "",
+    ) -> None:
+        """Constructor.
+
+        Args:
+            max_entries (int, optional): Maximum number of embeddings kept in memory.
+                Defaults to 0.
+            cache_dir (Optional[str], optional): Directory in which the embeddings are
+                also saved. If None, they are only kept in memory. Defaults to None.
+            namespace (str, optional): String included in the keys, separating the
+                embeddings of different encoders. Defaults to "".
+        """
+        self._max_entries = max_entries
+        self._namespace = namespace
+
+        self._dir = None
+        if cache_dir is not None:
+            self._dir = Path(cache_dir)
+            self._dir.mkdir(parents=True, exist_ok=True)
+
+        self._embeddings: OrderedDict[str, torch.Tensor] = OrderedDict()
+
+        self.nb_hits = 0
+        self.nb_disk_hits = 0
+        self.nb_misses = 0
+
+    def __len__(self) -> int:
+        """Get the number of embeddings in memory.
+
+        Returns:
+            int: Number of embeddings in memory.
+        """
+        return len(self._embeddings)
+
+    def make_key(
+        self,
+        image: torch.Tensor,
+        input_size: Sequence[int],
+        region: Optional[Sequence[float]] = None,
+    ) -> str:
+        """Make the key of the embedding of an image.
+
+        Args:
+            image (torch.Tensor): The image (as given to the model, before any
+                resizing), of shape (C, H, W).
+            input_size (Sequence[int]): Size of the image at the input of the encoder.
+            region (Optional[Sequence[float]], optional): Region of the image which is
+                encoded, if not the whole image. Defaults to None.
+
+        Returns:
+            str: The key.
+        """
+        image = image.detach().cpu().contiguous()
+
+        digest = hashlib.sha1()
+        digest.update(self._namespace.encode())
+        digest.update(
+            f"{tuple(image.shape)} {image.dtype} {tuple(input_size)}".encode()
+        )
+        if region is not None:
+            digest.update(str([round(float(v), 3) for v in region]).encode())
+        digest.update(image.numpy().tobytes())
+
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> Path:
+        """Get the path of the file of an embedding.
+
+        Args:
+            key (str): Key of the embedding.
+
+        Returns:
+            Path: Path of the file.
+        """
+        return self._dir / key[:2] / f"{key}.pt"
+
+    def _add(self, key: str, embedding: torch.Tensor) -> None:
+        """Add an embedding to the in-memory cache.
+
+        Args:
+            key (str): Key of the embedding.
+            embedding (torch.Tensor): The embedding.
+        """
+        if self._max_entries <= 0:
+            return
+
+        self._embeddings[key] = embedding
+        self._embeddings.move_to_end(key)
+
+        while len(self._embeddings) > self._max_entries:
+            self._embeddings.popitem(last=False)
+
+    def get(
+        self,
+        key: str,
+        device: Union[str, torch.device] = "cpu",
+    ) -> Optional[torch.Tensor]:
+        """Get an embedding.
+
+        Args:
+            key (str): Key of the embedding.
+            device (Union[str, torch.device], optional): Device on which the embedding
+                is needed. Defaults to "cpu".
+
+        Returns:
+            Optional[torch.Tensor]: The embedding, or None if it is not in the cache.
+        """
+        embedding = self._embeddings.get(key)
+
+        if embedding is not None:
+            self.nb_hits += 1
+            self._embeddings.move_to_end(key)
+            return embedding.to(device)
+
+        if self._dir is not None:
+            path = self._path(key)
+
+            try:
+                embedding = torch.load(path, map_location=device)
+            except (OSError, RuntimeError):
+                # Missing (or partially written) file
+                embedding = None
+
+            if embedding is not None:
+                self.nb_disk_hits += 1
+                self._add(key, embedding)
+                return embedding
+
+        self.nb_misses += 1
+
+        return None
+
+    def put(self, key: str, embedding: torch.Tensor) -> None:
+        """Add an embedding to the cache.
+
+        Args:
+            key (str): Key of the embedding.
+            embedding (torch.Tensor): The embedding.
+        """
+        # Copy the embedding so that the cache does not keep the whole batch it is a
+        # view of alive
+        embedding = embedding.detach().clone()
+
+        self._add(key, embedding)
+
+        if self._dir is not None:
+            path = self._path(key)
+            path.parent.mkdir(exist_ok=True)
+
+            # Write in a temporary file first so that a partial file is never read
+            tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+            torch.save(embedding.cpu(), tmp_path)
+            tmp_path.replace(path)
+
+    def stats(self) -> Dict[str, float]:
+        """Get the statistics of the cache.
+
+        Returns:
+            Dict[str, float]: Number of hits (in memory and on disk) and misses, hit
+                rate and number of entries in memory.
+        """
+        nb_lookups = self.nb_hits + self.nb_disk_hits + self.nb_misses
+
+        return {
+            "nb_hits": float(self.nb_hits),
+            "nb_disk_hits": float(self.nb_disk_hits),
+            "nb_misses": float(self.nb_misses),
+            "hit_rate": (self.nb_hits + self.nb_disk_hits) / nb_lookups
+            if nb_lookups > 0 else 0.0,
+            "nb_entries": float(len(self._embeddings)),
+        }
+
+    def clear(self) -> None:
+        """
+        Empty the in-memory cache (the files and the statistics are kept).
+        """
+        self._embeddings.clear()
@@ -0,0 +1,22 @@
+"""
+Information about the git repository the code runs from, recorded along with the
+results of the benchmarks so that they can be compared across commits.
+"""
+# Standard libraries
+from typing import Optional
+import subprocess
+
+
+def get_commit_hash() -> Optional[str]:
+    """Get the hash of the current git commit.
+
+    Returns:
+        Optional[str]: The commit hash, or None if it cannot be retrieved.
+    """
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"],
+            stderr=subprocess.DEVNULL,
+        ).decode().strip()
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return None
@@ -0,0 +1,90 @@
+"""
+Measurement of the latency of a function (e.g. a module applied to a batch) on CPU or
+GPU, after a few warmup calls, reported as quantiles along with the peak memory.
+"""
+# Standard libraries
+from typing import Any, Callable, Dict, Sequence, Union
+import resource
+import time
+
+# Third-party libraries
+import numpy as np
+import torch
+
+
+def synchronize(device: Union[str, torch.device]) -> None:
+    """Wait for the kernels queued on a device to complete.
+
+    Args:
+        device (Union[str, torch.device]): The device.
+    """
+    if torch.device(device).type == "cuda":
+        torch.cuda.synchronize(device)
+
+
+def max_rss_mib() -> float:
+    """Get the peak resident memory of the current process.
+
+    Returns:
+        float: Peak resident memory (in MiB).
+    """
+    # Kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
+
+
+def measure_latency(
+    fn: Callable[[], Any],
+    device: Union[str, torch.device] = "cpu",
+    nb_warmup_iterations: int = 5,
+    nb_iterations: int = 50,
+    quantiles: Sequence[float] = (0.5, 0.99),
+) -> Dict[str, float]:
+    """Measure the latency of a function.
+
+    Args:
+        fn (Callable[[], Any]): Function to call (without arguments).
+        device (Union[str, torch.device], optional): Device on which the function
+            runs (its kernels are waited for before stopping the clock). Defaults to
+            "cpu".
+        nb_warmup_iterations (int, optional): Number of calls before measuring (lazy
+            initializations, allocator and cuDNN autotuning). Defaults to 5.
+        nb_iterations (int, optional): Number of measured calls. Defaults to 50.
+        quantiles (Sequence[float], optional): Quantiles of the latency to report.
+            Defaults to (0.5, 0.99).
+
+    Returns:
+        Dict[str, float]: Mean latency ("mean_ms") and quantiles ("p50_ms", ...) in
+            milliseconds, peak resident memory of the process ("max_rss_mib") and,
+            on GPU, peak memory allocated during the measured calls
+            ("peak_cuda_mib").
+    """
+    is_cuda = torch.device(device).type == "cuda"
+
+    for _ in range(nb_warmup_iterations):
+        fn()
+    synchronize(device)
+
+    if is_cuda:
+        torch.cuda.reset_peak_memory_stats(device)
+
+    latencies = np.empty(nb_iterations)
+
+    for i in range(nb_iterations):
+        start = time.perf_counter()
+        fn()
+        synchronize(device)
+        latencies[i] = time.perf_counter() - start
+
+    latencies *= 1000
+
+    results = {"mean_ms": float(latencies.mean())}
+
+    for quantile in quantiles:
+        results[f"p{100 * quantile:g}_ms"] = float(np.quantile(latencies, quantile))
+
+    results["max_rss_mib"] = max_rss_mib()
+
+    if is_cuda:
+        results["peak_cuda_mib"] = torch.cuda.max_memory_allocated(device) / 2**20
+
+    return results
@@ -0,0 +1,221 @@
+"""
+Bounded LRU cache of the meshes of rigid objects. Meshes are loaded (and scaled) the
+first time an object is rendered, and kept in memory as long as they fit in the cache,
+so that rendering a batch whose objects are already resident does not parse any file.
+"""
+# Standard libraries
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple, Union
+
+# Third-party libraries
+import torch
+from pytorch3d.structures import Meshes, join_meshes_as_batch
+
+# Custom modules
+from toolbox.datasets.object_set import RigidObjectSet
+from toolbox.datasets.baked_mesh import load_scaled_mesh
+
+
+def meshes_nbytes(meshes: Meshes) -> int:
+    """Get the memory footprint of the vertices and faces of meshes.
+
+    Args:
+        meshes (Meshes): The meshes.
+
+    Returns:
+        int: Number of bytes used by the vertices and faces.
+    """
+    verts = meshes.verts_packed()
+    faces = meshes.faces_packed()
+
+    return verts.numel() * verts.element_size() + faces.numel() * faces.element_size()
+
+
+class MeshCache:
+    """
+    LRU cache of scaled meshes keyed by object label and level of detail. The least
+    recently used meshes are evicted when the number of entries or the number of bytes
+    exceeds the limits.
+    """
+    def __init__(
+        self,
+        object_set: RigidObjectSet,
+        max_entries: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+    ) -> None:
+        """Constructor.
+
+        Args:
+            object_set (RigidObjectSet): Object set containing the objects whose meshes
+                are cached.
+            max_entries (Optional[int], optional): Maximum number of meshes in the
+                cache. If None, the number of entries is not limited. Defaults to None.
+            max_bytes (Optional[int], optional): Maximum memory footprint of the cached
+                meshes (vertices and faces). If None, the memory is not limited.
+                Defaults to None.
+        """
+        self._object_set = object_set
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+
+        self._meshes: OrderedDict[Tuple[str, int], Meshes] = OrderedDict()
+        self._nbytes: Dict[Tuple[str, int], int] = {}
+        self._total_nbytes = 0
+
+        self.nb_hits = 0
+        self.nb_misses = 0
+        self.nb_evictions = 0
+
+    def __len__(self) -> int:
+        """Get the number of meshes in the cache.
+
+        Returns:
+            int: Number of cached meshes.
+        """
+        return len(self._meshes)
+
+    def __contains__(self, key: Union[str, Tuple[str, int]]) -> bool:
+        """Check whether the mesh of an object is in the cache.
+
+        Args:
+            key (Union[str, Tuple[str, int]]): Label of the object (full mesh), or
+                label and level of detail.
+
+        Returns:
+            bool: True if the mesh is cached.
+        """
+        if isinstance(key, str):
+            key = (key, 0)
+
+        return key in self._meshes
+
+    @property
+    def nbytes(self) -> int:
+        """Get the memory footprint of the cached meshes.
+
+        Returns:
+            int: Number of bytes used by the cached meshes.
+        """
+        return self._total_nbytes
+
+    def _load(self, label: str, lod: int = 0) -> Meshes:
+        """Load the scaled mesh of an object (from its baked file if any).
+
+        Args:
+            label (str): Label of the object.
+            lod (int, optional): Level of detail of the mesh (0 for the full mesh).
+                Defaults to 0.
+
+        Returns:
+            Meshes: The mesh of the object.
+        """
+        verts, faces = load_scaled_mesh(self._object_set[label], lod=lod)
+
+        return Meshes(verts=[verts], faces=[faces])
+
+    def _evict(self) -> None:
+        """
+        Evict the least recently used meshes until the cache fits in its limits.
+        """
+        while self._meshes and (
+            (self._max_entries is not None and len(self._meshes) > self._max_entries)
+            or (self._max_bytes is not None and self._total_nbytes > self._max_bytes)
+        ):
+            key, _ = self._meshes.popitem(last=False)
+            self._total_nbytes -= self._nbytes.pop(key)
+            self.nb_evictions += 1
+
+    def get(
+        self,
+        label: str,
+        device: Union[str, torch.device] = "cpu",
+        lod: int = 0,
+    ) -> Meshes:
+        """Get the mesh of an object, loading it if it is not in the cache.
+
+        Args:
+            label (str): Label of the object.
+            device (Union[str, torch.device], optional): Device on which the mesh is
+                needed. The cached mesh is kept on the last requested device. Defaults
+                to "cpu".
+            lod (int, optional): Level of detail of the mesh (0 for the full mesh).
+                Defaults to 0.
+
+        Returns:
+            Meshes: The scaled mesh of the object.
+        """
+        key = (label, lod)
+        mesh = self._meshes.get(key)
+
+        if mesh is not None:
+            self.nb_hits += 1
+            self._meshes.move_to_end(key)
+        else:
+            self.nb_misses += 1
+            mesh = self._load(label, lod=lod)
+            self._meshes[key] = mesh
+            self._nbytes[key] = meshes_nbytes(mesh)
+            self._total_nbytes += self._nbytes[key]
+
+        # No-op if the mesh is already on the device
+        if mesh.device != torch.device(device):
+            mesh = mesh.to(device)
+            self._meshes[key] = mesh
+
+        self._evict()
+
+        return mesh
+
+    def get_batch(
+        self,
+        labels: List[str],
+        device: Union[str, torch.device] = "cpu",
+        lods: Optional[List[int]] = None,
+    ) -> Meshes:
+        """Get the meshes of a batch of objects.
+
+        Args:
+            labels (List[str]): Labels of the objects of the batch (possibly repeated).
+            device (Union[str, torch.device], optional): Device on which the meshes are
+                needed. Defaults to "cpu".
+            lods (Optional[List[int]], optional): Level of detail of the mesh of each
+                object. If None, the full meshes are used. Defaults to None.
+
+        Returns:
+            Meshes: Batch of meshes, the i-th mesh being the one of the i-th label.
+        """
+        keys = list(zip(labels, lods if lods is not None else [0] * len(labels)))
+
+        # Each distinct mesh is looked up once per batch
+        meshes = {}
+        for label, lod in keys:
+            if (label, lod) not in meshes:
+                meshes[(label, lod)] = self.get(label, device=device, lod=lod)
+
+        return join_meshes_as_batch([meshes[key] for key in keys])
+
+    def stats(self) -> Dict[str, float]:
+        """Get the statistics of the cache.
+
+        Returns:
+            Dict[str, float]: Number of hits, misses and evictions, hit rate, number
+                of entries and memory footprint.
+        """
+        nb_lookups = self.nb_hits + self.nb_misses
+
+        return {
+            "nb_hits": float(self.nb_hits),
+            "nb_misses": float(self.nb_misses),
+            "nb_evictions": float(self.nb_evictions),
+            "hit_rate": self.nb_hits / nb_lookups if nb_lookups > 0 else 0.0,
+            "nb_entries": float(len(self._meshes)),
+            "nbytes": float(self._total_nbytes),
+        }
+
+    def clear(self) -> None:
+        """
+        Empty the cache (the statistics are kept).
+        """
+        self._meshes.clear()
+        self._nbytes.clear()
+        self._total_nbytes = 0